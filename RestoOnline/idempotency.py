@@ -0,0 +1,241 @@
+# ===================================
+# RestoOnline/idempotency.py
+# ===================================
+
+"""
+Idempotence des endpoints POST via l'en-tête `Idempotency-Key`.
+
+Une requête rejouée avec la même clé est servie depuis le stockage sans
+ré-exécuter la logique métier. Les doublons concurrents attendent la fin
+de la première requête puis reçoivent sa réponse.
+
+Par défaut le stockage est propre au processus : un réessai qui arrive sur
+un autre worker est ré-exécuté. Avec plusieurs processus, IDEMPOTENCY['CACHE']
+désigne un cache Django partagé (Redis, Memcached, base de données) qui
+porte les réponses et la réservation des clés (`cache.add`).
+"""
+
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, default)
+
+
+class StoredResponse:
+    """Réponse mémorisée pour une clé d'idempotence"""
+    __slots__ = ('fingerprint', 'status_code', 'data', 'expires_at')
+
+    def __init__(self, fingerprint, status_code, data, expires_at):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.data = data
+        self.expires_at = expires_at
+
+
+class SharedWait:
+    """Attente d'une requête en cours dans un autre processus (cache partagé)"""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.store.get(self.key) is not None or not self.store.in_flight(self.key):
+                return True
+            time.sleep(0.05)
+        return False
+
+
+class IdempotencyStore:
+    """Stockage LRU borné des réponses, avec expiration et verrou par clé"""
+
+    def __init__(self, max_entries=10000, ttl=86400, cache_alias=None, lock_timeout=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._mutex = threading.Lock()
+
+    @property
+    def _shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @staticmethod
+    def _cache_key(key, kind='response'):
+        # Clés bornées et sans caractères interdits par Memcached
+        return f"idempotency:{kind}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def in_flight(self, key):
+        shared = self._shared
+        if shared is not None:
+            return shared.get(self._cache_key(key, 'lock')) is not None
+        with self._mutex:
+            return key in self._in_flight
+
+    def _lookup(self, key):
+        shared = self._shared
+        if shared is not None:
+            return shared.get(self._cache_key(key))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._mutex:
+            return self._lookup(key)
+
+    def begin(self, key):
+        """
+        Réserver une clé. Retourne (entry, event) :
+        - entry non nul : réponse déjà stockée
+        - event nul : l'appelant est propriétaire et doit appeler `finish`
+        - event non nul : une requête identique est en cours, attendre l'event
+        """
+        shared = self._shared
+        if shared is not None:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry, None
+            # Réservation atomique entre processus; expire si le propriétaire disparaît
+            if shared.add(self._cache_key(key, 'lock'), 1, timeout=self.lock_timeout):
+                return None, None
+            return None, SharedWait(self, key)
+
+        with self._mutex:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry, None
+            event = self._in_flight.get(key)
+            if event is None:
+                self._in_flight[key] = threading.Event()
+            return None, event
+
+    def finish(self, key, entry=None):
+        """Stocker la réponse (si fournie) et libérer les requêtes en attente"""
+        shared = self._shared
+        if shared is not None:
+            if entry is not None:
+                shared.set(self._cache_key(key), entry, timeout=self.ttl)
+            shared.delete(self._cache_key(key, 'lock'))
+            return
+
+        with self._mutex:
+            if entry is not None:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def clear(self):
+        with self._mutex:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+store = IdempotencyStore(
+    max_entries=_get_setting('MAX_ENTRIES', 10000),
+    ttl=_get_setting('TTL', 86400),
+    cache_alias=_get_setting('CACHE', None),
+    lock_timeout=_get_setting('LOCK_TIMEOUT', 10),
+)
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _client_scope(request):
+    """
+    Propriétaire de la clé : l'utilisateur authentifié, sinon l'appareil
+    (`device_id` du body ou de la query), sinon l'adresse IP du client.
+    Deux clients anonymes qui choisissent la même clé ne partagent pas de réponse.
+    """
+    if request.user and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    data = request.data if hasattr(request.data, 'get') else {}
+    device_id = data.get('device_id') or request.query_params.get('device_id')
+    if device_id:
+        return f"device:{device_id}"
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+def _replay(entry, fingerprint):
+    if entry.fingerprint != fingerprint:
+        return Response(
+            {'error': "Clé d'idempotence déjà utilisée avec une requête différente"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(entry.data, status=entry.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view_method):
+    """
+    Décorateur pour les méthodes de ViewSet (create ou @action POST).
+    Sans en-tête `Idempotency-Key`, la requête est traitée normalement.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        scoped_key = f"{request.method}:{request.path}:{_client_scope(request)}:{key}"
+        fingerprint = _fingerprint(request)
+
+        entry, event = store.begin(scoped_key)
+        if entry is not None:
+            return _replay(entry, fingerprint)
+
+        if event is not None:
+            # Doublon concurrent : attendre la première requête
+            event.wait(_get_setting('LOCK_TIMEOUT', 10))
+            entry = store.get(scoped_key)
+            if entry is not None:
+                return _replay(entry, fingerprint)
+            return Response(
+                {'error': 'Une requête avec cette clé est déjà en cours de traitement'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        entry = None
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            # Les erreurs serveur ne sont pas mémorisées pour permettre un nouvel essai
+            if response.status_code < 500:
+                entry = StoredResponse(
+                    fingerprint, response.status_code, response.data,
+                    time.monotonic() + store.ttl
+                )
+            return response
+        finally:
+            store.finish(scoped_key, entry)
+
+    return wrapper
@@ -77,6 +77,70 @@ SIMPLE_JWT = {
     'UPDATE_LAST_LOGIN': True,
 }
 
+# Idempotence des POST (en-tête Idempotency-Key)
+IDEMPOTENCY = {
+    'TTL': 24 * 60 * 60,  # Durée de conservation des réponses (secondes)
+    'MAX_ENTRIES': 10000,  # Nombre maximum de réponses conservées
+    'LOCK_TIMEOUT': 10,  # Attente maximale d'un doublon concurrent (secondes)
+    # Alias de cache partagé (ex: 'default' avec Redis). None : stockage propre au
+    # processus, un réessai qui arrive sur un autre worker est ré-exécuté
+    'CACHE': None,
+}
+
+# Moteur de tarification (orders/pricing.py)
+PRICING = {
+    'TABLE_TTL': 60,  # Recompilation maximale de la table des prix (secondes)
+    'FREE_DELIVERY_OVER': None,  # Livraison offerte à partir de ce sous-total
+    # Ex: {'start': '15:00', 'end': '17:00', 'percent': 10, 'categories': ['boissons'], 'weekdays': [0, 1, 2, 3, 4]}
+    'HAPPY_HOURS': [],
+    # Ex: {'BIENVENUE': {'kind': 'percent', 'value': 10, 'min_subtotal': 5000}}
+    'PROMO_CODES': {},
+}
+
+# Suivi GPS des livreurs (delivery/ingest.py)
+DELIVERY_TRACKING = {
+    'FLUSH_SIZE': 200,  # Écriture groupée dès ce nombre de points en attente
+    'FLUSH_INTERVAL': 2.0,  # Délai maximal avant écriture d'un point (secondes)
+    'MAX_RETRIES': 5,  # Nouvelles tentatives d'écriture d'un lot en échec avant abandon
+    'MAX_PENDING': 10000,  # Points en attente au-delà desquels les lots en échec les plus anciens sont abandonnés
+    'POSITION_TTL': 300,  # Expiration de la dernière position connue (secondes)
+    'MISS_TTL': 30,  # Mémorisation d'une affectation sans position (secondes, 0 = désactivé)
+    'POSITION_CACHE': None,  # Alias de cache partagé optionnel (ex: 'default' avec Redis)
+    'MAX_POSITIONS': 10000,  # Affectations conservées en mémoire au plus (LRU)
+    'FLEET_STATS_TTL': 30,  # Cache des statistiques de la flotte (secondes, 0 = désactivé)
+}
+
+DELIVERY_ZONES = {
+    'INDEX_TTL': 60,  # Reconstruction de l'index des zones au plus tard après (secondes)
+    'CELL_SIZE': 0.01,  # Taille des cellules de la grille en degrés (~1 km)
+}
+
+DELIVERY_ANALYTICS = {
+    'RELATIVE_ACCURACY': 0.01,  # Erreur relative des quantiles (1 %)
+    'PERSIST_INTERVAL': 60,  # Écriture des nouvelles observations en base (secondes)
+    'REFRESH_INTERVAL': 60,  # Relecture des distributions persistées (secondes)
+}
+
+DISPATCH = {
+    'REDISPATCH_ON_REFUSAL': True,  # Réaffecter automatiquement une commande refusée (False : réaffectation manuelle)
+    'MAX_ACTIVE_PER_DRIVER': 2,  # Livraisons simultanées par livreur
+    'CANDIDATES': 8,  # Livreurs les plus proches considérés par commande
+    'MAX_DISTANCE_KM': 15,
+    'TIME_BUDGET_MS': 200,  # Au-delà, les commandes restantes sont affectées en glouton
+    'REFUSAL_WINDOW_DAYS': 7,
+    'DEPOT': None,  # Position du restaurant (latitude, longitude), départ des tournées
+    'RUN_MAX_STOPS': 3,  # Commandes par tournée
+    'RUN_RADIUS_KM': 2,  # Distance maximale entre commandes regroupées
+    'RUN_WINDOW_MINUTES': 15,  # Écart maximal entre heures de préparation
+    'WEIGHTS': {
+        'distance_km': 1.0,  # Par kilomètre
+        'load': 2.0,  # Par livraison déjà en cours
+        'rating': 0.5,  # Par point de note manquant (sur 5)
+        'refusal': 1.5,  # Par refus récent
+        'waiting': 0.1,  # Priorité par minute d'attente (plafonnée à 30 min)
+    },
+}
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
@@ -94,6 +158,61 @@ PAYDUNYA_MODE = 'test'  # 'test' ou 'live'
 
 SITE_URL = 'http://localhost:8000'
 
+# Passerelle de paiement (payments/gateway.py)
+PAYMENT_GATEWAY = {
+    'BACKEND': 'paydunya',  # 'paydunya' ou 'fake' (passerelle locale pour tests et mesures de charge)
+    'CONNECT_TIMEOUT': 3.05,  # Secondes
+    'READ_TIMEOUT': 10.0,
+    'POOL_SIZE': 10,  # Connexions keep-alive conservées par processus
+    'MAX_RETRIES': 2,  # Reprises (erreurs réseau; délais et 5xx uniquement pour les lectures)
+    'BACKOFF': 0.2,  # Délai de base des reprises, avec gigue (secondes)
+    'BREAKER_THRESHOLD': 5,  # Échecs consécutifs avant ouverture du disjoncteur
+    'BREAKER_RESET': 30.0,  # Durée d'ouverture du disjoncteur (secondes)
+    # Remboursements : mode de déboursement PayDunya par méthode de paiement
+    'WITHDRAW_MODES': {
+        'mtn_money': 'mtn-benin',
+        'moov_money': 'moov-benin',
+        'orange_money': 'orange-money-senegal',
+    },
+}
+
+# Annulations et remboursements en masse (payments/refunds.py)
+PAYMENT_REFUNDS = {
+    'BACKEND': 'thread',  # 'thread' (exécution locale), 'sync' (inline) ou 'none' (commande run_refund_jobs seule)
+    'WORKERS': 4,  # Remboursements simultanés auprès de la passerelle
+    'CHUNK_SIZE': 50,  # Commandes annulées par transaction
+}
+
+# Statistiques des paiements (payments/stats.py)
+PAYMENT_STATISTICS = {
+    'STATS_TTL': 30,  # Cache des statistiques (secondes, 0 = désactivé)
+}
+
+# Réconciliation des paiements en cours (payments/reconciliation.py)
+PAYMENT_RECONCILIATION = {
+    'STALE_AFTER': 120,  # Secondes sans changement avant vérification auprès de la passerelle
+    'RECHECK_INTERVAL': 60,  # Délai minimal entre deux vérifications d'un même paiement
+    'EXPIRE_AFTER': 86400,  # Facture toujours en attente après ce délai : paiement annulé
+    'BATCH_SIZE': 100,  # Paiements réservés par passage
+    'WORKERS': 8,  # Appels simultanés à la passerelle
+}
+
+# File de traitement des webhooks PayDunya (payments/webhooks.py)
+PAYMENT_WEBHOOKS = {
+    'BACKEND': 'thread',  # 'thread' (pool local), 'sync' (inline) ou 'none' (commande process_webhooks seule)
+    'WORKERS': 4,  # Webhooks traités simultanément
+    'BATCH_SIZE': 100,  # Webhooks réservés par passage de process_webhooks
+    'MAX_ATTEMPTS': 8,  # Au-delà, le webhook reste non traité (next_attempt_at vide)
+    'BACKOFF_BASE': 2,  # Délai avant nouvelle tentative : BACKOFF_BASE ** tentatives (secondes)
+    'BACKOFF_MAX': 600,
+    'LEASE_SECONDS': 60,  # Réservation d'un webhook par un worker
+    'ORDER_DELAY': 1,  # Report d'un événement tant qu'un précédent du même token est en attente (secondes)
+    'RETENTION_DAYS': 90,  # Webhooks traités conservés en base; au-delà : archive_webhooks
+    'ARCHIVE_DIR': BASE_DIR / 'archives' / 'webhooks',  # Archives JSON Lines compressées
+    'ARCHIVE_CHUNK': 1000,  # Webhooks par fichier d'archive
+    'VERIFY_SIGNATURE': True,  # Refuser les webhooks sans hash/signature dérivés de PAYDUNYA_MASTER_KEY
+}
+
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -0,0 +1,48 @@
+"""
+Outils de test partagés entre les applications.
+"""
+
+import os
+import sqlite3
+import tempfile
+from django.db import connection
+from django.test import TransactionTestCase
+
+
+class ThreadedTestCase(TransactionTestCase):
+    """
+    TransactionTestCase pour les tests qui accèdent à la base depuis plusieurs
+    threads. La base de test SQLite en mémoire partagée refuse les accès
+    concurrents ("database table is locked") au lieu d'attendre : le temps de
+    la classe, la base est copiée dans un fichier temporaire où les écritures
+    concurrentes attendent le verrou. Sans effet hors SQLite en mémoire.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._memory_db = None
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            cls._file_db_dir = tempfile.TemporaryDirectory()
+            path = os.path.join(cls._file_db_dir.name, 'test.sqlite3')
+            connection.ensure_connection()
+            target = sqlite3.connect(path)
+            connection.connection.backup(target)
+            target.close()
+            # La base en mémoire disparaît avec sa dernière connexion : la garder ouverte
+            cls._memory_db = (connection.settings_dict['NAME'], connection.connection)
+            connection.connection = None
+            connection.settings_dict['NAME'] = path
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            if cls._memory_db is not None:
+                name, keep_alive = cls._memory_db
+                connection.close()
+                connection.settings_dict['NAME'] = name
+                connection.ensure_connection()
+                keep_alive.close()
+                cls._file_db_dir.cleanup()
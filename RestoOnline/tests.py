@@ -0,0 +1,137 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status, viewsets
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from .idempotency import IdempotencyStore, StoredResponse, idempotent
+
+
+class EchoViewSet(viewsets.ViewSet):
+    """Vue de test : compte les exécutions et renvoie le body"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    calls = []
+    gate = None
+
+    @idempotent
+    def create(self, request):
+        self.calls.append(dict(request.data))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return Response({'call': len(self.calls), 'data': request.data}, status=status.HTTP_201_CREATED)
+
+
+class IdempotentDecoratorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = EchoViewSet.as_view({'post': 'create'})
+        EchoViewSet.calls = []
+        EchoViewSet.gate = None
+        patcher = mock.patch('RestoOnline.idempotency.store', IdempotencyStore())
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data, key='cle-1', ip='10.0.0.1', path='/api/echo/'):
+        request = self.factory.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY=key, REMOTE_ADDR=ip)
+        return self.view(request)
+
+    def test_replay_returns_stored_response(self):
+        first = self.post({'a': 1})
+        replay = self.post({'a': 1})
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay.data, first.data)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(EchoViewSet.calls), 1)
+
+    def test_different_body_with_same_key_is_rejected(self):
+        self.post({'a': 1})
+        response = self.post({'a': 2})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(EchoViewSet.calls), 1)
+
+    def test_anonymous_keys_scoped_by_device_then_ip(self):
+        self.post({'device_id': 'appareil-1'})
+        self.post({'device_id': 'appareil-2'})
+        self.assertEqual(len(EchoViewSet.calls), 2)
+
+        # Même appareil depuis une autre adresse : rejoué
+        replay = self.post({'device_id': 'appareil-1'}, ip='10.0.0.9')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        # Sans device_id : adresse IP du client
+        self.post({'a': 1}, ip='10.0.0.1')
+        self.post({'a': 1}, ip='10.0.0.2')
+        self.assertEqual(len(EchoViewSet.calls), 4)
+        self.assertEqual(self.post({'a': 1}, ip='10.0.0.2')['Idempotent-Replayed'], 'true')
+
+    def test_concurrent_duplicate_waits_for_first_request(self):
+        EchoViewSet.gate = threading.Event()
+        responses = {}
+        first = threading.Thread(target=lambda: responses.setdefault('first', self.post({'a': 1})))
+        first.start()
+        while not EchoViewSet.calls:
+            first.join(0.01)
+
+        duplicate = threading.Thread(target=lambda: responses.setdefault('duplicate', self.post({'a': 1})))
+        duplicate.start()
+        duplicate.join(0.2)
+        self.assertTrue(duplicate.is_alive())
+
+        EchoViewSet.gate.set()
+        first.join(5)
+        duplicate.join(5)
+
+        self.assertEqual(len(EchoViewSet.calls), 1)
+        self.assertEqual(responses['duplicate'].data, responses['first'].data)
+        self.assertEqual(responses['duplicate']['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCY={'LOCK_TIMEOUT': 0.1})
+    def test_concurrent_duplicate_times_out_with_409(self):
+        EchoViewSet.gate = threading.Event()
+        first = threading.Thread(target=self.post, args=({'a': 1},))
+        first.start()
+        while not EchoViewSet.calls:
+            first.join(0.01)
+
+        response = self.post({'a': 1})
+        EchoViewSet.gate.set()
+        first.join(5)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(EchoViewSet.calls), 1)
+
+
+class IdempotencyStoreTests(SimpleTestCase):
+
+    def entry(self, data):
+        return StoredResponse('empreinte', 201, data, float('inf'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        store = IdempotencyStore(max_entries=2)
+        for key in ('a', 'b'):
+            store.begin(key)
+            store.finish(key, self.entry(key))
+
+        # 'a' relue : 'b' devient la plus ancienne
+        self.assertEqual(store.get('a').data, 'a')
+        store.begin('c')
+        store.finish('c', self.entry('c'))
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual((store.get('a').data, store.get('c').data), ('a', 'c'))
+
+    def test_expired_entry_is_dropped(self):
+        store = IdempotencyStore()
+        store.begin('a')
+        store.finish('a', StoredResponse('empreinte', 201, 'a', 0))
+
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(len(store), 0)
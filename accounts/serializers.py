@@ -84,6 +84,9 @@ class ClientDeviceSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'first_seen', 'last_seen', 'order_count']
     
     def get_order_count(self, obj):
+        # Valeur annotée par la requête si disponible
+        if hasattr(obj, 'num_orders'):
+            return obj.num_orders
         return obj.orders.count()
 
 
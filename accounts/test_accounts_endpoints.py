@@ -144,7 +144,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/users/me/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -228,7 +228,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/users/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -255,7 +255,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/users/?user_type=delivery"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -323,7 +323,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/users/{self.test_user_id}/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -477,7 +477,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/delivery-persons/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -504,7 +504,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/delivery-persons/available/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -535,7 +535,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/delivery-persons/{self.test_delivery_id}/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
@@ -565,7 +565,7 @@ class AccountsEndpointTester:
         url = f"{self.base_url}/delivery-persons/{self.test_delivery_id}/statistics/"
         
         try:
-            response = requests.get(url, headers=self.get_headers())
+            response = requests.get(url, headers=self.get_headers(auth=False))
             
             if response.status_code == 200:
                 result = response.json()
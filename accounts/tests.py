@@ -1,3 +1,35 @@
-from django.test import TestCase
+import warnings
+from datetime import datetime
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from orders.models import Order
+from .models import ClientDevice
 
-# Create your tests here.
+
+class DeviceOrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.device = ClientDevice.objects.create(device_id='appareil-1')
+        for index, hour in enumerate((9, 11, 13)):
+            order = Order.objects.create(
+                order_number=f'HIST-{index}', device=self.device, delivery_address='Cotonou',
+                customer_name='Client', customer_phone='0100000000', subtotal=1000, total=1000
+            )
+            created_at = timezone.make_aware(datetime(2025, 1, 15, hour), timezone.get_fixed_timezone(60))
+            Order.objects.filter(id=order.id).update(created_at=created_at)
+        self.url = '/api/accounts/devices/appareil-1/orders/'
+
+    @override_settings(TIME_ZONE='Africa/Porto-Novo')
+    def test_since_without_offset_is_local_time(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            response = APIClient().get(self.url, {'since': '2025-01-15T10:00:00'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['order_number'] for order in response.data['results']], ['HIST-2', 'HIST-1'])
+
+    def test_invalid_since_is_rejected(self):
+        for since in ('hier', '2025-13-45T10:00:00', '2025-02-30T10:00:00Z'):
+            response = APIClient().get(self.url, {'since': since})
+            self.assertEqual(response.status_code, 400, since)
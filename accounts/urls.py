@@ -41,8 +41,10 @@ LIVREURS:
 - POST   /api/accounts/users/{id}/toggle_availability/   - Basculer disponibilité livreur
 - GET    /api/accounts/delivery-persons/                 - Liste des livreurs
 - GET    /api/accounts/delivery-persons/available/       - Livreurs disponibles
+- GET    /api/accounts/delivery-persons/nearest/         - Livreurs disponibles les plus proches
 - GET    /api/accounts/delivery-persons/{id}/            - Détails d'un livreur
 - GET    /api/accounts/delivery-persons/{id}/statistics/ - Statistiques d'un livreur
+- GET    /api/accounts/delivery-persons/fleet_statistics/ - Statistiques de toute la flotte
 
 APPAREILS CLIENTS:
 - GET    /api/accounts/devices/                          - Liste des appareils
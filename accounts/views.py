@@ -9,6 +9,9 @@ from django.utils.encoding import force_bytes, force_str
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User, ClientDevice
 from .serializers import (
@@ -246,30 +249,82 @@ class DeliveryPersonViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(available_drivers, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
+        """Livreurs disponibles les plus proches d'une commande ou d'un point"""
+        from delivery.geo import driver_index, warm_driver_index
+        from delivery.positions import POSITION_TTL
+        from orders.models import Order
+        
+        order_id = request.query_params.get('order')
+        try:
+            if order_id:
+                order = Order.objects.only(
+                    'delivery_latitude', 'delivery_longitude'
+                ).get(id=order_id)
+                latitude, longitude = order.delivery_latitude, order.delivery_longitude
+            else:
+                latitude = request.query_params.get('latitude')
+                longitude = request.query_params.get('longitude')
+            latitude, longitude = float(latitude), float(longitude)
+            k = min(int(request.query_params.get('k', 5)), 50)
+            max_distance_km = float(request.query_params.get('max_distance_km', 20))
+        except Order.DoesNotExist:
+            return Response(
+                {'error': 'Commande non trouvée'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Coordonnées de livraison requises (order ou latitude/longitude)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        warm_driver_index()
+        # Disponibilité vérifiée sur les seuls candidats de l'index (une requête id__in par
+        # passage); s'il en manque, nouveau passage plus large sans les indisponibles
+        drivers, unavailable, fetch = {}, set(), k * 2
+        while True:
+            candidates = driver_index.nearest(
+                latitude, longitude, k=fetch,
+                predicate=lambda driver_id: driver_id not in unavailable,
+                max_age=POSITION_TTL,
+                max_distance_m=max_distance_km * 1000
+            )
+            new_ids = [driver_id for _, driver_id, _, _ in candidates if driver_id not in drivers]
+            drivers.update(self.queryset.filter(is_available=True).in_bulk(new_ids))
+            unavailable.update(driver_id for driver_id in new_ids if driver_id not in drivers)
+            matches = [match for match in candidates if match[1] in drivers]
+            if len(matches) >= k or len(candidates) < fetch:
+                break
+            fetch *= 2
+        matches = matches[:k]
+        
+        return Response([
+            {
+                'distance_m': round(distance),
+                'latitude': driver_lat,
+                'longitude': driver_lon,
+                'delivery_person': DeliveryPersonSerializer(drivers[driver_id]).data
+            }
+            for distance, driver_id, driver_lat, driver_lon in matches
+        ])
+    
+    @action(detail=False, methods=['get'])
+    def fleet_statistics(self, request):
+        """Statistiques de tous les livreurs en quelques requêtes groupées"""
+        from delivery.stats import fleet_statistics
+        
+        fresh = request.query_params.get('fresh') in ('1', 'true')
+        return Response(fleet_statistics(use_cache=not fresh))
+    
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
         """Statistiques détaillées d'un livreur"""
-        driver = self.get_object()
-        from delivery.models import DeliveryAssignment
-        from ratings.models import DeliveryRating
-        
-        assignments = DeliveryAssignment.objects.filter(delivery_person=driver)
-        ratings = DeliveryRating.objects.filter(delivery_person=driver)
+        from delivery.stats import compute_driver_statistics
         
-        return Response({
-            'total_deliveries': driver.total_deliveries,
-            'average_rating': float(driver.average_rating),
-            'completed_deliveries': assignments.filter(status='delivered').count(),
-            'refused_deliveries': assignments.filter(status='refused').count(),
-            'total_ratings': ratings.count(),
-            'ratings_breakdown': {
-                '5_stars': ratings.filter(rating=5).count(),
-                '4_stars': ratings.filter(rating=4).count(),
-                '3_stars': ratings.filter(rating=3).count(),
-                '2_stars': ratings.filter(rating=2).count(),
-                '1_star': ratings.filter(rating=1).count(),
-            }
-        })
+        driver_id = self.get_object().id
+        return Response(compute_driver_statistics(driver_ids=[driver_id])[driver_id])
 
 
 class ClientDeviceViewSet(viewsets.ModelViewSet):
@@ -284,6 +339,9 @@ class ClientDeviceViewSet(viewsets.ModelViewSet):
             return ClientDeviceCreateSerializer
         return ClientDeviceSerializer
     
+    def get_queryset(self):
+        return ClientDevice.objects.annotate(num_orders=Count('orders'))
+    
     @action(detail=False, methods=['post'])
     def register(self, request):
         """Enregistrer ou récupérer un appareil client"""
@@ -330,9 +388,45 @@ class ClientDeviceViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def orders(self, request, device_id=None):
-        """Historique des commandes d'un appareil"""
-        device = self.get_object()
-        from orders.serializers import OrderListSerializer
-        orders = device.orders.all()
-        serializer = OrderListSerializer(orders, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        """Historique paginé des commandes d'un appareil"""
+        from orders.models import Order
+        from orders.pagination import OrderHistoryPagination
+        from orders.serializers import OrderHistorySerializer
+        
+        device_pk = ClientDevice.objects.filter(
+            device_id=device_id
+        ).values_list('pk', flat=True).first()
+        if device_pk is None:
+            return Response(
+                {'error': 'Appareil non trouvé'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Filtrer sur la clé étrangère pour profiter de l'index (device_id, created_at)
+        orders = Order.objects.filter(device_id=device_pk)
+        
+        # Ne renvoyer que les commandes plus récentes que `since`
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since_dt = parse_datetime(since)
+            except ValueError:  # Format valide mais date impossible (ex: 2025-13-45)
+                since_dt = None
+            if since_dt is None:
+                return Response(
+                    {'error': 'Paramètre since invalide (format ISO 8601 attendu)'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # Sans fuseau : heure locale du serveur (TIME_ZONE)
+            if timezone.is_naive(since_dt):
+                since_dt = timezone.make_aware(since_dt)
+            orders = orders.filter(created_at__gt=since_dt)
+        
+        orders = orders.annotate(num_items=Count('items')).only(
+            'id', 'order_number', 'status', 'total', 'created_at', 'delivered_at'
+        )
+        
+        paginator = OrderHistoryPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = OrderHistorySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
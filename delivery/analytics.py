@@ -0,0 +1,454 @@
+# ===================================
+# delivery/analytics.py
+# ===================================
+
+"""
+Distributions des durées d'étape des livraisons (p50/p95...) par livreur,
+par heure de commande et par zone.
+
+Chaque durée alimente un sketch de quantiles à erreur relative bornée
+(intervalles logarithmiques, type DDSketch) : quelques centaines de
+compteurs par distribution, fusionnables par simple addition. Les
+livraisons terminées sont ajoutées en mémoire au fil de l'eau; les
+observations locales sont fusionnées en base toutes les
+DELIVERY_ANALYTICS['PERSIST_INTERVAL'] secondes et l'état persisté est
+relu toutes les REFRESH_INTERVAL secondes (ou après un recalcul complet),
+ce qui permet à plusieurs processus d'alimenter les mêmes distributions.
+
+Un recalcul complet enregistre en base, avec les distributions remplacées,
+une nouvelle version et sa date de coupure (DeliveryAnalyticsState).
+Chaque processus relit cet état avant d'écrire : il oublie ses
+observations non écrites livrées avant la coupure, déjà comptées par le
+recalcul. La fusion est refusée si la coupure a changé entre la lecture
+et l'écriture (ligne d'état verrouillée).
+"""
+
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# (étape, horodatage de début, horodatage de fin) sur Order
+STAGES = (
+    ('acceptance', 'created_at', 'accepted_at'),
+    ('preparation', 'accepted_at', 'ready_at'),
+    ('dispatch', 'ready_at', 'assigned_at'),
+    ('pickup', 'assigned_at', 'picked_up_at'),
+    ('transit', 'picked_up_at', 'delivered_at'),
+    ('total', 'created_at', 'delivered_at'),
+)
+STAGE_NAMES = tuple(stage for stage, _, _ in STAGES)
+TIMESTAMP_FIELDS = ('created_at', 'accepted_at', 'ready_at', 'assigned_at', 'picked_up_at', 'delivered_at')
+DIMENSIONS = ('all', 'driver', 'hour', 'zone')
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DELIVERY_ANALYTICS', {}).get(name, default)
+
+
+class QuantileSketch:
+    """
+    Sketch de quantiles à erreur relative `relative_accuracy` : une valeur x
+    tombe dans l'intervalle k = ceil(log_gamma(x)), gamma = (1 + a) / (1 - a).
+    Au-delà de `max_bins` intervalles, les plus bas sont regroupés (seuls les
+    petits quantiles perdent alors en précision).
+    """
+    MIN_VALUE = 1e-3  # En dessous : compté comme zéro
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy doit être dans ]0, 1[")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        if value < self.MIN_VALUE:
+            self.zero_count += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        overflow = keys[:len(keys) - self.max_bins + 1]
+        target = keys[len(overflow)]
+        self.bins[target] += sum(self.bins.pop(key) for key in overflow)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Impossible de fusionner des sketches de précisions différentes")
+        if not other.count:
+            return self
+        for key, weight in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + weight
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Valeur au quantile q (0..1), ou None si le sketch est vide"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Nombre, moyenne et quantiles en secondes"""
+        if not self.count:
+            return {'count': 0}
+        data = {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 1),
+            'min': round(self.min, 1),
+            'max': round(self.max, 1),
+        }
+        for q in QUANTILES:
+            data[f'p{round(q * 100)}'] = round(self.quantile(q), 1)
+        return data
+
+    def copy(self):
+        return QuantileSketch(self.relative_accuracy, self.max_bins).merge(self)
+
+    def to_dict(self):
+        return {
+            'accuracy': self.relative_accuracy,
+            'bins': {str(key): weight for key, weight in self.bins.items()},
+            'zero': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data, max_bins=2048):
+        sketch = cls(data.get('accuracy', 0.01), max_bins)
+        sketch.bins = {int(key): weight for key, weight in data.get('bins', {}).items()}
+        sketch.zero_count = data.get('zero', 0)
+        sketch.count = data.get('count', 0)
+        sketch.sum = data.get('sum', 0.0)
+        sketch.min = data.get('min')
+        sketch.max = data.get('max')
+        return sketch
+
+
+def stage_durations(timestamps):
+    """{étape: secondes} pour les étapes dont les deux horodatages sont connus et ordonnés"""
+    durations = {}
+    for stage, start_field, end_field in STAGES:
+        start, end = timestamps.get(start_field), timestamps.get(end_field)
+        if start is None or end is None:
+            continue
+        seconds = (end - start).total_seconds()
+        if seconds >= 0:
+            durations[stage] = seconds
+    return durations
+
+
+def delivery_dimensions(driver_id, zone_id, created_at):
+    """Clés (dimension, clé) auxquelles contribue une livraison"""
+    dimensions = [('all', '')]
+    if driver_id is not None:
+        dimensions.append(('driver', str(driver_id)))
+    if created_at is not None:
+        dimensions.append(('hour', str(timezone.localtime(created_at).hour)))
+    dimensions.append(('zone', str(zone_id) if zone_id is not None else ''))
+    return dimensions
+
+
+def locate_zone(latitude, longitude):
+    """Zone de livraison actuelle de l'adresse (index en mémoire), ou None"""
+    if latitude is None or longitude is None:
+        return None
+    from .zones import get_zone_index
+
+    zone = get_zone_index().locate(latitude, longitude)
+    return zone.zone_id if zone else None
+
+
+class AnalyticsStateChanged(Exception):
+    """Un recalcul complet a changé la coupure pendant une écriture"""
+
+
+def _state_row(lock=False):
+    from .models import DeliveryAnalyticsState
+
+    queryset = DeliveryAnalyticsState.objects.select_for_update() if lock else DeliveryAnalyticsState.objects
+    state, _ = queryset.get_or_create(id=1)
+    return state
+
+
+def get_analytics_state():
+    """(version, coupure) des distributions persistées, lues en base : partagées entre processus"""
+    from .models import DeliveryAnalyticsState
+
+    state = DeliveryAnalyticsState.objects.filter(id=1).values_list('version', 'cutoff').first()
+    return state or (0, None)
+
+
+def get_analytics_version():
+    return get_analytics_state()[0]
+
+
+def load_sketches(max_bins=2048):
+    """Distributions persistées : {(dimension, clé, étape): sketch}"""
+    from .models import DeliveryStageSketch
+
+    return {
+        (dimension, key, stage): QuantileSketch.from_dict(data, max_bins)
+        for dimension, key, stage, data in DeliveryStageSketch.objects.values_list(
+            'dimension', 'key', 'stage', 'sketch'
+        )
+    }
+
+
+def write_sketches(sketches, replace=False, cutoff=None):
+    """
+    Écrire des sketches en base. Par défaut ils sont fusionnés avec les
+    lignes existantes (verrouillées), à condition que la coupure en base
+    soit toujours `cutoff` (AnalyticsStateChanged sinon); `replace=True`
+    remplace toute la table et enregistre la coupure `cutoff` avec une
+    nouvelle version, dans la même transaction.
+    """
+    from .models import DeliveryStageSketch
+
+    with transaction.atomic():
+        # Ligne d'état verrouillée : fusions et remplacements sont sérialisés
+        state = _state_row(lock=True)
+        if replace:
+            state.version += 1
+            state.cutoff = cutoff
+            state.save()
+            DeliveryStageSketch.objects.all().delete()
+            existing = {}
+        elif state.cutoff != cutoff:
+            raise AnalyticsStateChanged()
+        else:
+            existing = {
+                (row.dimension, row.key, row.stage): row
+                for row in DeliveryStageSketch.objects.select_for_update().filter(
+                    dimension__in={dimension for dimension, _, _ in sketches},
+                    stage__in={stage for _, _, stage in sketches},
+                )
+            }
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for (dimension, key, stage), sketch in sketches.items():
+            row = existing.get((dimension, key, stage))
+            if row is None:
+                to_create.append(DeliveryStageSketch(
+                    dimension=dimension, key=key, stage=stage,
+                    count=sketch.count, sketch=sketch.to_dict(), updated_at=now
+                ))
+                continue
+            merged = QuantileSketch.from_dict(row.sketch, sketch.max_bins).merge(sketch)
+            row.count = merged.count
+            row.sketch = merged.to_dict()
+            row.updated_at = now
+            to_update.append(row)
+
+        DeliveryStageSketch.objects.bulk_create(to_create, batch_size=500)
+        DeliveryStageSketch.objects.bulk_update(to_update, ['count', 'sketch', 'updated_at'], batch_size=500)
+    return len(to_create) + len(to_update)
+
+
+class DeliveryAnalytics:
+    """
+    Distributions en mémoire : état persisté (`_base`) plus observations du
+    processus pas encore écrites (`_pending`, et leur date de livraison dans
+    `_observations` pour pouvoir écarter celles d'avant une coupure).
+    """
+
+    def __init__(self, relative_accuracy=None, persist_interval=None, refresh_interval=None):
+        self.relative_accuracy = relative_accuracy or _get_setting('RELATIVE_ACCURACY', 0.01)
+        self.max_bins = _get_setting('MAX_BINS', 2048)
+        self.persist_interval = (persist_interval if persist_interval is not None
+                                 else _get_setting('PERSIST_INTERVAL', 60))
+        self.refresh_interval = (refresh_interval if refresh_interval is not None
+                                 else _get_setting('REFRESH_INTERVAL', 60))
+        self._base = None
+        self._pending = {}
+        self._observations = []
+        self._version = None
+        self._cutoff = None
+        self._loaded_at = 0.0
+        self._persisted_at = time.monotonic()
+        self._lock = threading.Lock()
+        # Écriture et relecture exclusives : une relecture ne voit jamais des
+        # observations écrites mais pas encore retirées de `_pending`
+        self._io_lock = threading.Lock()
+
+    def _sketch(self):
+        return QuantileSketch(self.relative_accuracy, self.max_bins)
+
+    def observe(self, timestamps, driver_id=None, zone_id=None, into=None):
+        """Ajouter les durées d'une livraison; retourne le nombre d'étapes connues"""
+        durations = stage_durations(timestamps)
+        if not durations:
+            return 0
+        dimensions = delivery_dimensions(driver_id, zone_id, timestamps.get('created_at'))
+        with self._lock:
+            if into is None:
+                self._observations.append((timestamps.get('delivered_at'), dimensions, durations))
+            self._add(self._pending if into is None else into, dimensions, durations)
+        return len(durations)
+
+    def _add(self, target, dimensions, durations):
+        for dimension, key in dimensions:
+            for stage, seconds in durations.items():
+                sketch = target.get((dimension, key, stage))
+                if sketch is None:
+                    sketch = target[(dimension, key, stage)] = self._sketch()
+                sketch.add(seconds)
+
+    def _apply_cutoff(self, cutoff):
+        """Écarter les observations non écrites livrées avant `cutoff` (appelé sous verrou)"""
+        if cutoff is None or cutoff == self._cutoff:
+            return
+        self._cutoff = cutoff
+        kept = [
+            observation for observation in self._observations
+            if observation[0] is None or observation[0] > cutoff
+        ]
+        if len(kept) == len(self._observations):
+            return
+        self._observations = kept
+        self._pending = {}
+        for _, dimensions, durations in kept:
+            self._add(self._pending, dimensions, durations)
+
+    def persist(self):
+        """Fusionner les observations locales en base"""
+        with self._io_lock:
+            while True:
+                version, cutoff = get_analytics_state()
+                with self._lock:
+                    if version != self._version:
+                        self._base = None  # Relue au prochain résumé
+                    self._apply_cutoff(cutoff)
+                    pending, self._pending = self._pending, {}
+                    observations, self._observations = self._observations, []
+                    self._persisted_at = time.monotonic()
+                if not pending:
+                    return 0
+                try:
+                    written = write_sketches(pending, cutoff=cutoff)
+                except Exception as e:
+                    # Réessayer au prochain passage, ou tout de suite avec la nouvelle coupure
+                    with self._lock:
+                        for sketch_key, sketch in pending.items():
+                            current = self._pending.get(sketch_key)
+                            self._pending[sketch_key] = sketch.merge(current) if current else sketch
+                        self._observations = observations + self._observations
+                    if isinstance(e, AnalyticsStateChanged):
+                        continue
+                    raise
+                with self._lock:
+                    if self._base is not None:
+                        for sketch_key, sketch in pending.items():
+                            current = self._base.get(sketch_key)
+                            self._base[sketch_key] = current.merge(sketch) if current else sketch
+                return written
+
+    def maybe_persist(self):
+        if time.monotonic() - self._persisted_at >= self.persist_interval:
+            try:
+                self.persist()
+            except Exception:
+                logger.exception("Échec de l'écriture des distributions de livraison")
+
+    def refresh(self):
+        with self._io_lock:
+            # État lu avant les lignes : un remplacement entre les deux lectures
+            # est vu comme un changement de version au résumé suivant
+            version, cutoff = get_analytics_state()
+            base = load_sketches(self.max_bins)
+            with self._lock:
+                self._apply_cutoff(cutoff)
+                self._base = base
+                self._version = version
+                self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if (self._base is None or self._version != get_analytics_version()
+                or time.monotonic() - self._loaded_at >= self.refresh_interval):
+            self.refresh()
+
+    def reset(self):
+        """Oublier l'état en mémoire (après un recalcul complet)"""
+        with self._lock:
+            self._base = None
+            self._pending = {}
+            self._observations = []
+
+    def summary(self, dimension='all', key=None, stage=None):
+        """{clé: {étape: {count, mean, min, max, p50, p90, p95, p99}}} en secondes"""
+        self._ensure_loaded()
+        with self._lock:
+            merged = {}
+            for sketches in (self._base, self._pending):
+                for (sketch_dimension, sketch_key, sketch_stage), sketch in sketches.items():
+                    if sketch_dimension != dimension:
+                        continue
+                    if key is not None and sketch_key != key:
+                        continue
+                    if stage is not None and sketch_stage != stage:
+                        continue
+                    current = merged.get((sketch_key, sketch_stage))
+                    merged[(sketch_key, sketch_stage)] = current.merge(sketch) if current else sketch.copy()
+
+        data = {}
+        for (sketch_key, sketch_stage), sketch in merged.items():
+            data.setdefault(sketch_key, {})[sketch_stage] = sketch.summary()
+        return data
+
+
+delivery_analytics = DeliveryAnalytics()
+
+
+def record_delivery(order, driver_id=None):
+    """Ajouter une livraison terminée aux distributions (n'échoue jamais)"""
+    try:
+        delivery_analytics.observe(
+            {field: getattr(order, field) for field in TIMESTAMP_FIELDS},
+            driver_id=driver_id if driver_id is not None else order.delivery_person_id,
+            zone_id=locate_zone(order.delivery_latitude, order.delivery_longitude),
+        )
+    except Exception:
+        logger.exception("Impossible d'enregistrer les durées de la commande %s", order.pk)
+        return
+    delivery_analytics.maybe_persist()
@@ -0,0 +1,159 @@
+# ===================================
+# delivery/cash.py
+# ===================================
+
+"""
+Registre des espèces des livreurs (paiement à la livraison).
+
+Chaque mouvement est une ligne `DriverCashEntry` ajoutée, jamais modifiée :
+encaissement à la livraison d'une commande payée en espèces, remise au
+restaurant (settlement) ou ajustement signé par un manager. Les totaux par
+livreur (`DriverCashBalance`) sont tenus à jour dans la même transaction
+par des incréments F() : le solde se lit en une requête, quel que soit
+l'historique. `verify_cash_ledger` les recalcule à partir des mouvements.
+"""
+
+import logging
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from .models import DriverCashBalance, DriverCashEntry
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+
+class CashLedgerError(Exception):
+    """Mouvement d'espèces refusé"""
+
+
+def _post(driver_id, kind, amount, order_id=None, recorded_by=None, note=''):
+    """Ajouter un mouvement et mettre à jour les totaux du livreur (même transaction)"""
+    with transaction.atomic():
+        DriverCashBalance.objects.get_or_create(delivery_person_id=driver_id)
+        # Verrou de la ligne de totaux : les mouvements d'un livreur sont sérialisés
+        balance = DriverCashBalance.objects.select_for_update().values_list(
+            'balance', flat=True
+        ).get(delivery_person_id=driver_id)
+        if kind == 'settlement' and balance + amount < ZERO:
+            raise CashLedgerError(f"Remise supérieure aux espèces détenues ({balance})")
+
+        entry = DriverCashEntry.objects.create(
+            delivery_person_id=driver_id, kind=kind, amount=amount, balance_after=balance + amount,
+            order_id=order_id, recorded_by=recorded_by, note=note
+        )
+        totals = {
+            'collection': 'total_collected', 'settlement': 'total_settled', 'adjustment': 'total_adjusted',
+        }
+        DriverCashBalance.objects.filter(delivery_person_id=driver_id).update(**{
+            'balance': F('balance') + amount,
+            totals[kind]: F(totals[kind]) + (-amount if kind == 'settlement' else amount),
+            'entries_count': F('entries_count') + 1,
+            'last_entry_at': entry.created_at,
+        })
+    return entry
+
+
+def record_cash_collection(order, driver_id):
+    """
+    Encaissement d'une commande payée en espèces, à la livraison; le
+    paiement passe à `completed`. Si le paiement ne peut plus y passer
+    (annulé...), le mouvement est enregistré avec une note à vérifier.
+    Retourne le mouvement, ou None si la commande n'est pas payée en
+    espèces ou est déjà encaissée.
+    """
+    from payments.models import Payment
+    from payments.transitions import transition_payment
+
+    payment = Payment.objects.filter(order_id=order.id, payment_method='cash').values('id', 'amount').first()
+    if payment is None:
+        return None
+
+    try:
+        with transaction.atomic():
+            entry = _post(driver_id, 'collection', payment['amount'], order_id=order.id)
+            if not transition_payment(payment['id'], 'completed'):
+                # Paiement annulé ou remboursé entre-temps : les espèces sont
+                # bien chez le livreur, le mouvement est gardé et signalé
+                payment_status = Payment.objects.filter(id=payment['id']).values_list('status', flat=True).get()
+                if payment_status != 'completed':
+                    entry.note = f"Paiement {payment_status} : encaissement à vérifier"
+                    DriverCashEntry.objects.filter(id=entry.id).update(note=entry.note)
+                    logger.warning(
+                        "Espèces encaissées pour la commande %s mais paiement %s (%s)",
+                        order.id, payment['id'], payment_status
+                    )
+    except IntegrityError:
+        # Déjà encaissée (livraison confirmée deux fois)
+        return None
+    return entry
+
+
+def record_settlement(driver_id, amount, recorded_by=None, note=''):
+    """Remise d'espèces par le livreur; le montant ne peut dépasser le solde"""
+    amount = Decimal(amount)
+    if amount <= ZERO:
+        raise CashLedgerError("Le montant doit être positif")
+    return _post(driver_id, 'settlement', -amount, recorded_by=recorded_by, note=note)
+
+
+def record_adjustment(driver_id, amount, recorded_by=None, note=''):
+    """Correction signée (le registre n'est jamais modifié); une note est requise"""
+    amount = Decimal(amount)
+    if not amount:
+        raise CashLedgerError("Le montant doit être non nul")
+    if not note:
+        raise CashLedgerError("Une note est requise pour un ajustement")
+    return _post(driver_id, 'adjustment', amount, recorded_by=recorded_by, note=note)
+
+
+def recompute_balances(driver_ids=None):
+    """Totaux recalculés à partir des mouvements, en une requête groupée : {driver_id: {...}}"""
+    entries = DriverCashEntry.objects.all()
+    if driver_ids is not None:
+        entries = entries.filter(delivery_person_id__in=driver_ids)
+    rows = entries.values('delivery_person_id').annotate(
+        balance=Sum('amount'),
+        total_collected=Sum('amount', filter=Q(kind='collection')),
+        total_settled=Sum('amount', filter=Q(kind='settlement')),
+        total_adjusted=Sum('amount', filter=Q(kind='adjustment')),
+        entries_count=Count('id'),
+        last_entry_at=Max('created_at'),
+    ).order_by()
+    return {
+        row['delivery_person_id']: {
+            'balance': (row['balance'] or ZERO).quantize(ZERO),
+            'total_collected': (row['total_collected'] or ZERO).quantize(ZERO),
+            'total_settled': -(row['total_settled'] or ZERO).quantize(ZERO),
+            'total_adjusted': (row['total_adjusted'] or ZERO).quantize(ZERO),
+            'entries_count': row['entries_count'],
+            'last_entry_at': row['last_entry_at'],
+        }
+        for row in rows
+    }
+
+
+def verify_balances(fix=False):
+    """
+    Comparer les totaux tenus à jour avec ceux recalculés; retourne la liste
+    des écarts [(driver_id, champ, tenu, recalculé)]. `fix` réécrit les
+    totaux erronés.
+    """
+    expected = recompute_balances()
+    stored = {balance.delivery_person_id: balance for balance in DriverCashBalance.objects.all()}
+    fields = ('balance', 'total_collected', 'total_settled', 'total_adjusted', 'entries_count')
+
+    mismatches = []
+    for driver_id in sorted(set(expected) | set(stored)):
+        values = expected.get(driver_id, dict.fromkeys(fields[:-1], ZERO) | {'entries_count': 0, 'last_entry_at': None})
+        balance = stored.get(driver_id)
+        differences = [
+            (driver_id, field, getattr(balance, field) if balance else None, values[field])
+            for field in fields
+            if balance is None or getattr(balance, field) != values[field]
+        ]
+        mismatches.extend(differences)
+        if fix and differences:
+            DriverCashBalance.objects.update_or_create(delivery_person_id=driver_id, defaults=values)
+    return mismatches
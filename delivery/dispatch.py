@@ -0,0 +1,451 @@
+# ===================================
+# delivery/dispatch.py
+# ===================================
+
+"""
+Affectation automatique des commandes prêtes aux livreurs disponibles.
+
+Chaque passage charge l'état (commandes `ready`, livreurs disponibles, charge
+et refus récents) en quelques requêtes groupées et ne garde, pour chaque
+commande, que les CANDIDATES livreurs les plus proches (index en grille de
+`delivery.geo`). Le problème d'affectation est résolu comme un flot de coût
+minimal (plus courts chemins successifs, Dijkstra sur coûts réduits par
+potentiels, interrompu dès que le puits est atteint). Chaque livreur offre autant
+de places que de livraisons simultanées autorisées, avec un coût de charge
+croissant par place. Si TIME_BUDGET_MS est dépassé, l'affectation partielle
+obtenue est conservée et les commandes restantes sont affectées en glouton.
+"""
+
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .geo import DriverGridIndex
+from .positions import POSITION_TTL
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('assigned', 'accepted', 'picked_up')
+WAITING_CAP_MINUTES = 30
+COST_SCALE = 1000  # Coûts entiers pour des coûts réduits exacts
+INF = float('inf')
+
+DEFAULT_WEIGHTS = {
+    'distance_km': 1.0,
+    'load': 2.0,
+    'rating': 0.5,
+    'refusal': 1.5,
+    'waiting': 0.1,
+}
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DISPATCH', {}).get(name, default)
+
+
+def get_weights():
+    return dict(DEFAULT_WEIGHTS, **_get_setting('WEIGHTS', {}))
+
+
+@dataclass(frozen=True)
+class DispatchOrder:
+    """Commande à affecter"""
+    order_id: int
+    latitude: object = None
+    longitude: object = None
+    waiting_minutes: float = 0
+    excluded: frozenset = frozenset()  # Livreurs ayant déjà refusé cette commande
+
+
+@dataclass(frozen=True)
+class DispatchDriver:
+    """Livreur disponible et son état courant"""
+    driver_id: int
+    latitude: object = None
+    longitude: object = None
+    load: int = 0
+    capacity: int = 2
+    rating: float = 0
+    refusals: int = 0
+    position_age: float = 0  # Secondes depuis la dernière position
+
+    @property
+    def slots(self):
+        return max(self.capacity - self.load, 0)
+
+
+@dataclass
+class DispatchPlan:
+    """Résultat d'un passage : (order_id, driver_id, cost, distance_m) par affectation"""
+    matches: list
+    unassigned: list
+    solver: str
+    elapsed_ms: float
+
+    @property
+    def total_cost(self):
+        return sum(cost for _, _, cost, _ in self.matches)
+
+    def as_dict(self):
+        return {
+            'solver': self.solver,
+            'elapsed_ms': round(self.elapsed_ms, 2),
+            'assigned': len(self.matches),
+            'unassigned': self.unassigned,
+            'total_cost': round(self.total_cost, 3),
+            'matches': [
+                {'order': order_id, 'delivery_person': driver_id,
+                 'cost': round(cost, 3), 'distance_m': round(distance) if distance is not None else None}
+                for order_id, driver_id, cost, distance in self.matches
+            ],
+        }
+
+
+# ---------------------------------------------------------------------------
+# Coûts et candidats
+# ---------------------------------------------------------------------------
+
+def edge_cost(order, driver, distance_m, weights):
+    """Coût d'affectation hors charge (la charge est portée par les places du livreur)"""
+    # Livreur non encore noté : pénalité neutre d'un point
+    missing_rating = 5 - float(driver.rating) if driver.rating else 1
+    waiting = min(order.waiting_minutes, WAITING_CAP_MINUTES)
+    return (
+        weights['distance_km'] * (distance_m or 0) / 1000
+        + weights['rating'] * missing_rating
+        + weights['refusal'] * driver.refusals
+        + weights['waiting'] * (WAITING_CAP_MINUTES - waiting)
+    )
+
+
+def slot_cost(driver, slot, weights):
+    """Coût de la `slot`-ième place libre d'un livreur"""
+    return weights['load'] * (driver.load + slot)
+
+
+def build_candidates(orders, drivers, weights, k=8, max_distance_m=None, max_age=POSITION_TTL):
+    """
+    K meilleurs livreurs par commande : {order_id: [(cost, driver_id, distance_m)]}.
+    Sans coordonnées de livraison, tous les livreurs sont comparés sans distance.
+    Les positions de plus de `max_age` secondes ne sont pas utilisées.
+    """
+    by_id = {driver.driver_id: driver for driver in drivers if driver.slots}
+    index = DriverGridIndex()
+    clock = time.monotonic()
+    for driver in by_id.values():
+        if driver.latitude is not None:
+            index.update(driver.driver_id, float(driver.latitude), float(driver.longitude),
+                         updated_at=clock - driver.position_age)
+
+    candidates = {}
+    for order in orders:
+        if order.latitude is None:
+            picks = [(None, driver_id) for driver_id in by_id if driver_id not in order.excluded]
+        else:
+            picks = [
+                (distance, driver_id)
+                for distance, driver_id, _, _ in index.nearest(
+                    float(order.latitude), float(order.longitude), k=k,
+                    predicate=lambda driver_id: driver_id not in order.excluded,
+                    max_age=max_age,
+                    max_distance_m=max_distance_m
+                )
+            ]
+        candidates[order.order_id] = sorted(
+            (edge_cost(order, by_id[driver_id], distance, weights), driver_id, distance)
+            for distance, driver_id in picks
+        )[:k]
+    return candidates
+
+
+# ---------------------------------------------------------------------------
+# Résolution
+# ---------------------------------------------------------------------------
+
+class _FlowGraph:
+    """Graphe résiduel : arcs [destination, capacité, coût, indice de l'arc inverse]"""
+
+    def __init__(self, size):
+        self.adj = [[] for _ in range(size)]
+
+    def add_edge(self, u, v, cost):
+        self.adj[u].append([v, 1, cost, len(self.adj[v])])
+        self.adj[v].append([u, 0, -cost, len(self.adj[u]) - 1])
+        return len(self.adj[u]) - 1
+
+    def push(self, u, index):
+        edge = self.adj[u][index]
+        edge[1] -= 1
+        self.adj[edge[0]][edge[3]][1] += 1
+
+    def shortest_paths(self, source, sink, potentials):
+        """Dijkstra sur les coûts réduits, arrêté dès que le puits est atteint"""
+        dist = [INF] * len(self.adj)
+        parent = [None] * len(self.adj)
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == sink:
+                break
+            h_u = potentials[u]
+            for index, (v, capacity, cost, _) in enumerate(self.adj[u]):
+                if capacity > 0:
+                    nd = d + cost + h_u - potentials[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        parent[v] = (u, index)
+                        heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+
+def solve_greedy(orders, drivers, candidates, weights, taken=None):
+    """Affectation gloutonne par coût croissant"""
+    by_id = {driver.driver_id: driver for driver in drivers}
+    used = dict(taken or {})
+    edges = sorted(
+        (cost, order_id, driver_id, distance)
+        for order_id, order_edges in candidates.items()
+        for cost, driver_id, distance in order_edges
+    )
+    matched = {}
+    for cost, order_id, driver_id, distance in edges:
+        if order_id in matched:
+            continue
+        driver = by_id[driver_id]
+        slot = used.get(driver_id, 0)
+        if slot >= driver.slots:
+            continue
+        used[driver_id] = slot + 1
+        matched[order_id] = (driver_id, cost + slot_cost(driver, slot, weights), distance)
+    return matched
+
+
+def solve_min_cost(orders, drivers, candidates, weights, deadline=None):
+    """
+    Affectation de coût minimal maximisant le nombre de commandes affectées.
+    Retourne ({order_id: (driver_id, cost, distance_m)}, complete).
+    """
+    by_id = {driver.driver_id: driver for driver in drivers}
+    order_nodes = {order_id: 1 + i for i, order_id in enumerate(candidates)}
+    driver_ids = sorted({
+        driver_id for order_edges in candidates.values() for _, driver_id, _ in order_edges
+    })
+    driver_nodes = {driver_id: 1 + len(order_nodes) + i for i, driver_id in enumerate(driver_ids)}
+    source, sink = 0, 1 + len(order_nodes) + len(driver_nodes)
+
+    graph = _FlowGraph(sink + 1)
+    order_edges = []
+    for order_id, node in order_nodes.items():
+        graph.add_edge(source, node, 0)
+        for cost, driver_id, distance in candidates[order_id]:
+            index = graph.add_edge(node, driver_nodes[driver_id], round(cost * COST_SCALE))
+            order_edges.append((order_id, node, index, driver_id, cost, distance))
+    for driver_id, node in driver_nodes.items():
+        driver = by_id[driver_id]
+        for slot in range(driver.slots):
+            graph.add_edge(node, sink, round(slot_cost(driver, slot, weights) * COST_SCALE))
+
+    potentials = [0] * (sink + 1)
+    flow = 0
+    complete = True
+    while flow < len(order_nodes):
+        if deadline is not None and time.perf_counter() > deadline:
+            complete = False
+            break
+        dist, parent = graph.shortest_paths(source, sink, potentials)
+        if dist[sink] == INF:
+            break
+        # Potentiels bornés par la distance du puits : les coûts réduits restent positifs
+        limit = dist[sink]
+        for node, d in enumerate(dist):
+            potentials[node] += d if d < limit else limit
+        node = sink
+        while node != source:
+            u, index = parent[node]
+            graph.push(u, index)
+            node = u
+        flow += 1
+
+    # Coût de place attribué dans l'ordre des coûts d'arc pour chaque livreur
+    matched = {}
+    slots_used = {}
+    for order_id, node, index, driver_id, cost, distance in sorted(order_edges, key=lambda e: e[4]):
+        if graph.adj[node][index][1] == 0:
+            slot = slots_used.get(driver_id, 0)
+            slots_used[driver_id] = slot + 1
+            matched[order_id] = (driver_id, cost + slot_cost(by_id[driver_id], slot, weights), distance)
+    return matched, complete
+
+
+def plan_dispatch(orders, drivers, weights=None, k=None, max_distance_m=None,
+                  time_budget_ms=None, solver='optimal'):
+    """Calculer un plan d'affectation en mémoire (sans accès base)"""
+    started = time.perf_counter()
+    weights = weights or get_weights()
+    k = k or _get_setting('CANDIDATES', 8)
+    if max_distance_m is None:
+        max_distance_m = _get_setting('MAX_DISTANCE_KM', 15) * 1000
+    if time_budget_ms is None:
+        time_budget_ms = _get_setting('TIME_BUDGET_MS', 200)
+
+    candidates = build_candidates(orders, drivers, weights, k=k, max_distance_m=max_distance_m)
+
+    if solver == 'greedy':
+        matched, used_solver = solve_greedy(orders, drivers, candidates, weights), 'greedy'
+    else:
+        deadline = started + time_budget_ms / 1000 if time_budget_ms else None
+        matched, complete = solve_min_cost(orders, drivers, candidates, weights, deadline)
+        used_solver = 'optimal'
+        if not complete:
+            taken = {}
+            for driver_id, _, _ in matched.values():
+                taken[driver_id] = taken.get(driver_id, 0) + 1
+            remaining = {
+                order_id: edges for order_id, edges in candidates.items() if order_id not in matched
+            }
+            matched.update(solve_greedy(orders, drivers, remaining, weights, taken))
+            used_solver = 'partial+greedy'
+
+    matches = [
+        (order.order_id,) + matched[order.order_id]
+        for order in orders if order.order_id in matched
+    ]
+    unassigned = [order.order_id for order in orders if order.order_id not in matched]
+    return DispatchPlan(matches, unassigned, used_solver, (time.perf_counter() - started) * 1000)
+
+
+# ---------------------------------------------------------------------------
+# État et écriture en base
+# ---------------------------------------------------------------------------
+
+def load_state(order_ids=None, now=None):
+    """Charger commandes prêtes et livreurs disponibles (requêtes groupées)"""
+    from accounts.models import User
+    from orders.models import Order
+    from .geo import driver_index, warm_driver_index
+    from .models import DeliveryAssignment, DeliveryRefusal
+
+    now = now or timezone.now()
+    order_rows = Order.objects.filter(status='ready')
+    if order_ids is not None:
+        order_rows = order_rows.filter(id__in=order_ids)
+    order_rows = list(order_rows.order_by('created_at').values_list(
+        'id', 'delivery_latitude', 'delivery_longitude', 'ready_at', 'created_at'
+    ))
+
+    excluded = {}
+    for order_id, driver_id in DeliveryRefusal.objects.filter(
+        order_id__in=[row[0] for row in order_rows]
+    ).values_list('order_id', 'delivery_person_id'):
+        excluded.setdefault(order_id, set()).add(driver_id)
+
+    orders = [
+        DispatchOrder(
+            order_id=order_id,
+            latitude=latitude,
+            longitude=longitude,
+            waiting_minutes=(now - (ready_at or created_at)).total_seconds() / 60,
+            excluded=frozenset(excluded.get(order_id, ())),
+        )
+        for order_id, latitude, longitude, ready_at, created_at in order_rows
+    ]
+
+    driver_rows = list(User.objects.filter(
+        user_type='delivery', is_available=True, is_active=True
+    ).values_list('id', 'average_rating'))
+    driver_ids = [driver_id for driver_id, _ in driver_rows]
+
+    loads = dict(DeliveryAssignment.objects.filter(
+        delivery_person_id__in=driver_ids, status__in=ACTIVE_STATUSES
+    ).values('delivery_person_id').annotate(n=Count('id')).values_list('delivery_person_id', 'n'))
+    refusals = dict(DeliveryRefusal.objects.filter(
+        delivery_person_id__in=driver_ids,
+        created_at__gte=now - timedelta(days=_get_setting('REFUSAL_WINDOW_DAYS', 7))
+    ).values('delivery_person_id').annotate(n=Count('id')).values_list('delivery_person_id', 'n'))
+
+    warm_driver_index()
+    capacity = _get_setting('MAX_ACTIVE_PER_DRIVER', 2)
+    drivers = []
+    for driver_id, rating in driver_rows:
+        # Position expirée : le livreur n'est proposé que sans coordonnées
+        position = driver_index.get(driver_id, max_age=POSITION_TTL) or (None, None)
+        drivers.append(DispatchDriver(
+            driver_id=driver_id,
+            latitude=position[0],
+            longitude=position[1],
+            position_age=(driver_index.age(driver_id) or 0) if position[0] is not None else 0,
+            load=loads.get(driver_id, 0),
+            capacity=capacity,
+            rating=float(rating),
+            refusals=refusals.get(driver_id, 0),
+        ))
+    return orders, drivers
+
+
+def assign_order(order_id, driver_id, assigned_by=None, notes=''):
+    """
+    Affecter une commande prête à un livreur. L'affectation refusée
+    éventuelle est réutilisée (une seule affectation par commande).
+    Retourne None si la commande n'est plus prête.
+    """
+    from orders.models import Order
+    from .models import DeliveryAssignment
+
+    now = timezone.now()
+    with transaction.atomic():
+        updated = Order.objects.filter(id=order_id, status='ready').update(
+            status='assigned', delivery_person_id=driver_id, assigned_at=now, updated_at=now
+        )
+        if not updated:
+            return None
+        assignment, _ = DeliveryAssignment.objects.update_or_create(
+            order_id=order_id,
+            defaults={
+                'delivery_person_id': driver_id,
+                'assigned_by': assigned_by,
+                'status': 'assigned',
+                'assigned_at': now,
+                'accepted_at': None,
+                'refused_at': None,
+                'refusal_reason': '',
+                'notes': notes,
+            }
+        )
+    return assignment
+
+
+def run_dispatch(order_ids=None, dry_run=False, assigned_by=None):
+    """Un passage complet : état, plan, écriture. Retourne (plan, affectations)."""
+    orders, drivers = load_state(order_ids)
+    if not orders:
+        return DispatchPlan([], [], 'none', 0.0), []
+
+    plan = plan_dispatch(orders, drivers)
+    assignments = []
+    if not dry_run:
+        for order_id, driver_id, _, _ in plan.matches:
+            assignment = assign_order(order_id, driver_id, assigned_by=assigned_by)
+            if assignment is not None:
+                assignments.append(assignment)
+
+    logger.info(
+        "Dispatch : %d/%d commandes affectées (%s, %.1f ms)",
+        len(plan.matches), len(orders), plan.solver, plan.elapsed_ms
+    )
+    return plan, assignments
+
+
+def redispatch_after_refusal(order_id):
+    """Réaffecter une commande refusée si REDISPATCH_ON_REFUSAL est actif (par défaut)"""
+    if not _get_setting('REDISPATCH_ON_REFUSAL', True):
+        return None
+    _, assignments = run_dispatch(order_ids=[order_id])
+    return assignments[0] if assignments else None
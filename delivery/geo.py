@@ -0,0 +1,225 @@
+# ===================================
+# delivery/geo.py
+# ===================================
+
+"""
+Index spatial en mémoire des dernières positions des livreurs.
+
+Les positions sont rangées dans une grille de cellules de CELL_SIZE degrés.
+La recherche des K plus proches parcourt les anneaux de cellules autour du
+point demandé et s'arrête dès que l'anneau suivant ne peut plus contenir
+de livreur plus proche que le K-ième trouvé.
+"""
+
+import heapq
+import math
+import threading
+import time
+from .positions import POSITION_TTL
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en mètres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class DriverGridIndex:
+    """Grille de cellules (lat, lon) → livreurs"""
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._drivers = {}  # driver_id -> (lat, lon, cell, updated_at)
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def update(self, driver_id, lat, lon, updated_at=None):
+        """`updated_at` : instant `time.monotonic()` de la position (maintenant par défaut)"""
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._drivers.get(driver_id)
+            if previous and previous[2] != cell:
+                self._discard(driver_id, previous[2])
+            self._cells.setdefault(cell, set()).add(driver_id)
+            self._drivers[driver_id] = (
+                lat, lon, cell, time.monotonic() if updated_at is None else updated_at
+            )
+
+    def remove(self, driver_id):
+        with self._lock:
+            previous = self._drivers.pop(driver_id, None)
+            if previous:
+                self._discard(driver_id, previous[2])
+
+    def _discard(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def get(self, driver_id, max_age=None):
+        entry = self._drivers.get(driver_id)
+        if entry is None:
+            return None
+        if max_age is not None and time.monotonic() - entry[3] > max_age:
+            return None
+        return (entry[0], entry[1])
+
+    def age(self, driver_id):
+        """Secondes écoulées depuis la dernière position, None si inconnue"""
+        entry = self._drivers.get(driver_id)
+        return time.monotonic() - entry[3] if entry else None
+
+    def evict(self, max_age):
+        """Retirer les positions plus anciennes que `max_age` secondes"""
+        limit = time.monotonic() - max_age
+        with self._lock:
+            stale = [driver_id for driver_id, entry in self._drivers.items() if entry[3] < limit]
+            for driver_id in stale:
+                self.remove(driver_id)
+        return len(stale)
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def _ring(self, center, radius):
+        ci, cj = center
+        if radius == 0:
+            yield center
+            return
+        for j in range(cj - radius, cj + radius + 1):
+            yield (ci - radius, j)
+            yield (ci + radius, j)
+        for i in range(ci - radius + 1, ci + radius):
+            yield (i, cj - radius)
+            yield (i, cj + radius)
+
+    def nearest(self, lat, lon, k=5, predicate=None, max_age=None, max_distance_m=None):
+        """
+        K livreurs les plus proches : liste de (distance_m, driver_id, lat, lon),
+        triée par distance. `predicate(driver_id)` filtre les candidats,
+        `max_age` (secondes) ignore les positions trop anciennes et les
+        retire de l'index.
+        """
+        center = self._cell(lat, lon)
+        # Distance minimale garantie par anneau (la largeur d'une cellule en longitude rétrécit avec la latitude)
+        ring_width_m = self.cell_size * METERS_PER_DEGREE * max(
+            math.cos(math.radians(min(abs(lat) + self.cell_size, 90))), 1e-6
+        )
+        now = time.monotonic()
+        best = []  # tas max sur la distance : (-distance, driver_id, lat, lon)
+        stale = []
+
+        with self._lock:
+            total = len(self._drivers)
+            seen = 0
+            radius = 0
+            while seen < total:
+                lower_bound = (radius - 1) * ring_width_m if radius else 0
+                if len(best) == k and lower_bound > -best[0][0]:
+                    break
+                if max_distance_m is not None and lower_bound > max_distance_m:
+                    break
+
+                if radius and (2 * radius + 1) ** 2 > 4 * len(self._cells):
+                    # Grille clairsemée : parcourir directement les cellules restantes
+                    cells = [
+                        cell for cell in self._cells
+                        if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= radius
+                    ]
+                    seen = total
+                else:
+                    cells = self._ring(center, radius)
+
+                for cell in cells:
+                    for driver_id in self._cells.get(cell, ()):
+                        seen += 1
+                        d_lat, d_lon, _, updated_at = self._drivers[driver_id]
+                        if max_age is not None and now - updated_at > max_age:
+                            stale.append(driver_id)
+                            continue
+                        if predicate is not None and not predicate(driver_id):
+                            continue
+                        distance = haversine_m(lat, lon, d_lat, d_lon)
+                        if max_distance_m is not None and distance > max_distance_m:
+                            continue
+                        item = (-distance, driver_id, d_lat, d_lon)
+                        if len(best) < k:
+                            heapq.heappush(best, item)
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, item)
+                radius += 1
+
+            for driver_id in stale:
+                self.remove(driver_id)
+
+        return sorted((-neg_distance, driver_id, d_lat, d_lon) for neg_distance, driver_id, d_lat, d_lon in best)
+
+
+def naive_nearest(drivers, lat, lon, k=5):
+    """Parcours complet (référence pour le benchmark) : drivers = {id: (lat, lon)}"""
+    return heapq.nsmallest(k, (
+        (haversine_m(lat, lon, d_lat, d_lon), driver_id, d_lat, d_lon)
+        for driver_id, (d_lat, d_lon) in drivers.items()
+    ))
+
+
+driver_index = DriverGridIndex()
+
+_warmed = False
+_warm_lock = threading.Lock()
+
+
+def _index_position(position):
+    driver_index.update(position.driver_id, float(position.latitude), float(position.longitude))
+
+
+def warm_driver_index(max_age=POSITION_TTL):
+    """
+    Charger une fois la dernière position connue de chaque livreur au
+    démarrage du processus. Seules les positions de moins de `max_age`
+    secondes sont chargées, avec leur âge réel : elles expirent dans
+    l'index comme celles reçues en direct.
+    """
+    global _warmed
+    if _warmed:
+        return
+    with _warm_lock:
+        if _warmed:
+            return
+        from datetime import timedelta
+        from django.db.models import OuterRef, Subquery
+        from django.utils import timezone
+        from .models import DeliveryLocation
+
+        now = timezone.now()
+        since = now - timedelta(seconds=max_age)
+        latest = DeliveryLocation.objects.filter(
+            assignment__delivery_person_id=OuterRef('assignment__delivery_person_id'),
+            timestamp__gte=since,
+        ).order_by('-timestamp').values('id')[:1]
+        rows = DeliveryLocation.objects.filter(
+            timestamp__gte=since, id=Subquery(latest)
+        ).values_list('assignment__delivery_person_id', 'latitude', 'longitude', 'timestamp')
+        clock = time.monotonic()
+        for driver_id, lat, lon, timestamp in rows:
+            if driver_index.get(driver_id) is None:
+                age = max((now - timestamp).total_seconds(), 0)
+                driver_index.update(driver_id, float(lat), float(lon), updated_at=clock - age)
+        _warmed = True
+
+
+def connect_position_store():
+    """Maintenir l'index à jour à chaque nouvelle position"""
+    from .positions import position_store
+    position_store.add_listener(_index_position)
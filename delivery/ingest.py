@@ -0,0 +1,136 @@
+# ===================================
+# delivery/ingest.py
+# ===================================
+
+"""
+Ingestion des positions GPS des livreurs.
+
+Les points reçus sont mis en tampon en mémoire puis écrits par lots
+(`bulk_create`) dès que le tampon atteint FLUSH_SIZE points ou que le plus
+ancien point attend depuis FLUSH_INTERVAL secondes.
+
+Un lot dont l'écriture échoue est remis en tampon et réessayé aux
+écritures suivantes, au plus MAX_RETRIES fois; au-delà de MAX_PENDING
+points en attente, les plus anciens sont abandonnés. Les points ne vivent
+qu'en mémoire jusqu'à leur écriture : un arrêt brutal du processus les
+perd, malgré la réponse 202 déjà envoyée.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from .models import DeliveryLocation
+
+logger = logging.getLogger(__name__)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DELIVERY_TRACKING', {}).get(name, default)
+
+
+class LocationBuffer:
+    """Tampon thread-safe de positions, vidé par lots"""
+
+    def __init__(self, flush_size=200, flush_interval=2.0, batch_size=500, max_retries=5, max_pending=10000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._points = []
+        self._retries = []  # [(échecs, lot)] à réécrire, les plus anciens d'abord
+        self._oldest_at = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, locations):
+        """Ajouter des DeliveryLocation non sauvegardées au tampon"""
+        with self._lock:
+            self._points.extend(locations)
+            if self._oldest_at is None:
+                self._oldest_at = time.monotonic()
+            due = len(self._points) >= self.flush_size or (
+                self.flush_interval is not None
+                and time.monotonic() - self._oldest_at >= self.flush_interval
+            )
+            batch = self._drain() if due else None
+            if not due:
+                self._schedule()
+
+        if batch:
+            self._write_all(batch)
+
+    def flush(self):
+        """Écrire immédiatement les points en attente; retourne le nombre de points écrits"""
+        with self._lock:
+            batch = self._drain()
+        return self._write_all(batch)
+
+    def pending(self):
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        return len(self._points) + sum(len(points) for _, points in self._retries)
+
+    def _drain(self):
+        batch = self._retries + ([(0, self._points)] if self._points else [])
+        self._retries, self._points, self._oldest_at = [], [], None
+        return batch
+
+    def _schedule(self):
+        # Un seul minuteur actif pour garantir l'écriture des points isolés
+        if self.flush_interval is None or self._timer is not None:
+            return
+        self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+    def _write_all(self, batch):
+        written = 0
+        for failures, points in batch:
+            try:
+                # bulk_create est atomique : un lot réessayé n'est jamais écrit deux fois
+                DeliveryLocation.objects.bulk_create(points, batch_size=self.batch_size)
+                written += len(points)
+            except Exception:
+                logger.exception("Échec de l'écriture de %d positions", len(points))
+                self._requeue(failures + 1, points)
+        return written
+
+    def _requeue(self, failures, points):
+        if failures > self.max_retries:
+            logger.error("%d positions abandonnées après %d échecs d'écriture", len(points), failures)
+            return
+        for point in points:
+            point.pk = None  # Id éventuellement attribué par l'insertion annulée
+        with self._lock:
+            self._retries.append((failures, points))
+            excess = self._count() - self.max_pending
+            while excess > 0 and self._retries:
+                dropped = self._retries.pop(0)[1]
+                excess -= len(dropped)
+                logger.error("Tampon de positions plein : %d positions abandonnées", len(dropped))
+            if self._oldest_at is None:
+                self._oldest_at = time.monotonic()
+            self._schedule()
+
+
+location_buffer = LocationBuffer(
+    flush_size=_get_setting('FLUSH_SIZE', 200),
+    flush_interval=_get_setting('FLUSH_INTERVAL', 2.0),
+    max_retries=_get_setting('MAX_RETRIES', 5),
+    max_pending=_get_setting('MAX_PENDING', 10000),
+)
+atexit.register(location_buffer.flush)
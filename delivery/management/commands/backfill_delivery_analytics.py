@@ -0,0 +1,84 @@
+# ===================================
+# delivery/management/commands/backfill_delivery_analytics.py
+# ===================================
+
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.models import Order
+from delivery.analytics import (
+    TIMESTAMP_FIELDS, DeliveryAnalytics, delivery_analytics, locate_zone, write_sketches
+)
+
+FIELDS = (
+    'id', *TIMESTAMP_FIELDS, 'assignment__delivery_person_id', 'delivery_person_id',
+    'delivery_latitude', 'delivery_longitude'
+)
+
+
+class Command(BaseCommand):
+    help = "Recalcule les distributions des durées d'étape à partir de l'historique des commandes livrées"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=2000, help='Commandes lues par requête')
+        parser.add_argument('--dry-run', action='store_true', help='Calculer sans écrire')
+
+    def observe(self, analytics, sketches, rows):
+        for row in rows:
+            timestamps = dict(zip(TIMESTAMP_FIELDS, row[1:7]))
+            assignment_driver, order_driver, latitude, longitude = row[7:]
+            analytics.observe(
+                timestamps,
+                driver_id=assignment_driver if assignment_driver is not None else order_driver,
+                zone_id=locate_zone(latitude, longitude),
+                into=sketches,
+            )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        analytics = DeliveryAnalytics()
+        sketches = {}
+        last_id = 0
+        orders = 0
+
+        # Coupure : seules les livraisons jusqu'à cette date sont comptées
+        cutoff = timezone.now()
+        delivered = Order.objects.filter(status='delivered', delivered_at__isnull=False)
+
+        # Parcours par id croissant : pas d'OFFSET, mémoire bornée par --chunk
+        while True:
+            rows = list(
+                delivered.filter(
+                    id__gt=last_id, delivered_at__lte=cutoff
+                ).order_by('id').values_list(*FIELDS)[:options['chunk']]
+            )
+            if not rows:
+                break
+            self.observe(analytics, sketches, rows)
+            orders += len(rows)
+            last_id = rows[-1][0]
+            self.stdout.write(f"{orders} commandes lues...")
+
+        # Rattrapage des livraisons terminées pendant le parcours, juste avant l'écriture
+        previous_cutoff, cutoff = cutoff, timezone.now()
+        rows = list(delivered.filter(
+            delivered_at__gt=previous_cutoff, delivered_at__lte=cutoff
+        ).values_list(*FIELDS))
+        self.observe(analytics, sketches, rows)
+        orders += len(rows)
+
+        elapsed = time.perf_counter() - start
+        if options['dry_run']:
+            self.stdout.write(
+                f"[dry-run] {orders} commandes, {len(sketches)} distributions ({elapsed:.1f}s)"
+            )
+            return
+
+        # Table, version et coupure changent dans la même transaction : les autres
+        # processus relisent l'état en base avant chaque écriture
+        written = write_sketches(sketches, replace=True, cutoff=cutoff)
+        delivery_analytics.reset()
+        self.stdout.write(self.style.SUCCESS(
+            f"{orders} commandes, {written} distributions écrites jusqu'au "
+            f"{timezone.localtime(cutoff):%Y-%m-%d %H:%M:%S} ({time.perf_counter() - start:.1f}s)"
+        ))
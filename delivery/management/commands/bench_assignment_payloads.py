@@ -0,0 +1,147 @@
+# ===================================
+# delivery/management/commands/bench_assignment_payloads.py
+# ===================================
+
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from accounts.models import User
+from menu.models import Category, MenuItem, MenuItemSize
+from orders.models import Order, OrderItem
+from delivery.models import DeliveryAssignment, DeliveryLocation
+from delivery.positions import position_store
+from delivery.serializers import DeliveryAssignmentListSerializer, DeliveryAssignmentSerializer
+from delivery.views import DeliveryAssignmentViewSet
+
+
+class Command(BaseCommand):
+    help = "Mesure requêtes SQL et taille des réponses des endpoints d'affectation (livreur et manager)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assignments', type=int, default=30, help='Affectations du livreur')
+        parser.add_argument('--locations', type=int, default=200, help='Positions GPS par affectation')
+        parser.add_argument('--items', type=int, default=4, help='Articles par commande')
+
+    def handle(self, *args, **options):
+        # Tout est annulé à la fin : la base n'est pas modifiée
+        with transaction.atomic():
+            driver, manager, assignments = self._create_data(
+                options['assignments'], options['locations'], options['items']
+            )
+            # Mesurer le pire cas : aucune position en cache (la liste manager est paginée)
+            position_store.clear()
+            detail_id = assignments[0].id
+
+            rows = [
+                ('my_deliveries (livreur)', 'legacy', self._legacy_list(driver)),
+                ('my_deliveries (livreur)', 'actuel', self._call(driver, 'my_deliveries', 'get')),
+                ('list (manager)', 'actuel', self._call(manager, 'list', 'get')),
+                ('retrieve (livreur)', 'legacy', self._legacy_detail(detail_id)),
+                ('retrieve (livreur)', 'actuel', self._call(driver, 'retrieve', 'get', detail_id)),
+                ('retrieve (manager)', 'legacy', self._legacy_detail(detail_id)),
+                ('retrieve (manager)', 'actuel', self._call(manager, 'retrieve', 'get', detail_id)),
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{options['assignments']} affectations, {options['locations']} positions et "
+            f"{options['items']} articles chacune"
+        )
+        self.stdout.write(f"{'endpoint':<26}{'version':<9}{'requêtes':>9}{'octets':>10}{'ms':>9}")
+        for endpoint, version, (queries, size, elapsed) in rows:
+            self.stdout.write(f"{endpoint:<26}{version:<9}{queries:>9}{size:>10}{elapsed * 1000:>9.1f}")
+
+    def _measure(self, produce):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            content = produce()
+        return len(ctx.captured_queries), len(content), time.perf_counter() - start
+
+    def _call(self, user, action, method, pk=None):
+        factory = APIRequestFactory()
+        view = DeliveryAssignmentViewSet.as_view({method: action})
+        request = getattr(factory, method)('/api/delivery/assignments/')
+        force_authenticate(request, user=user)
+
+        def produce():
+            response = view(request, pk=pk) if pk is not None else view(request)
+            return response.render().content
+        return self._measure(produce)
+
+    def _legacy_list(self, user):
+        """Requête de liste avant allègement : tout l'historique GPS préchargé"""
+        def produce():
+            queryset = DeliveryAssignment.objects.select_related(
+                'order', 'delivery_person', 'assigned_by'
+            ).prefetch_related('locations')
+            if user.user_type == 'delivery':
+                queryset = queryset.filter(delivery_person=user)
+            data = DeliveryAssignmentListSerializer(queryset.order_by('-assigned_at'), many=True).data
+            return JSONRenderer().render(data)
+        return self._measure(produce)
+
+    def _legacy_detail(self, assignment_id):
+        """Détail avant allègement : commande complète imbriquée pour tous"""
+        def produce():
+            assignment = DeliveryAssignment.objects.select_related(
+                'order', 'delivery_person', 'assigned_by'
+            ).prefetch_related('locations').get(id=assignment_id)
+            position_store.clear()
+            return JSONRenderer().render(DeliveryAssignmentSerializer(assignment).data)
+        return self._measure(produce)
+
+    def _create_data(self, count, locations_per_assignment, items_per_order):
+        stamp = int(time.time() * 1000)
+        driver = User.objects.create(username=f'bench-driver-{stamp}', user_type='delivery')
+        manager = User.objects.create(username=f'bench-manager-{stamp}', user_type='manager')
+
+        category = Category.objects.create(name=f'Bench {stamp}', slug=f'bench-{stamp}')
+        sizes = []
+        for i in range(items_per_order):
+            menu_item = MenuItem.objects.create(
+                category=category, name=f'Plat {i}', slug=f'bench-{stamp}-{i}', description='bench'
+            )
+            sizes.append(MenuItemSize.objects.create(
+                menu_item=menu_item, size='medium', price=Decimal('2500')
+            ))
+
+        now = timezone.now()
+        assignments = []
+        for i in range(count):
+            order = Order.objects.create(
+                order_number=f'BP-{stamp % 100000}-{i}',
+                delivery_address='Quartier bench, rue 12', customer_name='Client bench',
+                customer_phone='70000000', delivery_latitude=Decimal('12.37140000'),
+                delivery_longitude=Decimal('-1.51970000'),
+                subtotal=Decimal('10000'), total=Decimal('10500'), status='in_delivery'
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order, menu_item=size.menu_item, size=size,
+                    item_name=size.menu_item.name, size_name=size.size,
+                    item_price=size.price, quantity=1, subtotal=size.price
+                )
+                for size in sizes
+            ])
+            assignment = DeliveryAssignment.objects.create(
+                order=order, delivery_person=driver, assigned_by=manager, status='picked_up'
+            )
+            DeliveryLocation.objects.bulk_create([
+                DeliveryLocation(
+                    assignment=assignment,
+                    latitude=Decimal('12.37') + Decimal(random.randint(0, 9999)) / 1000000,
+                    longitude=Decimal('-1.52') + Decimal(random.randint(0, 9999)) / 1000000,
+                    accuracy=5.0,
+                    timestamp=now - timedelta(seconds=5 * j)
+                )
+                for j in range(locations_per_assignment)
+            ], batch_size=500)
+            assignments.append(assignment)
+        return driver, manager, assignments
@@ -0,0 +1,105 @@
+# ===================================
+# delivery/management/commands/bench_location_ingest.py
+# ===================================
+
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from accounts.models import User
+from orders.models import Order
+from delivery.models import DeliveryAssignment, DeliveryLocation
+from delivery.ingest import LocationBuffer
+
+
+class Command(BaseCommand):
+    help = "Mesure le débit d'ingestion des positions (pings/seconde), unitaire vs par lots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=50)
+        parser.add_argument('--pings', type=int, default=100, help='Pings par livreur')
+        parser.add_argument('--batch', type=int, default=10, help='Points par requête en mode lot')
+        parser.add_argument('--flush-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        # Écritures en autocommit, comme en production (un COMMIT par requête) :
+        # les données sont écrites pour de bon puis supprimées à la fin
+        assignments = self._create_assignments(options['drivers'])
+        total = options['drivers'] * options['pings']
+        try:
+            single = self._run_single(assignments, options['pings'])
+            batched = self._run_batched(
+                assignments, options['pings'], options['batch'], options['flush_size']
+            )
+            stored = DeliveryLocation.objects.filter(assignment__in=assignments).count()
+        finally:
+            self._cleanup(assignments)
+
+        self.stdout.write(f"Livreurs: {options['drivers']}, pings: {total} par mode")
+        self.stdout.write(f"Unitaire (1 INSERT par ping): {total / single:,.0f} pings/s")
+        self.stdout.write(
+            f"Par lots ({options['batch']} points/requête, flush à {options['flush_size']}): "
+            f"{total / batched:,.0f} pings/s"
+        )
+        self.stdout.write(f"Gain: x{single / batched:.1f} — {stored} positions écrites au total (attendu {2 * total})")
+
+    def _create_assignments(self, count):
+        stamp = int(time.time() * 1000)
+        assignments = []
+        for i in range(count):
+            driver = User.objects.create(username=f'bench-driver-{stamp}-{i}', user_type='delivery')
+            order = Order.objects.create(
+                order_number=f'BENCH-{stamp % 100000}-{i}',
+                delivery_address='bench', customer_name='bench', customer_phone='0',
+                subtotal=0, total=0, status='in_delivery'
+            )
+            assignments.append(DeliveryAssignment.objects.create(
+                order=order, delivery_person=driver, status='picked_up'
+            ))
+        return assignments
+
+    def _cleanup(self, assignments):
+        with transaction.atomic():
+            DeliveryLocation.objects.filter(assignment__in=assignments).delete()
+            order_ids = [assignment.order_id for assignment in assignments]
+            driver_ids = [assignment.delivery_person_id for assignment in assignments]
+            DeliveryAssignment.objects.filter(id__in=[assignment.id for assignment in assignments]).delete()
+            Order.objects.filter(id__in=order_ids).delete()
+            User.objects.filter(id__in=driver_ids).delete()
+
+    def _point(self, assignment):
+        return dict(
+            assignment_id=assignment.pk,
+            latitude=Decimal(f'{6.36 + random.random() / 100:.8f}'),
+            longitude=Decimal(f'{2.41 + random.random() / 100:.8f}'),
+            accuracy=5.0,
+            timestamp=timezone.now(),
+        )
+
+    def _run_single(self, assignments, pings):
+        started = time.perf_counter()
+        for _ in range(pings):
+            for assignment in assignments:
+                # Chemin historique : vérification d'appartenance + un INSERT par ping
+                DeliveryAssignment.objects.filter(
+                    pk=assignment.pk, delivery_person_id=assignment.delivery_person_id
+                ).exists()
+                DeliveryLocation.objects.create(**self._point(assignment))
+        return time.perf_counter() - started
+
+    def _run_batched(self, assignments, pings, batch, flush_size):
+        buffer = LocationBuffer(flush_size=flush_size, flush_interval=None)
+        started = time.perf_counter()
+        for offset in range(0, pings, batch):
+            for assignment in assignments:
+                DeliveryAssignment.objects.filter(
+                    pk=assignment.pk, delivery_person_id=assignment.delivery_person_id
+                ).exists()
+                buffer.add([
+                    DeliveryLocation(**self._point(assignment))
+                    for _ in range(min(batch, pings - offset))
+                ])
+        buffer.flush()
+        return time.perf_counter() - started
@@ -0,0 +1,55 @@
+# ===================================
+# delivery/management/commands/bench_nearest_drivers.py
+# ===================================
+
+import random
+import time
+from django.core.management.base import BaseCommand
+from delivery.geo import DriverGridIndex, naive_nearest
+
+
+class Command(BaseCommand):
+    help = "Compare la recherche des K livreurs les plus proches : index en grille vs parcours complet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('-k', type=int, default=5)
+        parser.add_argument('--spread', type=float, default=0.15,
+                            help='Étendue de la zone en degrés autour de Cotonou')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center_lat, center_lon, spread = 6.3654, 2.4183, options['spread']
+
+        def random_point():
+            return (center_lat + rng.uniform(-spread, spread), center_lon + rng.uniform(-spread, spread))
+
+        drivers = {driver_id: random_point() for driver_id in range(options['drivers'])}
+        index = DriverGridIndex()
+        for driver_id, (lat, lon) in drivers.items():
+            index.update(driver_id, lat, lon)
+
+        queries = [random_point() for _ in range(options['queries'])]
+        k = options['k']
+
+        started = time.perf_counter()
+        indexed = [index.nearest(lat, lon, k=k) for lat, lon in queries]
+        index_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        naive = [naive_nearest(drivers, lat, lon, k=k) for lat, lon in queries]
+        naive_time = time.perf_counter() - started
+
+        mismatches = sum(
+            1 for a, b in zip(indexed, naive)
+            if [driver_id for _, driver_id, _, _ in a] != [driver_id for _, driver_id, _, _ in b]
+        )
+
+        per_index = index_time / len(queries) * 1e6
+        per_naive = naive_time / len(queries) * 1e6
+        self.stdout.write(f"{options['drivers']} livreurs, {len(queries)} requêtes, K={k}")
+        self.stdout.write(f"Index en grille : {per_index:,.1f} µs/requête")
+        self.stdout.write(f"Parcours complet : {per_naive:,.1f} µs/requête")
+        self.stdout.write(f"Gain : x{per_naive / per_index:.1f} — résultats différents : {mismatches}")
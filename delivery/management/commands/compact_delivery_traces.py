@@ -0,0 +1,56 @@
+# ===================================
+# delivery/management/commands/compact_delivery_traces.py
+# ===================================
+
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from delivery.models import DeliveryAssignment
+from delivery.traces import compact_trace
+
+
+class Command(BaseCommand):
+    help = "Compresse les trajets GPS des livraisons terminées et supprime les points bruts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance', type=float, default=5.0,
+                            help='Écart maximal toléré en mètres (Douglas–Peucker)')
+        parser.add_argument('--archive-dir', default=None,
+                            help='Archiver les points bruts en JSON Lines gzip dans ce dossier')
+        parser.add_argument('--min-age', type=int, default=10,
+                            help='Minutes écoulées depuis la livraison (laisse le tampon GPS se vider)')
+        parser.add_argument('--limit', type=int, default=500)
+
+    def handle(self, *args, **options):
+        assignments = DeliveryAssignment.objects.filter(
+            status='delivered',
+            delivered_at__lte=timezone.now() - timedelta(minutes=options['min_age']),
+            # Inclut les trajets déjà compactés qui ont reçu des points en retard
+            locations__isnull=False,
+        ).distinct().order_by('delivered_at')[:options['limit']]
+
+        totals = {'assignments': 0, 'raw_points': 0, 'late_points': 0, 'points': 0, 'raw_bytes': 0,
+                  'compressed_bytes': 0}
+        for assignment in assignments:
+            stats = compact_trace(assignment, options['tolerance'], options['archive_dir'])
+            if stats is None:
+                continue
+            totals['assignments'] += 1
+            for key in ('raw_points', 'late_points', 'points', 'raw_bytes', 'compressed_bytes'):
+                totals[key] += stats[key]
+
+        if not totals['assignments']:
+            self.stdout.write('Aucun trajet à compresser')
+            return
+
+        reduction = 100 * (1 - totals['compressed_bytes'] / totals['raw_bytes'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['assignments']} trajets compressés: "
+            f"{totals['raw_points']} → {totals['points']} points, "
+            f"{totals['raw_bytes']:,} → {totals['compressed_bytes']:,} octets "
+            f"(-{reduction:.1f}%)"
+        ))
+        if totals['late_points']:
+            self.stdout.write(
+                f"{totals['late_points']} points antérieurs à un trajet déjà compacté archivés hors trajet"
+            )
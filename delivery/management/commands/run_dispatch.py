@@ -0,0 +1,37 @@
+# ===================================
+# delivery/management/commands/run_dispatch.py
+# ===================================
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from delivery.dispatch import run_dispatch
+
+
+class Command(BaseCommand):
+    help = "Affecte automatiquement les commandes prêtes aux livreurs disponibles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Relancer un passage toutes les --interval secondes')
+        parser.add_argument('--interval', type=float, default=15.0)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Calculer le plan sans rien écrire')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            plan, assignments = run_dispatch(dry_run=options['dry_run'])
+            if plan.matches or plan.unassigned:
+                self.stdout.write(
+                    f"{len(plan.matches)} commande(s) affectée(s), "
+                    f"{len(plan.unassigned)} en attente "
+                    f"({plan.solver}, {plan.elapsed_ms:.1f} ms)"
+                )
+                for order_id, driver_id, cost, distance in plan.matches:
+                    distance = f"{distance / 1000:.2f} km" if distance is not None else "distance inconnue"
+                    self.stdout.write(f"  commande {order_id} → livreur {driver_id} ({distance}, coût {cost:.2f})")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
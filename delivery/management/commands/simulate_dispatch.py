@@ -0,0 +1,160 @@
+# ===================================
+# delivery/management/commands/simulate_dispatch.py
+# ===================================
+
+import random
+import statistics
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from delivery.dispatch import DispatchDriver, DispatchOrder, plan_dispatch
+from delivery.geo import haversine_m
+
+CENTER = (6.3654, 2.4183)  # Cotonou
+
+
+class Command(BaseCommand):
+    help = (
+        "Simule le dispatch en mémoire : journée synthétique ou rejeu des commandes "
+        "d'une date (--date), en comparant le solveur optimal et le glouton"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Rejouer les commandes de ce jour (AAAA-MM-JJ)')
+        parser.add_argument('--orders', type=int, default=300, help='Commandes synthétiques')
+        parser.add_argument('--drivers', type=int, default=60)
+        parser.add_argument('--hours', type=float, default=0,
+                            help='Étalement des commandes synthétiques (0 = toutes prêtes en même temps)')
+        parser.add_argument('--interval', type=float, default=2.0, help='Minutes entre deux passages')
+        parser.add_argument('--capacity', type=int, default=2)
+        parser.add_argument('--speed-kmh', type=float, default=20.0)
+        parser.add_argument('--service-minutes', type=float, default=5.0)
+        parser.add_argument('--spread', type=float, default=0.08, help='Étendue de la zone en degrés')
+        parser.add_argument('--time-budget-ms', type=float, default=None)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        spread = options['spread']
+
+        def random_point():
+            return (CENTER[0] + rng.uniform(-spread, spread), CENTER[1] + rng.uniform(-spread, spread))
+
+        if options['date']:
+            arrivals = self._load_day(options['date'], random_point)
+            drivers = self._load_drivers(options['drivers'])
+        else:
+            arrivals = sorted(
+                (rng.uniform(0, options['hours'] * 60), order_id) + random_point()
+                for order_id in range(options['orders'])
+            )
+            drivers = list(range(options['drivers']))
+        if not arrivals:
+            raise CommandError("Aucune commande à simuler")
+        starts = {driver_id: random_point() for driver_id in drivers}
+        ratings = {driver_id: round(rng.uniform(3.5, 5), 2) for driver_id in drivers}
+
+        self.stdout.write(
+            f"{len(arrivals)} commandes, {len(drivers)} livreurs, "
+            f"passage toutes les {options['interval']} min"
+        )
+        for solver in ('optimal', 'greedy'):
+            result = self._simulate(arrivals, drivers, starts, ratings, solver, options)
+            self.stdout.write(
+                f"[{solver}] affectées {result['assigned']}/{len(arrivals)} — "
+                f"attente moyenne {result['mean_wait']:.1f} min — "
+                f"distance moyenne {result['mean_distance'] / 1000:.2f} km — "
+                f"coût total {result['total_cost']:.1f} — "
+                f"passage max {result['max_ms']:.1f} ms (p50 {result['p50_ms']:.1f} ms, "
+                f"{result['batches']} passages)"
+            )
+
+    def _load_day(self, value, random_point):
+        """Commandes livrables du jour : (minute d'arrivée, id, lat, lon)"""
+        from orders.models import Order
+
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError("Date invalide (AAAA-MM-JJ)")
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        rows = Order.objects.filter(
+            created_at__gte=start, created_at__lt=start + timedelta(days=1)
+        ).exclude(status__in=['cancelled', 'refused']).values_list(
+            'id', 'ready_at', 'created_at', 'delivery_latitude', 'delivery_longitude'
+        )
+        arrivals = []
+        for order_id, ready_at, created_at, latitude, longitude in rows:
+            minute = ((ready_at or created_at) - start).total_seconds() / 60
+            # Adresse sans coordonnées : point tiré au hasard dans la zone
+            point = (float(latitude), float(longitude)) if latitude is not None else random_point()
+            arrivals.append((minute, order_id) + point)
+        return sorted(arrivals)
+
+    def _load_drivers(self, default_count):
+        from accounts.models import User
+
+        drivers = list(User.objects.filter(user_type='delivery', is_active=True).values_list('id', flat=True))
+        return drivers or list(range(default_count))
+
+    def _simulate(self, arrivals, drivers, starts, ratings, solver, options):
+        speed_m_per_min = options['speed_kmh'] * 1000 / 60
+        position = dict(starts)
+        busy_until = {driver_id: [] for driver_id in drivers}  # fins de livraison planifiées
+        free_at = {driver_id: 0.0 for driver_id in drivers}
+
+        pending = {}
+        waits, distances, timings = [], [], []
+        total_cost = 0.0
+        next_arrival = 0
+        now = arrivals[0][0]
+        horizon = arrivals[-1][0] + 24 * 60
+
+        while (next_arrival < len(arrivals) or pending) and now <= horizon:
+            while next_arrival < len(arrivals) and arrivals[next_arrival][0] <= now:
+                minute, order_id, latitude, longitude = arrivals[next_arrival]
+                pending[order_id] = (minute, latitude, longitude)
+                next_arrival += 1
+
+            if pending:
+                orders = [
+                    DispatchOrder(order_id, latitude, longitude, waiting_minutes=now - minute)
+                    for order_id, (minute, latitude, longitude) in pending.items()
+                ]
+                fleet = []
+                for driver_id in drivers:
+                    busy_until[driver_id] = [end for end in busy_until[driver_id] if end > now]
+                    fleet.append(DispatchDriver(
+                        driver_id, *position[driver_id],
+                        load=len(busy_until[driver_id]),
+                        capacity=options['capacity'],
+                        rating=ratings[driver_id],
+                    ))
+
+                plan = plan_dispatch(
+                    orders, fleet, solver=solver, time_budget_ms=options['time_budget_ms']
+                )
+                timings.append(plan.elapsed_ms)
+                total_cost += plan.total_cost
+
+                for order_id, driver_id, _, _ in plan.matches:
+                    minute, latitude, longitude = pending.pop(order_id)
+                    distance = haversine_m(*position[driver_id], latitude, longitude)
+                    end = max(now, free_at[driver_id]) + distance / speed_m_per_min + options['service_minutes']
+                    free_at[driver_id] = end
+                    busy_until[driver_id].append(end)
+                    position[driver_id] = (latitude, longitude)
+                    waits.append(now - minute)
+                    distances.append(distance)
+
+            now += options['interval']
+
+        return {
+            'assigned': len(waits),
+            'mean_wait': statistics.fmean(waits) if waits else 0,
+            'mean_distance': statistics.fmean(distances) if distances else 0,
+            'total_cost': total_cost,
+            'batches': len(timings),
+            'max_ms': max(timings) if timings else 0,
+            'p50_ms': statistics.median(timings) if timings else 0,
+        }
@@ -0,0 +1,27 @@
+# ===================================
+# delivery/management/commands/verify_cash_ledger.py
+# ===================================
+
+from django.core.management.base import BaseCommand
+from delivery.cash import verify_balances
+
+
+class Command(BaseCommand):
+    help = "Recalcule les soldes d'espèces des livreurs à partir du registre et signale les écarts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Réécrire les totaux erronés')
+
+    def handle(self, *args, **options):
+        mismatches = verify_balances(fix=options['fix'])
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Registre cohérent : aucun écart'))
+            return
+
+        for driver_id, field, stored, expected in mismatches:
+            self.stdout.write(f"Livreur {driver_id} : {field} = {stored}, attendu {expected}")
+        drivers = len({driver_id for driver_id, *_ in mismatches})
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"{len(mismatches)} écarts corrigés ({drivers} livreurs)"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(mismatches)} écarts ({drivers} livreurs), relancer avec --fix"))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliverylocation',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0003_alter_deliverylocation_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliverylocation',
+            index=models.Index(fields=['assignment', '-timestamp'], name='delivery_loc_assign_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0004_deliverylocation_delivery_loc_assign_ts_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polyline', models.TextField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('raw_point_count', models.PositiveIntegerField(default=0)),
+                ('raw_bytes', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('assignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trace', to='delivery.deliveryassignment')),
+            ],
+            options={
+                'db_table': 'delivery_traces',
+            },
+        ),
+    ]
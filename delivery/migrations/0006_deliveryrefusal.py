@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_refusals(apps, schema_editor):
+    """Historiser les refus antérieurs encore visibles sur les affectations"""
+    DeliveryAssignment = apps.get_model('delivery', 'DeliveryAssignment')
+    DeliveryRefusal = apps.get_model('delivery', 'DeliveryRefusal')
+
+    refusals = [
+        DeliveryRefusal(
+            order_id=order_id,
+            delivery_person_id=delivery_person_id,
+            reason=reason,
+            created_at=refused_at or assigned_at,
+        )
+        for order_id, delivery_person_id, reason, refused_at, assigned_at in
+        DeliveryAssignment.objects.filter(status='refused').values_list(
+            'order_id', 'delivery_person_id', 'refusal_reason', 'refused_at', 'assigned_at'
+        )
+    ]
+    DeliveryRefusal.objects.bulk_create(refusals, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0005_deliverytrace'),
+        ('orders', '0004_order_discount_order_promo_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryRefusal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivery_person', models.ForeignKey(limit_choices_to={'user_type': 'delivery'}, on_delete=django.db.models.deletion.CASCADE, related_name='delivery_refusals', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_refusals', to='orders.order')),
+            ],
+            options={
+                'db_table': 'delivery_refusals',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['delivery_person', 'created_at'], name='delivery_refusal_person_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_refusals, migrations.RunPython.noop),
+    ]
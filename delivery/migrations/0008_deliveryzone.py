@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0007_deliveryrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('polygon', models.JSONField()),
+                ('delivery_fee', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('minimum_order', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('base_eta_minutes', models.PositiveIntegerField(default=30)),
+                ('priority', models.IntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'delivery_zones',
+                'ordering': ['-priority', 'name'],
+            },
+        ),
+    ]
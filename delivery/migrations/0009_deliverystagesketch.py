@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0008_deliveryzone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryStageSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('all', 'Global'), ('driver', 'Livreur'), ('hour', 'Heure de commande'), ('zone', 'Zone')], max_length=10)),
+                ('key', models.CharField(blank=True, max_length=20)),
+                ('stage', models.CharField(max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sketch', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'delivery_stage_sketches',
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key', 'stage'), name='delivery_stage_sketch_unique')],
+            },
+        ),
+    ]
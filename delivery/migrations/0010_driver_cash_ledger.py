@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('delivery', '0009_deliverystagesketch'),
+        ('orders', '0004_order_discount_order_promo_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverCashBalance',
+            fields=[
+                ('delivery_person', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cash_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_collected', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_settled', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_adjusted', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entries_count', models.PositiveIntegerField(default=0)),
+                ('last_entry_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'driver_cash_balances',
+            },
+        ),
+        migrations.CreateModel(
+            name='DriverCashEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('collection', 'Encaissement'), ('settlement', 'Remise'), ('adjustment', 'Ajustement')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('note', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('delivery_person', models.ForeignKey(limit_choices_to={'user_type': 'delivery'}, on_delete=django.db.models.deletion.PROTECT, related_name='cash_entries', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='cash_entries', to='orders.order')),
+                ('recorded_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cash_entries_recorded', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'driver_cash_entries',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['delivery_person', '-id'], name='driver_cash_entry_driver_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'collection')), fields=('order',), name='driver_cash_collection_once')],
+            },
+        ),
+    ]
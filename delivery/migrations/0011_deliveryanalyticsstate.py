@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0010_driver_cash_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryAnalyticsState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('cutoff', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'delivery_analytics_state',
+            },
+        ),
+    ]
@@ -1,7 +1,37 @@
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 from orders.models import Order
 
+
+class DeliveryRun(models.Model):
+    """Tournée : plusieurs commandes livrées par un livreur en un seul trajet"""
+    STATUS_CHOICES = (
+        ('planned', 'Planifiée'),
+        ('in_progress', 'En cours'),
+        ('completed', 'Terminée'),
+        ('cancelled', 'Annulée'),
+    )
+    
+    delivery_person = models.ForeignKey(User, on_delete=models.CASCADE, related_name='delivery_runs',
+                                        limit_choices_to={'user_type': 'delivery'})
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='delivery_runs_created')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='planned')
+    total_distance = models.PositiveIntegerField(default=0)  # Distance estimée du parcours en mètres
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'delivery_runs'
+        ordering = ['-created_at']
+        
+    def __str__(self):
+        return f"Run {self.id} by {self.delivery_person.get_full_name()}"
+
+
 class DeliveryAssignment(models.Model):
     """Affectation d'une commande à un livreur"""
     STATUS_CHOICES = (
@@ -29,6 +59,11 @@ class DeliveryAssignment(models.Model):
     refusal_reason = models.TextField(blank=True)
     notes = models.TextField(blank=True)
     
+    # Arrêt d'une tournée (ordre de passage)
+    run = models.ForeignKey(DeliveryRun, on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='stops')
+    run_sequence = models.PositiveSmallIntegerField(null=True, blank=True)
+    
     class Meta:
         db_table = 'delivery_assignments'
         ordering = ['-assigned_at']
@@ -43,11 +78,170 @@ class DeliveryLocation(models.Model):
     latitude = models.DecimalField(max_digits=10, decimal_places=8)
     longitude = models.DecimalField(max_digits=11, decimal_places=8)
     accuracy = models.FloatField(null=True, blank=True)  # Précision en mètres
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # Horodatage fourni par l'appareil ou à la réception
     
     class Meta:
         db_table = 'delivery_locations'
         ordering = ['-timestamp']
+        indexes = [
+            # Dernière position d'une affectation
+            models.Index(fields=['assignment', '-timestamp'], name='delivery_loc_assign_ts_idx'),
+        ]
+        
+    def __str__(self):
+        return f"Location for {self.assignment.order.order_number} at {self.timestamp}"
+
+
+class DeliveryTrace(models.Model):
+    """Trajet compressé d'une livraison terminée (polyline encodée)"""
+    assignment = models.OneToOneField(DeliveryAssignment, on_delete=models.CASCADE, related_name='trace')
+    polyline = models.TextField()  # Format Google Encoded Polyline
+    point_count = models.PositiveIntegerField(default=0)
+    raw_point_count = models.PositiveIntegerField(default=0)
+    raw_bytes = models.PositiveIntegerField(default=0)  # Taille estimée des points bruts
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'delivery_traces'
+        
+    def __str__(self):
+        return f"Trace for {self.assignment.order.order_number} ({self.point_count} points)"
+
+
+class DeliveryRefusal(models.Model):
+    """Historique des refus d'affectation (l'affectation elle-même est réutilisée)"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='delivery_refusals')
+    delivery_person = models.ForeignKey(User, on_delete=models.CASCADE, related_name='delivery_refusals',
+                                        limit_choices_to={'user_type': 'delivery'})
+    reason = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'delivery_refusals'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['delivery_person', 'created_at'], name='delivery_refusal_person_idx'),
+        ]
+        
+    def __str__(self):
+        return f"Refusal of {self.order.order_number} by {self.delivery_person.get_full_name()}"
+
+
+class DeliveryZone(models.Model):
+    """Zone de livraison (polygone de points [latitude, longitude]) et ses tarifs"""
+    name = models.CharField(max_length=100)
+    polygon = models.JSONField()  # [[lat, lon], [lat, lon], ...]
+    delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    minimum_order = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    base_eta_minutes = models.PositiveIntegerField(default=30)
+    priority = models.IntegerField(default=0)  # Zones superposées : la plus prioritaire s'applique
+    is_active = models.BooleanField(default=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'delivery_zones'
+        ordering = ['-priority', 'name']
+        
+    def __str__(self):
+        return self.name
+
+
+class DeliveryStageSketch(models.Model):
+    """Distribution persistée d'une durée d'étape (sketch de quantiles) pour une dimension"""
+    DIMENSION_CHOICES = (
+        ('all', 'Global'),
+        ('driver', 'Livreur'),
+        ('hour', 'Heure de commande'),
+        ('zone', 'Zone'),
+    )
+    
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=20, blank=True)  # Id du livreur, heure, id de zone
+    stage = models.CharField(max_length=20)
+    count = models.PositiveIntegerField(default=0)
+    sketch = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'delivery_stage_sketches'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key', 'stage'], name='delivery_stage_sketch_unique'),
+        ]
+        
+    def __str__(self):
+        return f"{self.stage} ({self.dimension}={self.key}): {self.count}"
+
+
+class DeliveryAnalyticsState(models.Model):
+    """
+    Version des distributions persistées et coupure du dernier recalcul
+    complet (une seule ligne, id=1), partagées par tous les processus
+    """
+    version = models.PositiveIntegerField(default=0)
+    cutoff = models.DateTimeField(null=True, blank=True)  # Livraisons comptées par le dernier recalcul
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'delivery_analytics_state'
+        
+    def __str__(self):
+        return f"Analytics v{self.version} (coupure {self.cutoff})"
+
+
+class DriverCashEntry(models.Model):
+    """Mouvement d'espèces d'un livreur (registre en ajout seul, jamais modifié)"""
+    KIND_CHOICES = (
+        ('collection', 'Encaissement'),
+        ('settlement', 'Remise'),
+        ('adjustment', 'Ajustement'),
+    )
+    
+    delivery_person = models.ForeignKey(User, on_delete=models.PROTECT, related_name='cash_entries',
+                                        limit_choices_to={'user_type': 'delivery'})
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Positif : espèces détenues en plus
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2)
+    order = models.ForeignKey(Order, on_delete=models.PROTECT, null=True, blank=True,
+                              related_name='cash_entries')
+    recorded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='cash_entries_recorded')
+    note = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'driver_cash_entries'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['delivery_person', '-id'], name='driver_cash_entry_driver_idx'),
+        ]
+        constraints = [
+            # Une commande n'est encaissée qu'une fois
+            models.UniqueConstraint(
+                fields=['order'], condition=models.Q(kind='collection'), name='driver_cash_collection_once'
+            ),
+        ]
+        
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.amount} ({self.delivery_person_id})"
+
+
+class DriverCashBalance(models.Model):
+    """Totaux tenus à jour du registre d'espèces d'un livreur (lecture en O(1))"""
+    delivery_person = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                           related_name='cash_balance')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Espèces à remettre
+    total_collected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_settled = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_adjusted = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    entries_count = models.PositiveIntegerField(default=0)
+    last_entry_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'driver_cash_balances'
         
     def __str__(self):
-        return f"Location for {self.assignment.order.order_number} at {self.timestamp}"
\ No newline at end of file
+        return f"Cash balance {self.delivery_person_id}: {self.balance}"
@@ -0,0 +1,274 @@
+# ===================================
+# delivery/positions.py
+# ===================================
+
+"""
+Dernière position connue des livreurs, par affectation et par livreur.
+
+Mise à jour à chaque écriture de position et lue en O(1) par le suivi de
+commande et les serializers. Le stockage est en mémoire du processus, avec
+un cache Django partagé optionnel (DELIVERY_TRACKING['POSITION_CACHE']) pour
+les déploiements multi-processus. Les entrées expirent après POSITION_TTL
+secondes ; la base de données (index assignment_id, timestamp) sert de repli.
+Une affectation sans position est aussi mémorisée (MISS_TTL secondes) :
+le suivi d'une commande pas encore partie n'interroge pas la base à chaque
+appel. Les affectations sont conservées en LRU (MAX_POSITIONS entrées au
+plus), les entrées expirées sont retirées à l'écriture.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+
+COORDINATE_PRECISION = Decimal('0.00000001')
+
+# Marqueur « aucune position » (valeur en cache distincte de l'absence d'entrée)
+MISSING = False
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DELIVERY_TRACKING', {}).get(name, default)
+
+
+POSITION_TTL = _get_setting('POSITION_TTL', 300)
+
+
+@dataclass(frozen=True)
+class Position:
+    assignment_id: int
+    driver_id: int
+    latitude: object
+    longitude: object
+    accuracy: object
+    timestamp: datetime
+    location_id: int = None  # Nul tant que le point est dans le tampon d'écriture
+
+    def as_dict(self):
+        return {
+            'id': self.location_id,
+            'assignment': self.assignment_id,
+            # Même format que DeliveryLocationSerializer (8 décimales)
+            'latitude': str(Decimal(str(self.latitude)).quantize(COORDINATE_PRECISION)),
+            'longitude': str(Decimal(str(self.longitude)).quantize(COORDINATE_PRECISION)),
+            'accuracy': self.accuracy,
+            'timestamp': self.timestamp,
+        }
+
+
+class LatestPositionStore:
+    """Dernières positions avec expiration, indexées par affectation et par livreur"""
+
+    def __init__(self, ttl=300, cache_alias=None, miss_ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.cache_alias = cache_alias
+        self.max_entries = max_entries
+        self._by_assignment = OrderedDict()
+        self._by_driver = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def _shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _store_assignment(self, assignment_id, value, expires_at):
+        """Écrire une entrée d'affectation (verrou tenu) et borner l'index"""
+        self._by_assignment[assignment_id] = (value, expires_at)
+        self._by_assignment.move_to_end(assignment_id)
+        # Affectations terminées : leurs entrées expirées sont en tête
+        now = time.monotonic()
+        while self._by_assignment:
+            oldest_id, (_, oldest_expires_at) = next(iter(self._by_assignment.items()))
+            if oldest_expires_at > now and len(self._by_assignment) <= self.max_entries:
+                break
+            del self._by_assignment[oldest_id]
+
+    def add_listener(self, callback):
+        """Appeler `callback(position)` à chaque nouvelle position"""
+        self._listeners.append(callback)
+
+    def record(self, position):
+        """Enregistrer une position si elle est plus récente que la précédente"""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            current = self._by_assignment.get(position.assignment_id)
+            if current and current[0] and current[0].timestamp > position.timestamp:
+                return False
+            self._store_assignment(position.assignment_id, position, expires_at)
+
+            current = self._by_driver.get(position.driver_id)
+            driver_updated = not current or current[0].timestamp <= position.timestamp
+            if driver_updated:
+                self._by_driver[position.driver_id] = (position, expires_at)
+
+        shared = self._shared
+        if shared is not None:
+            values = {f'delivery:position:assignment:{position.assignment_id}': position}
+            if driver_updated:
+                values[f'delivery:position:driver:{position.driver_id}'] = position
+            shared.set_many(values, timeout=self.ttl)
+
+        if driver_updated:
+            for callback in self._listeners:
+                callback(position)
+        return True
+
+    def record_missing(self, assignment_id):
+        """Mémoriser qu'une affectation n'a pas encore de position"""
+        if not self.miss_ttl:
+            return
+        with self._lock:
+            if self._by_assignment.get(assignment_id, (None,))[0] is not None:
+                return
+            self._store_assignment(assignment_id, MISSING, time.monotonic() + self.miss_ttl)
+        shared = self._shared
+        if shared is not None:
+            shared.add(f'delivery:position:assignment:{assignment_id}', MISSING, timeout=self.miss_ttl)
+
+    def _get(self, index, key, cache_key):
+        shared = self._shared
+        with self._lock:
+            entry = index.get(key)
+            if entry is not None:
+                if entry[1] <= time.monotonic():
+                    del index[key]
+                # Une position reçue par un autre processus remplace le marqueur en cache partagé
+                elif entry[0] is not MISSING or shared is None:
+                    if index is self._by_assignment:
+                        index.move_to_end(key)
+                    return entry[0]
+
+        if shared is not None:
+            return shared.get(cache_key)
+        return None
+
+    def for_assignment(self, assignment_id):
+        """Position, MISSING si l'absence de position est mémorisée, sinon None"""
+        return self._get(
+            self._by_assignment, assignment_id,
+            f'delivery:position:assignment:{assignment_id}'
+        )
+
+    def for_driver(self, driver_id):
+        return self._get(
+            self._by_driver, driver_id,
+            f'delivery:position:driver:{driver_id}'
+        )
+
+    def drivers(self):
+        """Positions non expirées de tous les livreurs connus du processus"""
+        now = time.monotonic()
+        with self._lock:
+            return [position for position, expires_at in self._by_driver.values() if expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._by_assignment.clear()
+            self._by_driver.clear()
+
+
+position_store = LatestPositionStore(
+    ttl=POSITION_TTL,
+    cache_alias=_get_setting('POSITION_CACHE', None),
+    miss_ttl=_get_setting('MISS_TTL', 30),
+    max_entries=_get_setting('MAX_POSITIONS', 10000),
+)
+
+
+def record_location(location, driver_id):
+    """Mettre à jour le cache à partir d'une DeliveryLocation"""
+    return position_store.record(Position(
+        assignment_id=location.assignment_id,
+        driver_id=driver_id,
+        latitude=location.latitude,
+        longitude=location.longitude,
+        accuracy=location.accuracy,
+        timestamp=location.timestamp,
+        location_id=location.pk,
+    ))
+
+
+def latest_position(assignment_id, driver_id=None):
+    """
+    Dernière position d'une affectation : cache d'abord, sinon base de
+    données via l'index (assignment_id, timestamp).
+    """
+    position = position_store.for_assignment(assignment_id)
+    if position is MISSING:
+        return None
+    if position is not None:
+        return position
+
+    from .models import DeliveryLocation
+
+    location = DeliveryLocation.objects.filter(
+        assignment_id=assignment_id
+    ).order_by('-timestamp').first()
+    if location is None:
+        position_store.record_missing(assignment_id)
+        return None
+
+    if driver_id is None:
+        from .models import DeliveryAssignment
+        driver_id = DeliveryAssignment.objects.filter(
+            pk=assignment_id
+        ).values_list('delivery_person_id', flat=True).first()
+
+    position = Position(
+        assignment_id=assignment_id,
+        driver_id=driver_id,
+        latitude=location.latitude,
+        longitude=location.longitude,
+        accuracy=location.accuracy,
+        timestamp=location.timestamp,
+        location_id=location.pk,
+    )
+    position_store.record(position)
+    return position
+
+
+def latest_location_annotations():
+    """
+    Annotations `latest_*` (sous-requêtes) : dernière position de chaque
+    affectation calculée dans la requête de liste, sans charger l'historique.
+    """
+    from django.db.models import OuterRef, Subquery
+    from .models import DeliveryLocation
+
+    latest = DeliveryLocation.objects.filter(assignment=OuterRef('pk')).order_by('-timestamp')
+    return {
+        f'latest_{field}': Subquery(latest.values(field)[:1])
+        for field in ('id', 'latitude', 'longitude', 'accuracy', 'timestamp')
+    }
+
+
+def annotated_position(assignment):
+    """
+    Dernière position d'une affectation : cache d'abord, puis annotations
+    `latest_*` si la requête les a calculées, sinon `latest_position`.
+    """
+    position = position_store.for_assignment(assignment.id)
+    if position is MISSING:
+        return None
+    if position is not None:
+        return position
+    if not hasattr(assignment, 'latest_timestamp'):
+        return latest_position(assignment.id, assignment.delivery_person_id)
+    if assignment.latest_timestamp is None:
+        return None
+    # SQLite ne ramène pas les décimales des sous-requêtes à l'échelle du champ
+    return Position(
+        assignment_id=assignment.id,
+        driver_id=assignment.delivery_person_id,
+        latitude=Decimal(assignment.latest_latitude).quantize(COORDINATE_PRECISION),
+        longitude=Decimal(assignment.latest_longitude).quantize(COORDINATE_PRECISION),
+        accuracy=assignment.latest_accuracy,
+        timestamp=assignment.latest_timestamp,
+        location_id=assignment.latest_id,
+    )
@@ -0,0 +1,116 @@
+# ===================================
+# delivery/routing.py
+# ===================================
+
+"""
+Tournées multi-commandes : ordre de passage et regroupement.
+
+L'ordre des arrêts est construit par plus proche voisin puis amélioré par
+2-opt (chemin ouvert depuis le restaurant quand il est connu). Le
+regroupement des commandes prêtes utilise une grille de cellules de la
+taille du rayon de regroupement : seules les cellules voisines sont
+comparées, ce qui permet de relancer le calcul toutes les quelques secondes.
+"""
+
+import math
+from .geo import METERS_PER_DEGREE, haversine_m
+
+
+def _distance_matrix(points):
+    return [[haversine_m(a[0], a[1], b[0], b[1]) for b in points] for a in points]
+
+
+def route_length(points, sequence, start=None):
+    """Longueur en mètres du parcours `sequence` (indices dans `points`)"""
+    stops = [points[i] for i in sequence]
+    if start is not None:
+        stops.insert(0, start)
+    return sum(haversine_m(*stops[i], *stops[i + 1]) for i in range(len(stops) - 1))
+
+
+def plan_route(points, start=None, max_passes=20):
+    """
+    Ordre de passage des points (lat, lon) : plus proche voisin puis 2-opt.
+    `start` (restaurant) est un point de départ fixe. Retourne (sequence, longueur_m).
+    """
+    if not points:
+        return [], 0.0
+
+    nodes = ([start] if start is not None else []) + list(points)
+    dist = _distance_matrix(nodes)
+    offset = 1 if start is not None else 0
+
+    # Plus proche voisin depuis le restaurant, sinon depuis le point le plus excentré
+    if start is not None:
+        current = 0
+        tour = [0]
+    else:
+        centroid = (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+        current = max(range(len(nodes)), key=lambda i: haversine_m(*nodes[i], *centroid))
+        tour = [current]
+    remaining = set(range(len(nodes))) - {current}
+    while remaining:
+        current = min(remaining, key=dist[current].__getitem__)
+        remaining.discard(current)
+        tour.append(current)
+
+    # 2-opt sur chemin ouvert (le restaurant reste en tête)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(offset, len(tour) - 1):
+            for j in range(i + 1, len(tour)):
+                before = dist[tour[i - 1]][tour[i]] if i > 0 else 0
+                after = dist[tour[j]][tour[j + 1]] if j + 1 < len(tour) else 0
+                new_before = dist[tour[i - 1]][tour[j]] if i > 0 else 0
+                new_after = dist[tour[i]][tour[j + 1]] if j + 1 < len(tour) else 0
+                if new_before + new_after < before + after - 1e-6:
+                    tour[i:j + 1] = reversed(tour[i:j + 1])
+                    improved = True
+        if not improved:
+            break
+
+    length = sum(dist[tour[i]][tour[i + 1]] for i in range(len(tour) - 1))
+    sequence = [node - offset for node in tour if node >= offset]
+    return sequence, length
+
+
+def cluster_orders(orders, radius_m=2000, window_minutes=15, max_stops=3):
+    """
+    Regrouper des commandes (order_id, lat, lon, ready_minute) proches dans
+    l'espace et dans le temps. Les commandes les plus anciennes servent de
+    germe; chaque groupe contient au plus `max_stops` commandes.
+    Retourne une liste de listes d'order_id (les commandes isolées forment
+    un groupe d'une seule commande).
+    """
+    cell_size = max(radius_m / METERS_PER_DEGREE, 1e-6)
+    cells = {}
+    for order in orders:
+        cell = (math.floor(order[1] / cell_size), math.floor(order[2] / cell_size))
+        cells.setdefault(cell, []).append(order)
+
+    clustered = set()
+    groups = []
+    for seed in sorted(orders, key=lambda order: order[3]):
+        if seed[0] in clustered:
+            continue
+        clustered.add(seed[0])
+        ci, cj = math.floor(seed[1] / cell_size), math.floor(seed[2] / cell_size)
+
+        # La longitude d'une cellule rétrécit avec la latitude : élargir la recherche en conséquence
+        span = math.ceil(1 / max(math.cos(math.radians(seed[1])), 0.1))
+        neighbours = []
+        for i in range(ci - 1, ci + 2):
+            for j in range(cj - span, cj + span + 1):
+                for order in cells.get((i, j), ()):
+                    if order[0] in clustered or abs(order[3] - seed[3]) > window_minutes:
+                        continue
+                    distance = haversine_m(seed[1], seed[2], order[1], order[2])
+                    if distance <= radius_m:
+                        neighbours.append((distance, order[0]))
+
+        group = [seed[0]]
+        for _, order_id in sorted(neighbours)[:max_stops - 1]:
+            clustered.add(order_id)
+            group.append(order_id)
+        groups.append(group)
+    return groups
@@ -0,0 +1,149 @@
+# ===================================
+# delivery/runs.py
+# ===================================
+
+"""
+Tournées multi-commandes.
+
+Une tournée regroupe plusieurs affectations d'un même livreur; chaque
+affectation reste un arrêt indépendant (accept/pickup/complete) et porte son
+ordre de passage (`run_sequence`). Le statut de la tournée est recalculé à
+partir de celui de ses arrêts.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .dispatch import assign_order
+from .models import DeliveryAssignment, DeliveryRun
+from .routing import cluster_orders, plan_route
+
+
+class RunError(Exception):
+    """Tournée impossible à créer"""
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DISPATCH', {}).get(name, default)
+
+
+def get_depot():
+    depot = _get_setting('DEPOT', None)
+    return (float(depot[0]), float(depot[1])) if depot else None
+
+
+def suggest_runs(max_stops=None, radius_km=None, window_minutes=None):
+    """Regroupements proposés pour les commandes prêtes, avec ordre de passage"""
+    from orders.models import Order
+
+    now = timezone.now()
+    rows = Order.objects.filter(
+        status='ready', delivery_latitude__isnull=False, delivery_longitude__isnull=False
+    ).values_list('id', 'order_number', 'delivery_latitude', 'delivery_longitude', 'ready_at', 'created_at')
+
+    points = {}
+    orders = []
+    for order_id, order_number, latitude, longitude, ready_at, created_at in rows:
+        points[order_id] = (order_number, float(latitude), float(longitude))
+        minute = ((ready_at or created_at) - now).total_seconds() / 60
+        orders.append((order_id, float(latitude), float(longitude), minute))
+
+    groups = cluster_orders(
+        orders,
+        radius_m=(radius_km or _get_setting('RUN_RADIUS_KM', 2)) * 1000,
+        window_minutes=window_minutes or _get_setting('RUN_WINDOW_MINUTES', 15),
+        max_stops=max_stops or _get_setting('RUN_MAX_STOPS', 3),
+    )
+
+    depot = get_depot()
+    suggestions = []
+    for group in groups:
+        if len(group) < 2:
+            continue
+        sequence, length = plan_route([points[order_id][1:] for order_id in group], depot)
+        ordered = [group[i] for i in sequence]
+        suggestions.append({
+            'orders': ordered,
+            'order_numbers': [points[order_id][0] for order_id in ordered],
+            'distance_m': round(length),
+        })
+    return suggestions
+
+
+def create_run(delivery_person, order_ids, created_by=None):
+    """
+    Affecter des commandes prêtes à un livreur en une tournée, dans l'ordre
+    de passage optimisé. Les commandes sans coordonnées passent en dernier.
+    """
+    from orders.models import Order
+
+    order_ids = list(dict.fromkeys(order_ids))
+    rows = {
+        order_id: (order_status, latitude, longitude)
+        for order_id, order_status, latitude, longitude in Order.objects.filter(
+            id__in=order_ids
+        ).values_list('id', 'status', 'delivery_latitude', 'delivery_longitude')
+    }
+    missing = [order_id for order_id in order_ids if order_id not in rows]
+    if missing:
+        raise RunError(f"Commandes introuvables : {missing}")
+    not_ready = [order_id for order_id in order_ids if rows[order_id][0] != 'ready']
+    if not_ready:
+        raise RunError(f"Seules les commandes prêtes peuvent être regroupées : {not_ready}")
+
+    located = [order_id for order_id in order_ids if rows[order_id][1] is not None]
+    unlocated = [order_id for order_id in order_ids if rows[order_id][1] is None]
+    sequence, length = plan_route(
+        [(float(rows[order_id][1]), float(rows[order_id][2])) for order_id in located], get_depot()
+    )
+    ordered = [located[i] for i in sequence] + unlocated
+
+    with transaction.atomic():
+        run = DeliveryRun.objects.create(
+            delivery_person=delivery_person,
+            created_by=created_by,
+            total_distance=round(length),
+        )
+        stops = []
+        for position, order_id in enumerate(ordered, 1):
+            assignment = assign_order(
+                order_id, delivery_person.id,
+                assigned_by=created_by if created_by and created_by.user_type == 'manager' else None
+            )
+            if assignment is None:
+                raise RunError(f"La commande {order_id} n'est plus prête")
+            assignment.run = run
+            assignment.run_sequence = position
+            stops.append(assignment)
+        DeliveryAssignment.objects.bulk_update(stops, ['run', 'run_sequence'])
+    return run
+
+
+def refresh_run_status(run_id):
+    """Recalculer le statut d'une tournée à partir de ses arrêts"""
+    if run_id is None:
+        return None
+
+    counts = dict(
+        DeliveryAssignment.objects.filter(run_id=run_id)
+        .values('status').annotate(n=Count('id')).values_list('status', 'n')
+    )
+    total = sum(counts.values())
+    now = timezone.now()
+    runs = DeliveryRun.objects.filter(id=run_id)
+
+    if not total:
+        run_status = 'cancelled'
+    elif counts.get('delivered', 0) == total:
+        run_status = 'completed'
+        runs.filter(completed_at__isnull=True).update(completed_at=now)
+    elif counts.get('picked_up') or counts.get('delivered'):
+        run_status = 'in_progress'
+    else:
+        run_status = 'planned'
+
+    if run_status in ('in_progress', 'completed'):
+        runs.filter(started_at__isnull=True).update(started_at=now)
+    runs.update(status=run_status)
+    return run_status
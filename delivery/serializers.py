@@ -4,8 +4,13 @@
 # ===================================
 
 from rest_framework import serializers
-from .models import DeliveryAssignment, DeliveryLocation
+from .models import (
+    DeliveryAssignment, DeliveryLocation, DeliveryRun, DeliveryZone, DriverCashBalance, DriverCashEntry
+)
+from .positions import annotated_position
+from orders.models import OrderItem
 from orders.serializers import OrderSerializer
+from accounts.models import User
 from accounts.serializers import DeliveryPersonSerializer
 
 
@@ -20,6 +25,19 @@ class DeliveryLocationSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp']
 
 
+class LocationPointSerializer(serializers.Serializer):
+    """Point GPS horodaté envoyé par lot"""
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    accuracy = serializers.FloatField(required=False, allow_null=True, min_value=0)
+    timestamp = serializers.DateTimeField(required=False)
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    """Lot de points GPS pour une affectation"""
+    points = LocationPointSerializer(many=True, allow_empty=False, max_length=500)
+
+
 class DeliveryAssignmentSerializer(serializers.ModelSerializer):
     """Serializer complet pour DeliveryAssignment"""
     order_details = OrderSerializer(source='order', read_only=True)
@@ -35,20 +53,64 @@ class DeliveryAssignmentSerializer(serializers.ModelSerializer):
             'delivery_person_details', 'assigned_by', 'assigned_by_name',
             'status', 'status_display', 'assigned_at', 'accepted_at',
             'refused_at', 'picked_up_at', 'delivered_at',
-            'refusal_reason', 'notes', 'latest_location'
+            'refusal_reason', 'notes', 'latest_location',
+            'run', 'run_sequence'
         ]
         read_only_fields = [
             'id', 'assigned_at', 'accepted_at', 'refused_at',
-            'picked_up_at', 'delivered_at'
+            'picked_up_at', 'delivered_at', 'run', 'run_sequence'
         ]
     
     def get_latest_location(self, obj):
-        latest = obj.locations.first()
+        latest = annotated_position(obj)
         if latest:
-            return DeliveryLocationSerializer(latest).data
+            return latest.as_dict()
         return None
 
 
+class DriverOrderItemSerializer(serializers.ModelSerializer):
+    """Article tel que commandé (snapshot), sans le menu"""
+    class Meta:
+        model = OrderItem
+        fields = ['item_name', 'size_name', 'quantity', 'special_instructions']
+
+
+class DriverAssignmentSerializer(serializers.ModelSerializer):
+    """
+    Affectation vue par le livreur : uniquement ce que l'application affiche.
+    Attend `payment_method` et `payment_status` annotés et `order__items`
+    préchargés (voir DeliveryAssignmentViewSet.get_queryset).
+    """
+    order_number = serializers.CharField(source='order.order_number', read_only=True)
+    customer_name = serializers.CharField(source='order.customer_name', read_only=True)
+    customer_phone = serializers.CharField(source='order.customer_phone', read_only=True)
+    delivery_address = serializers.CharField(source='order.delivery_address', read_only=True)
+    delivery_latitude = serializers.DecimalField(source='order.delivery_latitude', max_digits=10,
+                                                 decimal_places=8, read_only=True)
+    delivery_longitude = serializers.DecimalField(source='order.delivery_longitude', max_digits=11,
+                                                  decimal_places=8, read_only=True)
+    delivery_description = serializers.CharField(source='order.delivery_description', read_only=True)
+    order_notes = serializers.CharField(source='order.notes', read_only=True)
+    total = serializers.DecimalField(source='order.total', max_digits=10, decimal_places=2, read_only=True)
+    payment_method = serializers.CharField(read_only=True, allow_null=True)
+    payment_status = serializers.CharField(read_only=True, allow_null=True)
+    items = DriverOrderItemSerializer(source='order.items', many=True, read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = DeliveryAssignment
+        fields = [
+            'id', 'order', 'order_number', 'customer_name', 'customer_phone',
+            'delivery_address', 'delivery_latitude', 'delivery_longitude',
+            'delivery_description', 'order_notes', 'total',
+            'payment_method', 'payment_status', 'items',
+            'status', 'status_display', 'notes', 'refusal_reason',
+            'assigned_at', 'accepted_at', 'picked_up_at', 'delivered_at',
+            'run', 'run_sequence'
+        ]
+        read_only_fields = fields
+
+
 class DeliveryAssignmentCreateSerializer(serializers.ModelSerializer):
     """Serializer pour la création d'une affectation"""
     class Meta:
@@ -71,3 +133,112 @@ class DeliveryAssignmentListSerializer(serializers.ModelSerializer):
             'assigned_at', 'delivered_at'
         ]
 
+
+class DeliveryRunStopSerializer(serializers.ModelSerializer):
+    """Arrêt d'une tournée (affectation)"""
+    order_number = serializers.CharField(source='order.order_number', read_only=True)
+    customer_name = serializers.CharField(source='order.customer_name', read_only=True)
+    customer_phone = serializers.CharField(source='order.customer_phone', read_only=True)
+    delivery_address = serializers.CharField(source='order.delivery_address', read_only=True)
+    delivery_latitude = serializers.DecimalField(source='order.delivery_latitude', max_digits=10,
+                                                 decimal_places=8, read_only=True)
+    delivery_longitude = serializers.DecimalField(source='order.delivery_longitude', max_digits=11,
+                                                  decimal_places=8, read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = DeliveryAssignment
+        fields = [
+            'id', 'run_sequence', 'order', 'order_number', 'customer_name',
+            'customer_phone', 'delivery_address', 'delivery_latitude',
+            'delivery_longitude', 'status', 'status_display',
+            'picked_up_at', 'delivered_at'
+        ]
+
+
+class DeliveryRunSerializer(serializers.ModelSerializer):
+    """Serializer pour DeliveryRun avec ses arrêts dans l'ordre de passage"""
+    delivery_person_name = serializers.CharField(source='delivery_person.get_full_name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    stops = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = DeliveryRun
+        fields = [
+            'id', 'delivery_person', 'delivery_person_name', 'created_by',
+            'status', 'status_display', 'total_distance', 'stops',
+            'created_at', 'started_at', 'completed_at'
+        ]
+    
+    def get_stops(self, obj):
+        stops = sorted(obj.stops.all(), key=lambda stop: stop.run_sequence or 0)
+        return DeliveryRunStopSerializer(stops, many=True).data
+
+
+class DeliveryRunCreateSerializer(serializers.Serializer):
+    """Création d'une tournée à partir de commandes prêtes"""
+    delivery_person = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(user_type='delivery'))
+    orders = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=20)
+
+
+class DispatchRequestSerializer(serializers.Serializer):
+    """Passage de dispatch lancé par un manager"""
+    dry_run = serializers.BooleanField(required=False, default=False)
+    orders = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=500)
+
+
+class DeliveryZoneSerializer(serializers.ModelSerializer):
+    """Serializer pour DeliveryZone"""
+    class Meta:
+        model = DeliveryZone
+        fields = [
+            'id', 'name', 'polygon', 'delivery_fee', 'minimum_order',
+            'base_eta_minutes', 'priority', 'is_active',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def validate_polygon(self, value):
+        if not isinstance(value, list) or len(value) < 3:
+            raise serializers.ValidationError("Le polygone doit contenir au moins 3 points.")
+        for point in value:
+            try:
+                latitude, longitude = (float(coordinate) for coordinate in point)
+            except (TypeError, ValueError):
+                raise serializers.ValidationError("Chaque point doit être de la forme [latitude, longitude].")
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise serializers.ValidationError("Coordonnées hors limites.")
+        return [[float(latitude), float(longitude)] for latitude, longitude in value]
+
+
+class DriverCashEntrySerializer(serializers.ModelSerializer):
+    """Mouvement du registre d'espèces"""
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+    order_number = serializers.CharField(source='order.order_number', read_only=True, default=None)
+    
+    class Meta:
+        model = DriverCashEntry
+        fields = [
+            'id', 'delivery_person', 'kind', 'kind_display', 'amount', 'balance_after',
+            'order', 'order_number', 'recorded_by', 'note', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class DriverCashBalanceSerializer(serializers.ModelSerializer):
+    """Totaux du registre d'espèces d'un livreur"""
+    delivery_person_name = serializers.CharField(source='delivery_person.get_full_name', read_only=True)
+    
+    class Meta:
+        model = DriverCashBalance
+        fields = [
+            'delivery_person', 'delivery_person_name', 'balance', 'total_collected',
+            'total_settled', 'total_adjusted', 'entries_count', 'last_entry_at'
+        ]
+        read_only_fields = fields
+
+
+class DriverCashMovementSerializer(serializers.Serializer):
+    """Remise ou ajustement saisi par un manager"""
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    note = serializers.CharField(required=False, allow_blank=True, default='')
@@ -0,0 +1,16 @@
+# ===================================
+# delivery/signals.py
+# ===================================
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import DeliveryZone
+from .zones import bump_zones_version
+
+
+@receiver([post_save, post_delete], sender=DeliveryZone)
+def zones_changed(sender, **kwargs):
+    """Toute modification d'une zone invalide l'index"""
+    # Après validation : une version nouvelle ne doit jamais être compilée avec les anciennes lignes
+    transaction.on_commit(bump_zones_version)
@@ -0,0 +1,136 @@
+# ===================================
+# delivery/stats.py
+# ===================================
+
+"""
+Statistiques de charge des livreurs, calculées pour toute la flotte en
+quelques requêtes groupées (agrégation conditionnelle par livreur) au lieu
+de plusieurs `count()` par livreur.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+FLEET_STATS_CACHE_KEY = 'delivery:fleet-stats'
+ACTIVE_STATUSES = ('assigned', 'accepted', 'picked_up')
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DELIVERY_TRACKING', {}).get(name, default)
+
+
+def _by_driver(queryset, **aggregates):
+    return {
+        row.pop('delivery_person_id'): row
+        for row in queryset.values('delivery_person_id').annotate(**aggregates).order_by()
+    }
+
+
+def compute_driver_statistics(driver_ids=None, now=None):
+    """
+    Statistiques par livreur : {driver_id: {...}}.
+    Quatre requêtes quel que soit le nombre de livreurs.
+    """
+    from accounts.models import User
+    from ratings.models import DeliveryRating
+    from .models import DeliveryAssignment, DeliveryRefusal
+
+    now = now or timezone.now()
+    today = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    drivers = User.objects.filter(user_type='delivery')
+    assignments = DeliveryAssignment.objects.all()
+    ratings = DeliveryRating.objects.all()
+    refusals = DeliveryRefusal.objects.all()
+    if driver_ids is not None:
+        drivers = drivers.filter(id__in=driver_ids)
+        assignments = assignments.filter(delivery_person_id__in=driver_ids)
+        ratings = ratings.filter(delivery_person_id__in=driver_ids)
+        refusals = refusals.filter(delivery_person_id__in=driver_ids)
+
+    delivered = Q(status='delivered')
+    assignment_rows = _by_driver(
+        assignments,
+        completed=Count('id', filter=delivered),
+        active=Count('id', filter=Q(status__in=ACTIVE_STATUSES)),
+        completed_today=Count('id', filter=delivered & Q(delivered_at__gte=today)),
+        assigned_today=Count('id', filter=Q(assigned_at__gte=today)),
+        average_duration=Avg(
+            ExpressionWrapper(F('delivered_at') - F('picked_up_at'), output_field=DurationField()),
+            filter=delivered & Q(picked_up_at__isnull=False)
+        ),
+    )
+    rating_rows = _by_driver(
+        ratings,
+        total=Count('id'),
+        **{f'stars_{value}': Count('id', filter=Q(rating=value)) for value in range(1, 6)}
+    )
+    refusal_rows = _by_driver(
+        refusals,
+        refused=Count('id'),
+        refused_today=Count('id', filter=Q(created_at__gte=today)),
+    )
+
+    statistics = {}
+    for driver in drivers.only(
+        'id', 'username', 'first_name', 'last_name', 'is_available', 'total_deliveries', 'average_rating'
+    ):
+        counts = assignment_rows.get(driver.id, {})
+        driver_ratings = rating_rows.get(driver.id, {})
+        driver_refusals = refusal_rows.get(driver.id, {})
+        duration = counts.get('average_duration')
+        statistics[driver.id] = {
+            'id': driver.id,
+            'username': driver.username,
+            'full_name': driver.get_full_name(),
+            'is_available': driver.is_available,
+            'total_deliveries': driver.total_deliveries,
+            'average_rating': float(driver.average_rating),
+            'completed_deliveries': counts.get('completed', 0),
+            'refused_deliveries': driver_refusals.get('refused', 0),
+            'active_deliveries': counts.get('active', 0),
+            'average_delivery_minutes': round(duration.total_seconds() / 60, 1) if duration else None,
+            'today': {
+                'assigned': counts.get('assigned_today', 0),
+                'completed': counts.get('completed_today', 0),
+                'refused': driver_refusals.get('refused_today', 0),
+            },
+            'total_ratings': driver_ratings.get('total', 0),
+            'ratings_breakdown': {
+                '5_stars': driver_ratings.get('stars_5', 0),
+                '4_stars': driver_ratings.get('stars_4', 0),
+                '3_stars': driver_ratings.get('stars_3', 0),
+                '2_stars': driver_ratings.get('stars_2', 0),
+                '1_star': driver_ratings.get('stars_1', 0),
+            },
+        }
+    return statistics
+
+
+def fleet_statistics(use_cache=True):
+    """Statistiques de toute la flotte, en cache FLEET_STATS_TTL secondes"""
+    ttl = _get_setting('FLEET_STATS_TTL', 30)
+    if use_cache and ttl:
+        cached = cache.get(FLEET_STATS_CACHE_KEY)
+        if cached is not None:
+            return cached
+
+    now = timezone.now()
+    drivers = list(compute_driver_statistics(now=now).values())
+    data = {
+        'generated_at': now,
+        'totals': {
+            'drivers': len(drivers),
+            'available': sum(1 for driver in drivers if driver['is_available']),
+            'active_deliveries': sum(driver['active_deliveries'] for driver in drivers),
+            'assigned_today': sum(driver['today']['assigned'] for driver in drivers),
+            'completed_today': sum(driver['today']['completed'] for driver in drivers),
+            'refused_today': sum(driver['today']['refused'] for driver in drivers),
+        },
+        'drivers': drivers,
+    }
+    if ttl:
+        cache.set(FLEET_STATS_CACHE_KEY, data, timeout=ttl)
+    return data
@@ -1,3 +1,868 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.models import User
+from orders.models import Order
+from RestoOnline.testing import ThreadedTestCase
+from .models import (
+    DeliveryAnalyticsState, DeliveryAssignment, DeliveryLocation, DeliveryRefusal, DeliveryStageSketch,
+    DeliveryTrace
+)
+from .analytics import DeliveryAnalytics, write_sketches
+from .management.commands import backfill_delivery_analytics
+from . import geo
+from .geo import DriverGridIndex, haversine_m, warm_driver_index
+from .ingest import LocationBuffer
+from .positions import MISSING, LatestPositionStore, Position, position_store
+from .traces import compact_trace, decode_polyline, interpolate_timestamps
 
-# Create your tests here.
+
+class DeliveryTestMixin:
+
+    def setUp(self):
+        position_store.clear()
+        self.manager = User.objects.create(username='manager', user_type='manager')
+        self.driver = User.objects.create(username='livreur', user_type='delivery')
+
+    def create_order(self, index, latitude='6.37', longitude='2.42', **fields):
+        return Order.objects.create(
+            order_number=f'CMD-{index}', delivery_address='Cotonou', customer_name='Client',
+            customer_phone='0100000000', subtotal=1000, total=1000,
+            delivery_latitude=Decimal(latitude), delivery_longitude=Decimal(longitude), **fields
+        )
+
+    def create_assignment(self, index, status='picked_up', **fields):
+        return DeliveryAssignment.objects.create(
+            order=self.create_order(index, status='in_delivery'), delivery_person=self.driver,
+            assigned_by=self.manager, status=status, **fields
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class LocationBufferTests(DeliveryTestMixin, TestCase):
+
+    def points(self, assignment, count):
+        return [
+            DeliveryLocation(assignment=assignment, latitude=Decimal('6.37'), longitude=Decimal('2.42'))
+            for _ in range(count)
+        ]
+
+    def test_failed_batch_is_retried_then_dropped(self):
+        assignment = self.create_assignment(1)
+        buffer = LocationBuffer(flush_size=100, flush_interval=None, max_retries=1)
+        failing = mock.patch.object(DeliveryLocation.objects, 'bulk_create', side_effect=RuntimeError('base indisponible'))
+
+        buffer.add(self.points(assignment, 3))
+        with failing, self.assertLogs('delivery.ingest', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending(), 3)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(DeliveryLocation.objects.filter(assignment=assignment).count(), 3)
+
+        buffer.add(self.points(assignment, 2))
+        with failing, self.assertLogs('delivery.ingest', 'ERROR') as logs:
+            buffer.flush()
+            buffer.flush()
+        self.assertEqual(buffer.pending(), 0)
+        self.assertIn('2 positions abandonnées après 2 échecs', logs.output[-1])
+
+    def test_pending_failures_are_capped(self):
+        assignment = self.create_assignment(1)
+        buffer = LocationBuffer(flush_size=100, flush_interval=None, max_pending=5)
+
+        with mock.patch.object(DeliveryLocation.objects, 'bulk_create', side_effect=RuntimeError), \
+                self.assertLogs('delivery.ingest', 'ERROR'):
+            buffer.add(self.points(assignment, 4))
+            buffer.flush()
+            buffer.add(self.points(assignment, 4))
+            buffer.flush()
+
+        # Le lot en échec le plus ancien a été abandonné
+        self.assertEqual(buffer.pending(), 4)
+
+
+class PositionStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.clock = 1000.0
+        patcher = mock.patch('delivery.positions.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def position(self, assignment_id, minute, driver_id=1):
+        return Position(assignment_id, driver_id, '6.37', '2.42', 5.0,
+                        timezone.now().replace(hour=12, minute=minute, second=0, microsecond=0))
+
+    def test_older_position_is_ignored(self):
+        store = LatestPositionStore(ttl=60)
+        newer = self.position(1, 30)
+
+        self.assertTrue(store.record(newer))
+        self.assertFalse(store.record(self.position(1, 10)))
+        self.assertEqual(store.for_assignment(1), newer)
+        self.assertEqual(store.for_driver(1), newer)
+
+    def test_entries_expire(self):
+        store = LatestPositionStore(ttl=60, miss_ttl=10)
+        store.record(self.position(1, 0))
+        store.record_missing(2)
+        self.assertIs(store.for_assignment(2), MISSING)
+
+        self.clock += 30
+        self.assertIsNone(store.for_assignment(2))
+        self.assertIsNotNone(store.for_assignment(1))
+        self.clock += 31
+        self.assertIsNone(store.for_assignment(1))
+        self.assertEqual(store.drivers(), [])
+
+    def test_missing_marker_replaced_by_first_position(self):
+        store = LatestPositionStore(ttl=60)
+        store.record_missing(1)
+        position = self.position(1, 0)
+
+        store.record(position)
+        store.record_missing(1)
+
+        self.assertEqual(store.for_assignment(1), position)
+
+    def test_assignments_are_bounded(self):
+        store = LatestPositionStore(ttl=60, max_entries=2)
+        for assignment_id in (1, 2):
+            store.record(self.position(assignment_id, 0))
+        store.for_assignment(1)  # 2 devient la moins récemment utilisée
+
+        store.record(self.position(3, 0))
+
+        self.assertEqual(list(store._by_assignment), [1, 3])
+        self.assertIsNone(store.for_assignment(2))
+
+    def test_expired_entries_pruned_on_write(self):
+        store = LatestPositionStore(ttl=60, miss_ttl=10)
+        store.record_missing(1)
+        store.record(self.position(2, 0))
+
+        self.clock += 61
+        store.record(self.position(3, 0))
+
+        self.assertEqual(list(store._by_assignment), [3])
+
+    def test_local_missing_marker_checks_shared_cache(self):
+        # Deux processus partageant le cache
+        web = LatestPositionStore(ttl=60, cache_alias='default')
+        ingest = LatestPositionStore(ttl=60, cache_alias='default')
+        web.record_missing(1)
+        position = self.position(1, 0)
+
+        ingest.record(position)
+
+        self.assertEqual(web.for_assignment(1), position)
+
+
+class AssignmentPayloadTests(DeliveryTestMixin, TestCase):
+    """Nombre de requêtes constant et forme des réponses des affectations"""
+
+    LIST_KEYS = {'id', 'order_number', 'delivery_person_name', 'customer_name', 'status', 'status_display',
+                 'assigned_at', 'delivered_at'}
+    DRIVER_KEYS = {'id', 'order', 'order_number', 'customer_name', 'customer_phone', 'delivery_address',
+                   'delivery_latitude', 'delivery_longitude', 'delivery_description', 'order_notes', 'total',
+                   'payment_method', 'payment_status', 'items', 'status', 'status_display', 'notes',
+                   'refusal_reason', 'assigned_at', 'accepted_at', 'picked_up_at', 'delivered_at', 'run',
+                   'run_sequence'}
+    URL = '/api/delivery/assignments/'
+
+    def setUp(self):
+        super().setUp()
+        self.assignments = [self.create_detailed_assignment(index) for index in range(3)]
+
+    def create_detailed_assignment(self, index):
+        from menu.models import Category, MenuItem, MenuItemSize
+        from orders.models import OrderItem
+        from payments.models import Payment
+
+        assignment = self.create_assignment(index)
+        category, _ = Category.objects.get_or_create(name='Plats', slug='plats')
+        item = MenuItem.objects.create(category=category, name=f'Plat {index}', slug=f'plat-{index}',
+                                       description='-')
+        size = MenuItemSize.objects.create(menu_item=item, size='medium', price=Decimal('1000.00'))
+        for quantity in (1, 2):
+            OrderItem.objects.create(order=assignment.order, menu_item=item, size=size, item_name=item.name,
+                                     size_name='Moyen', item_price=size.price, quantity=quantity,
+                                     subtotal=size.price * quantity)
+        Payment.objects.create(order=assignment.order, amount=Decimal('1000.00'), payment_method='cash')
+        for minute in (1, 2):
+            DeliveryLocation.objects.create(assignment=assignment, latitude=Decimal('6.37'),
+                                            longitude=Decimal('2.42'),
+                                            timestamp=self.now_minus(minutes=10 - minute))
+        return assignment
+
+    def now_minus(self, **delta):
+        return timezone.now() - timedelta(**delta)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        client = self.client_for(self.manager)
+
+        with self.assertNumQueries(2):
+            response = client.get(self.URL)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(set(response.data['results'][0]), self.LIST_KEYS)
+
+        self.create_detailed_assignment(3)
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get(self.URL).data['count'], 4)
+
+        for action in ('pending', 'active'):
+            with self.assertNumQueries(1):
+                client.get(f'{self.URL}{action}/')
+        with self.assertNumQueries(1):
+            response = self.client_for(self.driver).get(f'{self.URL}my_deliveries/')
+        self.assertEqual(set(response.data[0]), self.LIST_KEYS)
+
+    def test_manager_detail_reads_latest_location_from_the_query(self):
+        assignment = self.assignments[0]
+        client = self.client_for(self.manager)
+        url = f'{self.URL}{assignment.id}/'
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+
+        # L'historique GPS n'est pas chargé : même nombre de requêtes avec 50 points de plus
+        DeliveryLocation.objects.bulk_create([
+            DeliveryLocation(assignment=assignment, latitude=Decimal('6.30'), longitude=Decimal('2.40'),
+                             timestamp=self.now_minus(hours=1, minutes=minute))
+            for minute in range(50)
+        ])
+        latest = assignment.locations.order_by('-timestamp').first()
+        with self.assertNumQueries(len(queries)) as context:
+            response = client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        location_queries = [query['sql'] for query in context.captured_queries if 'delivery_locations' in query['sql']]
+        self.assertEqual(len(location_queries), 1)
+        self.assertTrue(location_queries[0].startswith('SELECT "delivery_assignments"'))
+        self.assertIn('order_details', response.data)
+        self.assertEqual(response.data['latest_location'], {
+            'id': latest.id, 'assignment': assignment.id, 'latitude': '6.37000000', 'longitude': '2.42000000',
+            'accuracy': None, 'timestamp': latest.timestamp,
+        })
+
+    def test_driver_detail_is_lean(self):
+        assignment = self.assignments[0]
+
+        with self.assertNumQueries(2):
+            response = self.client_for(self.driver).get(f'{self.URL}{assignment.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), self.DRIVER_KEYS)
+        self.assertEqual((response.data['payment_method'], response.data['payment_status']), ('cash', 'pending'))
+        self.assertEqual(response.data['items'], [
+            {'item_name': 'Plat 0', 'size_name': 'Moyen', 'quantity': quantity, 'special_instructions': ''}
+            for quantity in (1, 2)
+        ])
+
+
+class TraceTests(DeliveryTestMixin, TestCase):
+
+    def add_points(self, assignment, points, start):
+        for index, (latitude, longitude) in enumerate(points):
+            DeliveryLocation.objects.create(
+                assignment=assignment, latitude=Decimal(f'{latitude:.8f}'),
+                longitude=Decimal(f'{longitude:.8f}'), accuracy=5.0,
+                timestamp=start + timedelta(seconds=10 * index)
+            )
+
+    def test_late_points_are_appended_to_compacted_trace(self):
+        assignment = self.create_assignment(1, status='delivered', delivered_at=timezone.now())
+        self.add_points(assignment, [(6.36, 2.41), (6.361, 2.41), (6.362, 2.412)], timezone.now())
+        compact_trace(assignment, tolerance_m=0)
+
+        # Fin de tampon GPS reçue après le compactage
+        late = timezone.now() + timedelta(minutes=1)
+        self.add_points(assignment, [(6.365, 2.415)], late)
+        stats = compact_trace(assignment, tolerance_m=0)
+
+        trace = DeliveryTrace.objects.get(assignment=assignment)
+        self.assertEqual(stats['raw_points'], 1)
+        self.assertEqual(trace.raw_point_count, 4)
+        self.assertEqual(trace.ended_at, late)
+        self.assertEqual(decode_polyline(trace.polyline),
+                         [(6.36, 2.41), (6.361, 2.41), (6.362, 2.412), (6.365, 2.415)])
+        self.assertFalse(DeliveryLocation.objects.filter(assignment=assignment).exists())
+
+    def test_points_older_than_compacted_trace_are_not_appended(self):
+        assignment = self.create_assignment(1, status='delivered', delivered_at=timezone.now())
+        start = timezone.now()
+        self.add_points(assignment, [(6.36, 2.41), (6.361, 2.41), (6.362, 2.412)], start)
+        compact_trace(assignment, tolerance_m=0)
+
+        # Un point antérieur à la fin du trajet et un point postérieur, reçus en retard
+        self.add_points(assignment, [(6.3605, 2.4105)], start + timedelta(seconds=5))
+        self.add_points(assignment, [(6.365, 2.415)], start + timedelta(minutes=1))
+        stats = compact_trace(assignment, tolerance_m=0)
+
+        trace = DeliveryTrace.objects.get(assignment=assignment)
+        self.assertEqual((stats['raw_points'], stats['late_points']), (2, 1))
+        self.assertEqual(trace.raw_point_count, 5)
+        self.assertEqual(trace.started_at, start)
+        self.assertEqual(decode_polyline(trace.polyline),
+                         [(6.36, 2.41), (6.361, 2.41), (6.362, 2.412), (6.365, 2.415)])
+        self.assertFalse(DeliveryLocation.objects.filter(assignment=assignment).exists())
+
+    def test_tracking_falls_back_to_trace(self):
+        assignment = self.create_assignment(1, status='delivered', delivered_at=timezone.now())
+        self.add_points(assignment, [(6.36, 2.41), (6.37, 2.42)], timezone.now())
+        compact_trace(assignment, tolerance_m=0)
+
+        response = self.client_for(self.manager).get(f'/api/delivery/assignments/{assignment.id}/tracking/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(point['latitude'], point['longitude']) for point in response.data],
+                         [('6.37000000', '2.42000000'), ('6.36000000', '2.41000000')])
+        trace = DeliveryTrace.objects.get(assignment=assignment)
+        self.assertEqual([point['timestamp'] for point in response.data], [trace.ended_at, trace.started_at])
+        self.assertTrue(all(point['timestamp_estimated'] for point in response.data))
+
+    def test_trace_timestamps_follow_distance(self):
+        start = timezone.now()
+        end = start + timedelta(minutes=30)
+        # Deux segments : 1 km puis 2 km vers le nord
+        points = [(6.36, 2.41), (6.36 + 1 / 111.195, 2.41), (6.36 + 3 / 111.195, 2.41)]
+
+        timestamps = interpolate_timestamps(points, start, end)
+
+        self.assertEqual((timestamps[0], timestamps[-1]), (start, end))
+        self.assertAlmostEqual((timestamps[1] - start).total_seconds(), 600, delta=1)
+        self.assertEqual(interpolate_timestamps(points, None, end), [None, None, end])
+        self.assertEqual(interpolate_timestamps([(6.36, 2.41)] * 3, start, end),
+                         [start, start + timedelta(minutes=15), end])
+
+
+class DriverIndexTests(DeliveryTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shared_index = geo.driver_index
+
+    def tearDown(self):
+        geo.driver_index = self.shared_index
+        geo._warmed = False
+
+    def test_stale_positions_are_skipped_and_evicted(self):
+        index = DriverGridIndex()
+        index.update(1, 6.36, 2.41)
+        index.update(2, 6.3601, 2.41, updated_at=time.monotonic() - 600)
+
+        self.assertEqual([match[1] for match in index.nearest(6.36, 2.41, max_age=300)], [1])
+        self.assertIsNone(index.get(2))
+        self.assertEqual(len(index), 1)
+
+    def test_nearest_refills_past_unavailable_drivers(self):
+        geo.driver_index = DriverGridIndex()
+        geo._warmed = True
+        busy = [User.objects.create(username=f'occupe-{i}', user_type='delivery', is_available=False) for i in range(3)]
+        for offset, driver in enumerate(busy):
+            geo.driver_index.update(driver.id, 6.36 + offset / 10000, 2.41)
+        geo.driver_index.update(self.driver.id, 6.37, 2.41)
+
+        client = self.client_for(self.manager)
+        url = '/api/accounts/delivery-persons/nearest/'
+        with self.assertNumQueries(2):  # Un passage k * 2, puis un passage élargi
+            response = client.get(url, {'latitude': 6.36, 'longitude': 2.41, 'k': 1})
+
+        self.assertEqual([match['delivery_person']['id'] for match in response.data], [self.driver.id])
+
+    def test_warm_up_loads_recent_positions_with_their_age(self):
+        geo.driver_index = DriverGridIndex()
+        geo._warmed = False
+        other = User.objects.create(username='ancien', user_type='delivery')
+        recent = self.create_assignment(1)
+        old = DeliveryAssignment.objects.create(order=self.create_order(2), delivery_person=other, status='picked_up')
+        now = timezone.now()
+        DeliveryLocation.objects.create(assignment=recent, latitude=Decimal('6.36'), longitude=Decimal('2.41'),
+                                        timestamp=now - timedelta(seconds=200))
+        DeliveryLocation.objects.create(assignment=old, latitude=Decimal('6.36'), longitude=Decimal('2.41'),
+                                        timestamp=now - timedelta(hours=2))
+
+        warm_driver_index(max_age=300)
+
+        self.assertEqual(len(geo.driver_index), 1)
+        self.assertIsNotNone(geo.driver_index.get(self.driver.id, max_age=300))
+        # L'âge réel est conservé : la position expire 100 s plus tard
+        self.assertIsNone(geo.driver_index.get(self.driver.id, max_age=150))
+
+
+class DispatchTests(DeliveryTestMixin, TestCase):
+
+    def test_invalid_orders_are_rejected(self):
+        client = self.client_for(self.manager)
+        for orders in (['1; DROP'], 'abc', [{'id': 1}]):
+            response = client.post('/api/delivery/assignments/dispatch/', {'orders': orders}, format='json')
+            self.assertEqual(response.status_code, 400, orders)
+
+    def test_stale_driver_positions_are_not_used(self):
+        from .dispatch import DispatchDriver, DispatchOrder, build_candidates, get_weights
+
+        order = DispatchOrder(order_id=1, latitude=6.36, longitude=2.41, waiting_minutes=0, excluded=frozenset())
+        drivers = [
+            DispatchDriver(driver_id=1, latitude=6.3601, longitude=2.41, position_age=900),
+            DispatchDriver(driver_id=2, latitude=6.37, longitude=2.42, position_age=10),
+        ]
+
+        candidates = build_candidates([order], drivers, get_weights(), max_age=300)
+
+        self.assertEqual([driver_id for _, driver_id, _ in candidates[1]], [2])
+
+    def test_refused_order_is_redispatched(self):
+        other = User.objects.create(username='livreur-2', user_type='delivery')
+        assignment = self.create_assignment(1, status='assigned')
+        Order.objects.filter(id=assignment.order_id).update(status='assigned', delivery_person=self.driver)
+        index = DriverGridIndex()
+        index.update(other.id, 6.371, 2.42)
+
+        with mock.patch.object(geo, 'driver_index', index), mock.patch.object(geo, '_warmed', True):
+            response = self.client_for(self.driver).post(
+                f'/api/delivery/assignments/{assignment.id}/refuse/', {'reason': 'Panne'}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['reassigned_to'], other.id)
+        assignment.refresh_from_db()
+        self.assertEqual((assignment.status, assignment.delivery_person_id), ('assigned', other.id))
+
+    def test_manual_reassignment_conflicts_with_concurrent_dispatch(self):
+        from .dispatch import assign_order
+
+        other = User.objects.create(username='livreur-2', user_type='delivery')
+        assignment = self.create_assignment(1, status='refused')
+        Order.objects.filter(id=assignment.order_id).update(status='ready')
+
+        def dispatched_first(order_id, *args, **kwargs):
+            # La répartition automatique affecte la commande entre la vérification et l'écriture
+            Order.objects.filter(id=order_id).update(status='assigned')
+            return assign_order(order_id, *args, **kwargs)
+
+        with mock.patch('delivery.views.assign_order', side_effect=dispatched_first):
+            response = self.client_for(self.manager).post('/api/delivery/assignments/', {
+                'order': assignment.order_id, 'delivery_person': other.id
+            }, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        assignment.refresh_from_db()
+        self.assertEqual((assignment.status, assignment.delivery_person_id), ('refused', self.driver.id))
+
+
+class RoutingTests(TestCase):
+
+    def test_route_order_along_a_street(self):
+        from .routing import plan_route
+
+        depot = (6.36, 2.41)
+        points = [(6.36, 2.41 + step / 1000) for step in (4, 1, 5, 2, 3)]
+
+        sequence, length = plan_route(points, start=depot)
+
+        self.assertEqual(sequence, [1, 3, 4, 0, 2])
+        self.assertAlmostEqual(length, haversine_m(*depot, 6.36, 2.415), delta=1)
+
+    def test_two_opt_improves_nearest_neighbour(self):
+        import random
+        from .routing import plan_route, route_length
+
+        depot = (6.36, 2.41)
+        for seed in range(20):
+            generator = random.Random(seed)
+            points = [(6.36 + generator.random() / 50, 2.41 + generator.random() / 50) for _ in range(8)]
+
+            greedy, greedy_length = plan_route(points, start=depot, max_passes=0)
+            sequence, length = plan_route(points, start=depot)
+
+            self.assertEqual(sorted(sequence), list(range(len(points))))
+            self.assertAlmostEqual(route_length(points, sequence, depot), length, delta=1e-6)
+            self.assertLessEqual(length, greedy_length + 1e-6)
+            # Aucune inversion de segment ne raccourcit encore le parcours
+            for i in range(len(sequence) - 1):
+                for j in range(i + 1, len(sequence)):
+                    reversed_sequence = sequence[:i] + sequence[i:j + 1][::-1] + sequence[j + 1:]
+                    self.assertGreater(route_length(points, reversed_sequence, depot), length - 1e-6)
+
+    def test_cluster_orders(self):
+        from .routing import cluster_orders
+
+        orders = [
+            (1, 6.3600, 2.4100, 0),
+            (2, 6.3650, 2.4120, 5),    # 600 m, 5 min plus tard
+            (3, 6.3610, 2.4090, 8),    # 150 m
+            (4, 6.3620, 2.4110, 40),   # proche mais hors fenêtre
+            (5, 6.4500, 2.5000, 1),    # 14 km
+        ]
+
+        groups = cluster_orders(orders, radius_m=2000, window_minutes=15, max_stops=2)
+
+        self.assertEqual(groups, [[1, 3], [5], [2], [4]])
+        self.assertEqual(cluster_orders(orders, radius_m=2000, window_minutes=15, max_stops=3)[0], [1, 3, 2])
+
+
+class RunTests(DeliveryTestMixin, TestCase):
+
+    def test_run_pickup_marks_every_accepted_stop(self):
+        orders = [self.create_order(index, longitude=f'2.4{index}', status='ready') for index in range(3)]
+        manager = self.client_for(self.manager)
+        response = manager.post('/api/delivery/runs/', {
+            'delivery_person': self.driver.id, 'orders': [order.id for order in orders]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        run_id = response.data['id']
+
+        driver = self.client_for(self.driver)
+        self.assertEqual(driver.post(f'/api/delivery/runs/{run_id}/pickup/').status_code, 400)
+        driver.post(f'/api/delivery/runs/{run_id}/accept/')
+        response = driver.post(f'/api/delivery/runs/{run_id}/pickup/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'in_progress')
+        self.assertEqual(
+            set(DeliveryAssignment.objects.filter(run_id=run_id).values_list('status', flat=True)), {'picked_up'}
+        )
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'in_delivery'})
+
+
+class ZoneTests(DeliveryTestMixin, TestCase):
+
+    def tearDown(self):
+        from . import zones
+
+        zones._index = None
+
+    def test_only_managers_can_write_zones(self):
+        body = {'name': 'Centre', 'polygon': [[6.34, 2.39], [6.34, 2.44], [6.39, 2.44]], 'delivery_fee': '500.00'}
+        customer = User.objects.create(username='client')
+        for user in (self.driver, customer):
+            client = self.client_for(user)
+            self.assertEqual(client.post('/api/delivery/zones/', body, format='json').status_code, 403)
+
+        response = self.client_for(self.manager).post('/api/delivery/zones/', body, format='json')
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/delivery/zones/{response.data['id']}/"
+
+        driver = self.client_for(self.driver)
+        self.assertEqual(driver.get(url).status_code, 200)
+        self.assertEqual(driver.patch(url, {'delivery_fee': '0.00'}, format='json').status_code, 403)
+        self.assertEqual(driver.put(url, body, format='json').status_code, 403)
+        self.assertEqual(driver.delete(url).status_code, 403)
+
+        admin = self.client_for(User.objects.create(username='admin', user_type='admin'))
+        self.assertEqual(admin.patch(url, {'delivery_fee': '0.00'}, format='json').status_code, 200)
+        self.assertEqual(admin.delete(url).status_code, 204)
+
+
+class AnalyticsTests(ThreadedTestCase):
+    """
+    Le recalcul et les processus web ne partagent que la base : le
+    recalcul passe par la commande, le processus web par une instance
+    DeliveryAnalytics distincte du singleton que la commande réinitialise.
+    """
+
+    def setUp(self):
+        self.analytics = DeliveryAnalytics(persist_interval=0, refresh_interval=3600)
+        self.now = timezone.now()
+
+    def observe(self, delivered_at):
+        self.analytics.observe({'created_at': delivered_at - timedelta(minutes=30), 'delivered_at': delivered_at})
+
+    def deliver(self, index, delivered_at):
+        order = Order.objects.create(
+            order_number=f'ANA-{index}', delivery_address='Cotonou', customer_name='Client',
+            customer_phone='0100000000', subtotal=1000, total=1000, status='delivered', delivered_at=delivered_at
+        )
+        Order.objects.filter(id=order.id).update(created_at=delivered_at - timedelta(minutes=30))
+        self.observe(delivered_at)
+
+    def total_count(self):
+        return self.analytics.summary(stage='total')['']['total']['count']
+
+    def stored_count(self):
+        return DeliveryStageSketch.objects.get(dimension='all', key='', stage='total').count
+
+    def backfill(self):
+        # Module importé avec le module de test : sa référence à write_sketches
+        # reste la vraie fonction quand un test la remplace dans delivery.analytics
+        call_command(backfill_delivery_analytics.Command(), stdout=StringIO())
+
+    def test_backfill_cutoff_drops_counted_pending_observations(self):
+        self.deliver(1, self.now - timedelta(minutes=5))
+        self.observe(self.now + timedelta(minutes=5))  # Livrée après la coupure du recalcul
+        self.assertEqual(self.total_count(), 2)
+
+        self.backfill()
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(DeliveryAnalyticsState.objects.get().version, 1)
+
+        self.assertEqual(self.total_count(), 2)
+        self.analytics.persist()
+        self.assertEqual(self.stored_count(), 2)
+
+    def test_backfill_during_persist_is_detected(self):
+        self.analytics.persist()  # État initial (pas de coupure) lu par le processus web
+        self.deliver(1, self.now - timedelta(minutes=5))
+        self.observe(self.now + timedelta(minutes=5))
+        real_write = write_sketches
+        calls = []
+
+        def backfill_then_write(sketches, **kwargs):
+            # Le recalcul valide entre la lecture de l'état et la fusion
+            if not calls:
+                self.backfill()
+            calls.append(kwargs['cutoff'])
+            return real_write(sketches, **kwargs)
+
+        with mock.patch('delivery.analytics.write_sketches', side_effect=backfill_then_write):
+            self.analytics.persist()
+
+        self.assertEqual(calls[0], None)
+        self.assertIsNotNone(calls[1])
+        self.assertEqual(self.stored_count(), 2)
+        self.assertEqual(self.total_count(), 2)
+
+    def test_refresh_during_persist_does_not_count_twice(self):
+        self.analytics.refresh()
+        self.observe(timezone.now())
+
+        def refresh():
+            try:
+                self.analytics.refresh()
+            finally:
+                close_old_connections()
+
+        def write_then_refresh(sketches, **kwargs):
+            written = write_sketches(sketches, **kwargs)
+            # Relecture concurrente entre l'écriture et la fusion dans _base
+            refresher = threading.Thread(target=refresh)
+            refresher.start()
+            refresher.join(0.2)
+            threads.append(refresher)
+            return written
+
+        threads = []
+        with mock.patch('delivery.analytics.write_sketches', side_effect=write_then_refresh):
+            self.analytics.persist()
+        threads[0].join()
+
+        self.assertEqual(self.total_count(), 1)
+
+
+class CashLedgerTests(DeliveryTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from payments.models import Payment
+
+        self.assignment = self.create_assignment(1)
+        self.payment = Payment.objects.create(order=self.assignment.order, amount=Decimal('4500.00'),
+                                              payment_method='cash')
+        self.url = f'/api/delivery/cash/{self.driver.id}/'
+
+    def balance(self):
+        from .models import DriverCashBalance
+
+        return DriverCashBalance.objects.get(delivery_person=self.driver)
+
+    def test_collection_is_recorded_once_per_order(self):
+        from .cash import record_cash_collection
+        from .models import DriverCashEntry
+
+        driver = self.client_for(self.driver)
+        url = f'/api/delivery/assignments/{self.assignment.id}/complete/'
+        self.assertEqual(driver.post(url).status_code, 200)
+        self.assertEqual(driver.post(url).status_code, 400)
+        # Second appel direct (livraison confirmée deux fois) : écarté par la contrainte unique
+        self.assertIsNone(record_cash_collection(self.assignment.order, self.driver.id))
+
+        self.assertEqual(DriverCashEntry.objects.filter(order=self.assignment.order).count(), 1)
+        self.assertEqual((self.balance().balance, self.balance().entries_count), (Decimal('4500.00'), 1))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_collection_on_cancelled_payment_is_flagged(self):
+        from .cash import record_cash_collection
+
+        self.payment.status = 'cancelled'
+        self.payment.save()
+
+        with self.assertLogs('delivery.cash', 'WARNING'):
+            entry = record_cash_collection(self.assignment.order, self.driver.id)
+
+        self.assertIn('à vérifier', entry.note)
+        self.assertEqual(self.balance().balance, Decimal('4500.00'))
+
+    def test_settlement_larger_than_balance_is_refused(self):
+        from .cash import record_cash_collection
+
+        record_cash_collection(self.assignment.order, self.driver.id)
+        manager = self.client_for(self.manager)
+
+        response = manager.post(f'{self.url}settle/', {'amount': '5000.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance().balance, Decimal('4500.00'))
+
+        response = manager.post(f'{self.url}settle/', {'amount': '4000.00'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['balance']['balance'], '500.00')
+        self.assertEqual(response.data['balance']['total_settled'], '4000.00')
+
+    def test_adjustment_requires_a_note(self):
+        manager = self.client_for(self.manager)
+
+        response = manager.post(f'{self.url}adjust/', {'amount': '-200.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.driver.cash_entries.exists())
+
+        response = manager.post(f'{self.url}adjust/', {'amount': '-200.00', 'note': 'Erreur de rendu'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['entry']['recorded_by'], self.manager.id)
+
+    def test_drivers_cannot_settle_or_adjust(self):
+        driver = self.client_for(self.driver)
+        for action in ('settle', 'adjust'):
+            response = driver.post(f'{self.url}{action}/', {'amount': '100.00', 'note': 'x'}, format='json')
+            self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.driver.cash_entries.exists())
+
+    def test_verify_balances_repairs_drifted_row(self):
+        from .cash import record_adjustment, record_cash_collection, verify_balances
+        from .models import DriverCashBalance
+
+        record_cash_collection(self.assignment.order, self.driver.id)
+        record_adjustment(self.driver.id, Decimal('-500.00'), recorded_by=self.manager, note='Écart')
+        self.assertEqual(verify_balances(), [])
+
+        DriverCashBalance.objects.filter(delivery_person=self.driver).update(balance=Decimal('9999.00'))
+        self.assertEqual(verify_balances(), [(self.driver.id, 'balance', Decimal('9999.00'), Decimal('4000.00'))])
+
+        self.assertEqual(len(verify_balances(fix=True)), 1)
+        self.assertEqual(verify_balances(), [])
+        self.assertEqual(self.balance().balance, Decimal('4000.00'))
+
+
+class DriverStatisticsTests(DeliveryTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ratings.models import DeliveryRating
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.other = User.objects.create(username='livreur2', user_type='delivery')
+        self.idle = User.objects.create(username='livreur3', user_type='delivery')
+        now = timezone.now()
+
+        for index, minutes in ((1, 10), (2, 20)):
+            self.create_assignment(index, status='delivered', picked_up_at=now - timedelta(minutes=minutes),
+                                   delivered_at=now)
+        self.create_assignment(3, status='picked_up')
+        refused = self.create_assignment(4, status='refused', refused_at=now)
+        DeliveryRefusal.objects.create(order=refused.order, delivery_person=self.driver)
+        # Refus d'une commande réattribuée depuis : l'affectation n'est plus au statut 'refused'
+        reassigned = self.create_assignment(5, status='assigned', delivery_person=self.other)
+        DeliveryRefusal.objects.create(order=reassigned.order, delivery_person=self.driver)
+        yesterday = self.create_assignment(6, status='delivered', delivery_person=self.other,
+                                           delivered_at=now - timedelta(days=1))
+        DeliveryAssignment.objects.filter(pk=yesterday.pk).update(assigned_at=now - timedelta(days=1))
+
+        for index, rating in ((1, 5), (2, 4), (3, 4)):
+            DeliveryRating.objects.create(order=Order.objects.get(order_number=f'CMD-{index}'),
+                                          delivery_person=self.driver, rating=rating)
+
+    def create_assignment(self, index, status='picked_up', delivery_person=None, **fields):
+        return DeliveryAssignment.objects.create(
+            order=self.create_order(index, status='in_delivery'), delivery_person=delivery_person or self.driver,
+            assigned_by=self.manager, status=status, **fields
+        )
+
+    def per_driver_figures(self, driver):
+        """Chiffres de l'ancienne action statistics (un count() par valeur)"""
+        from ratings.models import DeliveryRating
+
+        assignments = DeliveryAssignment.objects.filter(delivery_person=driver)
+        ratings = DeliveryRating.objects.filter(delivery_person=driver)
+        return {
+            'completed_deliveries': assignments.filter(status='delivered').count(),
+            'refused_deliveries': assignments.filter(status='refused').count(),
+            'total_ratings': ratings.count(),
+            'ratings_breakdown': {
+                '5_stars': ratings.filter(rating=5).count(),
+                '4_stars': ratings.filter(rating=4).count(),
+                '3_stars': ratings.filter(rating=3).count(),
+                '2_stars': ratings.filter(rating=2).count(),
+                '1_star': ratings.filter(rating=1).count(),
+            },
+        }
+
+    def test_grouped_statistics_match_per_driver_counts(self):
+        from .stats import compute_driver_statistics
+
+        with self.assertNumQueries(4):
+            statistics = compute_driver_statistics()
+
+        self.assertEqual(set(statistics), {self.driver.id, self.other.id, self.idle.id})
+        for driver in (self.driver, self.other, self.idle):
+            expected = self.per_driver_figures(driver)
+            # Refus comptés dans l'historique DeliveryRefusal et non plus sur les affectations
+            expected['refused_deliveries'] = DeliveryRefusal.objects.filter(delivery_person=driver).count()
+            self.assertEqual({field: statistics[driver.id][field] for field in expected}, expected)
+
+        driver = statistics[self.driver.id]
+        self.assertEqual(self.per_driver_figures(self.driver)['refused_deliveries'], 1)
+        self.assertEqual(driver['refused_deliveries'], 2)
+        self.assertEqual(driver['active_deliveries'], 1)
+        self.assertEqual(driver['average_delivery_minutes'], 15.0)
+        self.assertEqual(driver['today'], {'assigned': 4, 'completed': 2, 'refused': 2})
+        self.assertEqual(statistics[self.other.id]['today'], {'assigned': 1, 'completed': 0, 'refused': 0})
+        self.assertEqual(statistics[self.idle.id]['completed_deliveries'], 0)
+        self.assertIsNone(statistics[self.idle.id]['average_delivery_minutes'])
+
+        self.assertEqual(compute_driver_statistics(driver_ids=[self.other.id]),
+                         {self.other.id: statistics[self.other.id]})
+
+    def test_statistics_endpoint(self):
+        response = self.client_for(self.manager).get(f'/api/accounts/delivery-persons/{self.driver.id}/statistics/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['completed_deliveries'], 2)
+        self.assertEqual(response.data['refused_deliveries'], 2)
+        self.assertEqual(response.data['ratings_breakdown']['4_stars'], 2)
+
+    def test_fleet_statistics_cache(self):
+        client = self.client_for(self.manager)
+        url = '/api/accounts/delivery-persons/fleet_statistics/'
+
+        first = client.get(url).data
+        self.assertEqual(first['totals'], {'drivers': 3, 'available': 3, 'active_deliveries': 2,
+                                           'assigned_today': 5, 'completed_today': 2, 'refused_today': 2})
+        self.create_assignment(7, status='delivered', delivered_at=timezone.now())
+
+        # Servi depuis le cache jusqu'à expiration
+        self.assertEqual(client.get(url).data, first)
+
+        # ?fresh=1 recalcule et remplace l'entrée en cache
+        fresh = client.get(url, {'fresh': '1'}).data
+        self.assertEqual(fresh['totals']['completed_today'], 3)
+        self.assertEqual(client.get(url).data, fresh)
+
+        with override_settings(DELIVERY_TRACKING=dict(settings.DELIVERY_TRACKING, FLEET_STATS_TTL=0)):
+            self.create_assignment(8, status='delivered', delivered_at=timezone.now())
+            self.assertEqual(client.get(url).data['totals']['completed_today'], 4)
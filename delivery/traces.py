@@ -0,0 +1,226 @@
+# ===================================
+# delivery/traces.py
+# ===================================
+
+"""
+Compression des trajets GPS : simplification Douglas–Peucker puis
+encodage en polyline (format Google Encoded Polyline).
+"""
+
+import gzip
+import json
+import math
+from pathlib import Path
+from django.db import transaction
+from .models import DeliveryLocation, DeliveryTrace
+
+EARTH_RADIUS_M = 6371000
+POLYLINE_PRECISION = 5
+
+
+def _project(points):
+    """Projection équirectangulaire locale en mètres"""
+    if not points:
+        return []
+    ref_lat = math.radians(points[0][0])
+    cos_lat = math.cos(ref_lat)
+    return [
+        (math.radians(lon) * EARTH_RADIUS_M * cos_lat, math.radians(lat) * EARTH_RADIUS_M)
+        for lat, lon in points
+    ]
+
+
+def _segment_distance(p, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def simplify(points, tolerance_m=5.0):
+    """
+    Simplification Douglas–Peucker (itérative) d'une liste de (lat, lon).
+    Les points conservés sont à moins de `tolerance_m` mètres du tracé d'origine.
+    """
+    if len(points) < 3:
+        return list(points)
+
+    projected = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        max_distance, index = 0.0, None
+        for i in range(start + 1, end):
+            distance = _segment_distance(projected[i], projected[start], projected[end])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance_m:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    output = []
+    previous_lat = previous_lon = 0
+    for lat, lon in points:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        output.append(_encode_value(lat_i - previous_lat))
+        output.append(_encode_value(lon_i - previous_lon))
+        previous_lat, previous_lon = lat_i, lon_i
+    return ''.join(output)
+
+
+def decode_polyline(polyline, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(polyline):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(polyline[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def interpolate_timestamps(points, started_at, ended_at):
+    """
+    Horodatages estimés des points d'une polyline, qui ne les conserve pas :
+    répartis entre `started_at` et `ended_at` au prorata de la distance
+    parcourue (vitesse supposée constante). Sans début connu, seul le
+    dernier point est daté (fin du trajet).
+    """
+    if not points:
+        return []
+    if started_at is None or ended_at is None:
+        return [None] * (len(points) - 1) + [ended_at]
+
+    projected = _project(points)
+    distances = [0.0]
+    for a, b in zip(projected, projected[1:]):
+        distances.append(distances[-1] + math.hypot(b[0] - a[0], b[1] - a[1]))
+    total = distances[-1]
+    if total == 0:
+        # Livreur immobile : répartition uniforme
+        distances = list(range(len(points)))
+        total = max(len(points) - 1, 1)
+    duration = ended_at - started_at
+    return [started_at + duration * (distance / total) for distance in distances]
+
+
+def _raw_rows(assignment_id):
+    return list(
+        DeliveryLocation.objects.filter(assignment_id=assignment_id)
+        .order_by('timestamp')
+        .values_list('id', 'latitude', 'longitude', 'accuracy', 'timestamp')
+    )
+
+
+def _raw_size(row):
+    """Taille d'une position brute sérialisée (estimation du stockage)"""
+    id_, lat, lon, accuracy, timestamp = row
+    return len(json.dumps([id_, str(lat), str(lon), accuracy, timestamp.isoformat()]))
+
+
+def build_trace(assignment_id, tolerance_m=5.0):
+    """Trajet simplifié calculé à la volée (sans rien enregistrer)"""
+    rows = _raw_rows(assignment_id)
+    points = simplify([(float(lat), float(lon)) for _, lat, lon, _, _ in rows], tolerance_m)
+    return rows, points
+
+
+def compact_trace(assignment, tolerance_m=5.0, archive_dir=None):
+    """
+    Compresser le trajet d'une affectation : enregistrer la polyline,
+    archiver (optionnel, JSON Lines gzip) puis supprimer les points bruts.
+    Les points reçus après un premier compactage sont ajoutés au trajet
+    existant s'ils sont postérieurs à sa fin; les plus anciens (hors ordre,
+    la polyline ne garde pas les horodatages) sont archivés et supprimés
+    sans entrer dans le trajet. Retourne un dictionnaire de statistiques,
+    ou None s'il n'y a aucun point brut.
+    """
+    rows = _raw_rows(assignment.id)
+    if not rows:
+        return None
+
+    existing = DeliveryTrace.objects.filter(assignment=assignment).first()
+    previous = decode_polyline(existing.polyline) if existing else []
+    in_order = rows
+    if existing and existing.ended_at:
+        in_order = [row for row in rows if row[4] >= existing.ended_at]
+    points = simplify(previous + [(float(lat), float(lon)) for _, lat, lon, _, _ in in_order], tolerance_m)
+    polyline = encode_polyline(points)
+    raw_bytes = sum(_raw_size(row) for row in rows)
+
+    if archive_dir:
+        path = Path(archive_dir) / f'assignment-{assignment.id}.jsonl.gz'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Mode ajout : un nouveau membre gzip, l'archive reste lisible d'un bloc
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for id_, lat, lon, accuracy, timestamp in rows:
+                archive.write(json.dumps({
+                    'id': id_, 'assignment': assignment.id,
+                    'latitude': str(lat), 'longitude': str(lon),
+                    'accuracy': accuracy, 'timestamp': timestamp.isoformat(),
+                }) + '\n')
+
+    started_at, ended_at = rows[0][4], rows[-1][4]
+    late_points = len(rows) - len(in_order)
+    raw_point_count, total_bytes = len(rows), raw_bytes
+    if existing:
+        started_at = min(filter(None, [existing.started_at, started_at]))
+        ended_at = max(filter(None, [existing.ended_at, ended_at]))
+        raw_point_count += existing.raw_point_count
+        total_bytes += existing.raw_bytes
+
+    with transaction.atomic():
+        DeliveryTrace.objects.update_or_create(
+            assignment=assignment,
+            defaults={
+                'polyline': polyline,
+                'point_count': len(points),
+                'raw_point_count': raw_point_count,
+                'raw_bytes': total_bytes,
+                'started_at': started_at,
+                'ended_at': ended_at,
+            }
+        )
+        # Les points arrivés après la lecture ont un id supérieur et sont conservés
+        DeliveryLocation.objects.filter(
+            assignment_id=assignment.id, id__lte=max(row[0] for row in rows)
+        ).delete()
+
+    return {
+        'raw_points': len(rows),
+        'late_points': late_points,
+        'points': len(points),
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': len(polyline),
+    }
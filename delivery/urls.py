@@ -4,11 +4,17 @@
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DeliveryAssignmentViewSet, DeliveryLocationViewSet
+from .views import (
+    DeliveryAssignmentViewSet, DeliveryLocationViewSet, DeliveryRunViewSet, DeliveryZoneViewSet,
+    DriverCashViewSet
+)
 
 router = DefaultRouter()
 router.register(r'assignments', DeliveryAssignmentViewSet, basename='delivery-assignment')
 router.register(r'locations', DeliveryLocationViewSet, basename='delivery-location')
+router.register(r'runs', DeliveryRunViewSet, basename='delivery-run')
+router.register(r'zones', DeliveryZoneViewSet, basename='delivery-zone')
+router.register(r'cash', DriverCashViewSet, basename='driver-cash')
 
 urlpatterns = [
     path('', include(router.urls)),
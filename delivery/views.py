@@ -5,15 +5,39 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from decimal import Decimal
 from django.utils import timezone
-from django.db.models import Q
-from .models import DeliveryAssignment, DeliveryLocation
+from django.db.models import F, Prefetch, Q
+from django.shortcuts import get_object_or_404
+from django.db import transaction
+from .models import (
+    DeliveryAssignment, DeliveryLocation, DeliveryTrace, DeliveryRefusal, DeliveryRun, DeliveryZone,
+    DriverCashBalance
+)
 from .serializers import (
     DeliveryAssignmentSerializer, DeliveryAssignmentCreateSerializer,
-    DeliveryAssignmentListSerializer, DeliveryLocationSerializer
+    DeliveryAssignmentListSerializer, DeliveryLocationSerializer,
+    LocationBatchSerializer, DeliveryRunSerializer, DeliveryRunCreateSerializer,
+    DeliveryZoneSerializer, DriverAssignmentSerializer, DriverCashBalanceSerializer,
+    DriverCashEntrySerializer, DriverCashMovementSerializer, DispatchRequestSerializer
 )
-from orders.models import Order
+from .analytics import DIMENSIONS, STAGE_NAMES, delivery_analytics, record_delivery
+from .cash import CashLedgerError, record_adjustment, record_cash_collection, record_settlement
+from .dispatch import assign_order, redispatch_after_refusal, run_dispatch
+from .ingest import location_buffer
+from .positions import latest_location_annotations, record_location
+from .runs import RunError, create_run, refresh_run_status, suggest_runs
+from .traces import build_trace, encode_polyline, decode_polyline, interpolate_timestamps
+from .zones import ZoneError, quote_delivery
+from orders.models import Order, OrderItem
+from accounts.models import User
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+COORDINATE_PRECISION = Decimal('0.00000001')
 
 
 class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
@@ -22,17 +46,56 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
     serializer_class = DeliveryAssignmentSerializer
     permission_classes = [IsAuthenticated]
     
+    # Colonnes lues par DeliveryAssignmentListSerializer
+    LIST_FIELDS = (
+        'id', 'status', 'assigned_at', 'delivered_at', 'order_id', 'delivery_person_id',
+        'order__order_number', 'order__customer_name',
+        'delivery_person__first_name', 'delivery_person__last_name',
+    )
+    LIST_ACTIONS = ('list', 'my_deliveries', 'pending', 'active')
+    HISTORY_ACTIONS = ('trace', 'tracking')
+    DRIVER_ACTIONS = ('retrieve', 'accept', 'refuse', 'pickup', 'complete')
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return DeliveryAssignmentCreateSerializer
         if self.action == 'list':
             return DeliveryAssignmentListSerializer
+        if self._is_driver_view():
+            return DriverAssignmentSerializer
         return DeliveryAssignmentSerializer
     
+    def _is_driver_view(self):
+        return self.request.user.user_type == 'delivery' and self.action in self.DRIVER_ACTIONS
+    
+    def _detail_data(self, assignment):
+        return self.get_serializer_class()(assignment).data
+    
     def get_queryset(self):
-        queryset = DeliveryAssignment.objects.select_related(
-            'order', 'delivery_person', 'assigned_by'
-        ).prefetch_related('locations')
+        # Pas de préchargement de l'historique GPS : la dernière position est
+        # lue dans le cache ou annotée par sous-requête
+        if self.action in self.LIST_ACTIONS:
+            queryset = DeliveryAssignment.objects.select_related(
+                'order', 'delivery_person'
+            ).only(*self.LIST_FIELDS)
+        elif self.action in self.HISTORY_ACTIONS:
+            queryset = DeliveryAssignment.objects.only('id', 'delivery_person_id', 'status', 'assigned_at')
+        elif self._is_driver_view():
+            queryset = DeliveryAssignment.objects.select_related('order').prefetch_related(
+                Prefetch('order__items', queryset=OrderItem.objects.only(
+                    'id', 'order_id', 'item_name', 'size_name', 'quantity', 'special_instructions'
+                ))
+            ).annotate(
+                payment_method=F('order__payment__payment_method'),
+                payment_status=F('order__payment__status'),
+            )
+        else:
+            queryset = DeliveryAssignment.objects.select_related(
+                'order', 'order__device', 'order__manager', 'order__delivery_person',
+                'delivery_person', 'assigned_by'
+            ).prefetch_related(
+                'order__items__menu_item__category', 'order__items__size'
+            ).annotate(**latest_location_annotations())
         
         # Filtres
         status_param = self.request.query_params.get('status', None)
@@ -69,9 +132,33 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
             )
         
         if hasattr(order, 'assignment'):
+            if order.assignment.status != 'refused':
+                return Response(
+                    {'error': 'Cette commande est déjà assignée'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Réaffectation après refus : l'affectation existante est réutilisée
+            delivery_person_id = request.data.get('delivery_person')
+            if not User.objects.filter(id=delivery_person_id, user_type='delivery').exists():
+                return Response(
+                    {'error': 'Livreur non trouvé'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            assignment = assign_order(
+                order.id, delivery_person_id,
+                assigned_by=request.user if request.user.user_type == 'manager' else None,
+                notes=request.data.get('notes', '')
+            )
+            if assignment is None:
+                # Commande assignée ou modifiée entre-temps (répartition automatique concurrente)
+                return Response(
+                    {'error': 'La commande n\'est plus prête, elle a été modifiée entre-temps'},
+                    status=status.HTTP_409_CONFLICT
+                )
             return Response(
-                {'error': 'Cette commande est déjà assignée'},
-                status=status.HTTP_400_BAD_REQUEST
+                DeliveryAssignmentSerializer(assignment).data,
+                status=status.HTTP_201_CREATED
             )
         
         serializer = self.get_serializer(data=request.data)
@@ -125,7 +212,7 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         """Accepter une affectation (Livreur)"""
         assignment = self.get_object()
         
-        if assignment.delivery_person != request.user:
+        if assignment.delivery_person_id != request.user.id:
             return Response(
                 {'error': 'Non autorisé'},
                 status=status.HTTP_403_FORBIDDEN
@@ -141,15 +228,14 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         assignment.accepted_at = timezone.now()
         assignment.save()
         
-        serializer = DeliveryAssignmentSerializer(assignment)
-        return Response(serializer.data)
+        return Response(self._detail_data(assignment))
     
     @action(detail=True, methods=['post'])
     def refuse(self, request, pk=None):
         """Refuser une affectation (Livreur)"""
         assignment = self.get_object()
         
-        if assignment.delivery_person != request.user:
+        if assignment.delivery_person_id != request.user.id:
             return Response(
                 {'error': 'Non autorisé'},
                 status=status.HTTP_403_FORBIDDEN
@@ -161,10 +247,23 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Un arrêt refusé quitte sa tournée
+        run_id = assignment.run_id
+        
         assignment.status = 'refused'
         assignment.refused_at = timezone.now()
         assignment.refusal_reason = request.data.get('reason', '')
+        assignment.run = None
+        assignment.run_sequence = None
         assignment.save()
+        refresh_run_status(run_id)
+        
+        DeliveryRefusal.objects.create(
+            order_id=assignment.order_id,
+            delivery_person=request.user,
+            reason=assignment.refusal_reason,
+            created_at=assignment.refused_at
+        )
         
         # Remettre la commande en statut "ready"
         order = assignment.order
@@ -172,15 +271,78 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         order.delivery_person = None
         order.save()
         
-        serializer = DeliveryAssignmentSerializer(assignment)
-        return Response(serializer.data)
+        data = self._detail_data(assignment)
+        
+        # Réaffectation automatique (DISPATCH['REDISPATCH_ON_REFUSAL']) : un échec
+        # laisse la commande prête, le refus reste enregistré
+        try:
+            reassigned = redispatch_after_refusal(order.id)
+        except Exception:
+            logger.exception("Échec de la réaffectation de la commande %s", order.id)
+            reassigned = None
+        if reassigned is not None:
+            data['reassigned_to'] = reassigned.delivery_person_id
+        return Response(data)
+    
+    @action(detail=False, methods=['post'], url_path='dispatch')
+    def auto_dispatch(self, request):
+        """Affecter automatiquement les commandes prêtes (Manager)"""
+        if request.user.user_type == 'delivery':
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = DispatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dry_run = serializer.validated_data['dry_run']
+        plan, assignments = run_dispatch(
+            order_ids=serializer.validated_data.get('orders') or None,
+            dry_run=dry_run,
+            assigned_by=request.user if request.user.user_type == 'manager' else None
+        )
+        data = plan.as_dict()
+        data['dry_run'] = dry_run
+        data['assignments'] = [assignment.id for assignment in assignments]
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """Distributions des durées d'étape par livreur, heure ou zone (Manager)"""
+        if request.user.user_type == 'delivery':
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        dimension = request.query_params.get('dimension', 'all')
+        stage = request.query_params.get('stage')
+        if dimension not in DIMENSIONS:
+            return Response(
+                {'error': f"Dimension invalide (choix : {', '.join(DIMENSIONS)})"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if stage is not None and stage not in STAGE_NAMES:
+            return Response(
+                {'error': f"Étape invalide (choix : {', '.join(STAGE_NAMES)})"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'dimension': dimension,
+            'unit': 'seconds',
+            'relative_accuracy': delivery_analytics.relative_accuracy,
+            'results': delivery_analytics.summary(
+                dimension=dimension, key=request.query_params.get('key'), stage=stage
+            ),
+        })
     
     @action(detail=True, methods=['post'])
     def pickup(self, request, pk=None):
         """Confirmer la récupération de la commande (Livreur)"""
         assignment = self.get_object()
         
-        if assignment.delivery_person != request.user:
+        if assignment.delivery_person_id != request.user.id:
             return Response(
                 {'error': 'Non autorisé'},
                 status=status.HTTP_403_FORBIDDEN
@@ -195,6 +357,7 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         assignment.status = 'picked_up'
         assignment.picked_up_at = timezone.now()
         assignment.save()
+        refresh_run_status(assignment.run_id)
         
         # Mettre à jour le statut de la commande
         order = assignment.order
@@ -202,15 +365,14 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         order.picked_up_at = timezone.now()
         order.save()
         
-        serializer = DeliveryAssignmentSerializer(assignment)
-        return Response(serializer.data)
+        return Response(self._detail_data(assignment))
     
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
         """Marquer la livraison comme complétée (Livreur)"""
         assignment = self.get_object()
         
-        if assignment.delivery_person != request.user:
+        if assignment.delivery_person_id != request.user.id:
             return Response(
                 {'error': 'Non autorisé'},
                 status=status.HTTP_403_FORBIDDEN
@@ -225,27 +387,38 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
         assignment.status = 'delivered'
         assignment.delivered_at = timezone.now()
         assignment.save()
+        refresh_run_status(assignment.run_id)
         
         # Mettre à jour le statut de la commande
         order = assignment.order
         order.status = 'delivered'
         order.delivered_at = timezone.now()
         order.save()
+        record_delivery(order, assignment.delivery_person_id)
+        # Commande payée en espèces : le montant entre au registre du livreur
+        record_cash_collection(order, assignment.delivery_person_id)
         
         # Mettre à jour les statistiques du livreur
-        delivery_person = assignment.delivery_person
-        delivery_person.total_deliveries += 1
-        delivery_person.save()
+        User.objects.filter(id=assignment.delivery_person_id).update(
+            total_deliveries=F('total_deliveries') + 1
+        )
         
-        serializer = DeliveryAssignmentSerializer(assignment)
-        return Response(serializer.data)
+        return Response(self._detail_data(assignment))
+    
+    def _owned_assignment_id(self, request, pk):
+        """Vérification d'appartenance par une simple recherche indexée"""
+        try:
+            return DeliveryAssignment.objects.filter(
+                pk=pk, delivery_person=request.user
+            ).values_list('pk', flat=True).first()
+        except (TypeError, ValueError):
+            return None
     
     @action(detail=True, methods=['post'])
     def update_location(self, request, pk=None):
         """Mettre à jour la position du livreur"""
-        assignment = self.get_object()
-        
-        if assignment.delivery_person != request.user:
+        assignment_id = self._owned_assignment_id(request, pk)
+        if assignment_id is None:
             return Response(
                 {'error': 'Non autorisé'},
                 status=status.HTTP_403_FORBIDDEN
@@ -262,22 +435,106 @@ class DeliveryAssignmentViewSet(viewsets.ModelViewSet):
             )
         
         location = DeliveryLocation.objects.create(
-            assignment=assignment,
+            assignment_id=assignment_id,
             latitude=latitude,
             longitude=longitude,
             accuracy=accuracy
         )
+        record_location(location, request.user.id)
         
         serializer = DeliveryLocationSerializer(location)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['post'])
+    def update_locations(self, request, pk=None):
+        """Envoyer un lot de positions horodatées (écriture différée par lots)"""
+        assignment_id = self._owned_assignment_id(request, pk)
+        if assignment_id is None:
+            return Response(
+                {'error': 'Non autorisé'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = LocationBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        now = timezone.now()
+        locations = [
+            DeliveryLocation(
+                assignment_id=assignment_id,
+                latitude=Decimal(str(point['latitude'])).quantize(COORDINATE_PRECISION),
+                longitude=Decimal(str(point['longitude'])).quantize(COORDINATE_PRECISION),
+                accuracy=point.get('accuracy'),
+                timestamp=point.get('timestamp') or now
+            )
+            for point in serializer.validated_data['points']
+        ]
+        location_buffer.add(locations)
+        record_location(max(locations, key=lambda location: location.timestamp), request.user.id)
+        
+        return Response({'accepted': len(locations)}, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def trace(self, request, pk=None):
+        """Trajet compressé (polyline) d'une livraison"""
+        assignment = get_object_or_404(self.filter_queryset(self.get_queryset()), pk=pk)
+        
+        trace = DeliveryTrace.objects.filter(assignment=assignment).first()
+        if trace:
+            polyline = trace.polyline
+            data = {
+                'compacted': True,
+                'raw_point_count': trace.raw_point_count,
+                'started_at': trace.started_at,
+                'ended_at': trace.ended_at,
+            }
+        else:
+            # Livraison en cours ou non compactée : simplification à la volée
+            rows, points = build_trace(assignment.id)
+            polyline = encode_polyline(points)
+            data = {
+                'compacted': False,
+                'raw_point_count': len(rows),
+                'started_at': rows[0][4] if rows else None,
+                'ended_at': rows[-1][4] if rows else None,
+            }
+        
+        data.update({
+            'assignment': assignment.id,
+            'polyline': polyline,
+            'points': decode_polyline(polyline),
+        })
+        return Response(data)
+    
     @action(detail=True, methods=['get'])
     def tracking(self, request, pk=None):
         """Obtenir l'historique de position"""
         assignment = self.get_object()
         locations = assignment.locations.all()[:20]  # 20 dernières positions
         serializer = DeliveryLocationSerializer(locations, many=True)
-        return Response(serializer.data)
+        if serializer.data:
+            return Response(serializer.data)
+        
+        # Livraison compactée : points bruts supprimés, repli sur la polyline
+        trace = DeliveryTrace.objects.filter(assignment=assignment).first()
+        if trace is None:
+            return Response([])
+        points = decode_polyline(trace.polyline)
+        timestamps = interpolate_timestamps(points, trace.started_at, trace.ended_at)
+        return Response([
+            {
+                'id': None,
+                'assignment': assignment.id,
+                'latitude': f'{latitude:.8f}',
+                'longitude': f'{longitude:.8f}',
+                'accuracy': None,
+                # La polyline ne garde pas l'horodatage : estimé entre début et fin du trajet
+                'timestamp': timestamp,
+                'timestamp_estimated': True,
+            }
+            for (latitude, longitude), timestamp in reversed(list(zip(points, timestamps))[-20:])
+        ])
 
 
 class DeliveryLocationViewSet(viewsets.ReadOnlyModelViewSet):
@@ -296,3 +553,252 @@ class DeliveryLocationViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset.order_by('-timestamp')
 
 
+class DeliveryRunViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet pour les tournées multi-commandes"""
+    queryset = DeliveryRun.objects.all()
+    serializer_class = DeliveryRunSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = DeliveryRun.objects.select_related('delivery_person').prefetch_related('stops__order')
+        
+        status_param = self.request.query_params.get('status', None)
+        if status_param:
+            queryset = queryset.filter(status=status_param)
+        
+        # Si c'est un livreur, ne montrer que ses tournées
+        if self.request.user.user_type == 'delivery':
+            queryset = queryset.filter(delivery_person=self.request.user)
+        
+        return queryset.order_by('-created_at')
+    
+    def create(self, request, *args, **kwargs):
+        """Créer une tournée (Manager)"""
+        if request.user.user_type == 'delivery':
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = DeliveryRunCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            run = create_run(
+                serializer.validated_data['delivery_person'],
+                serializer.validated_data['orders'],
+                created_by=request.user
+            )
+        except RunError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(
+            DeliveryRunSerializer(self.get_queryset().get(id=run.id)).data,
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Regroupements proposés pour les commandes prêtes"""
+        try:
+            max_stops = int(request.query_params.get('max_stops', 0)) or None
+            radius_km = float(request.query_params.get('radius_km', 0)) or None
+            window_minutes = float(request.query_params.get('window_minutes', 0)) or None
+        except ValueError:
+            return Response(
+                {'error': 'Paramètres invalides'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(suggest_runs(max_stops, radius_km, window_minutes))
+    
+    def _driver_stops(self, request, stop_status):
+        run = self.get_object()
+        if run.delivery_person_id != request.user.id:
+            return run, None
+        return run, DeliveryAssignment.objects.filter(run_id=run.id, status=stop_status)
+    
+    @action(detail=True, methods=['post'])
+    def accept(self, request, pk=None):
+        """Accepter tous les arrêts de la tournée (Livreur)"""
+        run, stops = self._driver_stops(request, 'assigned')
+        if stops is None:
+            return Response(
+                {'error': 'Non autorisé'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        stops.update(status='accepted', accepted_at=timezone.now())
+        return Response(DeliveryRunSerializer(self.get_queryset().get(id=run.id)).data)
+    
+    @action(detail=True, methods=['post'])
+    def pickup(self, request, pk=None):
+        """Confirmer la récupération de toutes les commandes acceptées (Livreur)"""
+        run, stops = self._driver_stops(request, 'accepted')
+        if stops is None:
+            return Response(
+                {'error': 'Non autorisé'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        now = timezone.now()
+        # Mise à jour groupée (2 requêtes pour toute la tournée) : Order et
+        # DeliveryAssignment n'ont ni save() surchargé ni signal, seul le champ
+        # auto_now `updated_at` des commandes est renseigné explicitement. Les
+        # arrêts acceptés sont relus dans la transaction (verrou d'écriture) :
+        # un arrêt modifié entre-temps n'est pas marqué récupéré.
+        with transaction.atomic():
+            order_ids = list(stops.values_list('order_id', flat=True))
+            if order_ids:
+                DeliveryAssignment.objects.filter(
+                    run_id=run.id, order_id__in=order_ids, status='accepted'
+                ).update(status='picked_up', picked_up_at=now)
+                Order.objects.filter(id__in=order_ids).update(
+                    status='in_delivery', picked_up_at=now, updated_at=now
+                )
+        if not order_ids:
+            return Response(
+                {'error': "Les arrêts doivent d'abord être acceptés"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        refresh_run_status(run.id)
+        return Response(DeliveryRunSerializer(self.get_queryset().get(id=run.id)).data)
+
+
+class DeliveryZoneViewSet(viewsets.ModelViewSet):
+    """ViewSet pour les zones de livraison"""
+    queryset = DeliveryZone.objects.all()
+    serializer_class = DeliveryZoneSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_permissions(self):
+        if self.action == 'lookup':
+            return [AllowAny()]
+        return [IsAuthenticated()]
+    
+    def _check_manager(self, request):
+        # Les zones fixent les frais de livraison : écriture réservée aux managers et admins
+        if request.user.user_type not in ['manager', 'admin']:
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return None
+    
+    def create(self, request, *args, **kwargs):
+        forbidden = self._check_manager(request)
+        if forbidden is not None:
+            return forbidden
+        return super().create(request, *args, **kwargs)
+    
+    def update(self, request, *args, **kwargs):
+        # partial_update passe aussi par update
+        forbidden = self._check_manager(request)
+        if forbidden is not None:
+            return forbidden
+        return super().update(request, *args, **kwargs)
+    
+    def destroy(self, request, *args, **kwargs):
+        forbidden = self._check_manager(request)
+        if forbidden is not None:
+            return forbidden
+        return super().destroy(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'])
+    def lookup(self, request):
+        """Zone, frais et délai de livraison pour une adresse"""
+        try:
+            latitude = float(request.query_params.get('latitude'))
+            longitude = float(request.query_params.get('longitude'))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'latitude et longitude requises'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            zone = quote_delivery(latitude, longitude)
+        except ZoneError as e:
+            return Response(
+                {'deliverable': False, 'error': str(e)},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        if zone is None:
+            return Response({'deliverable': True, 'zone': None})
+        return Response(dict(zone.as_dict(), deliverable=True))
+
+
+class DriverCashViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet pour le registre d'espèces des livreurs (paiement à la livraison)"""
+    queryset = DriverCashBalance.objects.all()
+    serializer_class = DriverCashBalanceSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = DriverCashBalance.objects.select_related('delivery_person')
+        
+        # Si c'est un livreur, ne montrer que son solde
+        if self.request.user.user_type == 'delivery':
+            queryset = queryset.filter(delivery_person=self.request.user)
+        elif self.request.query_params.get('outstanding') == 'true':
+            queryset = queryset.filter(balance__gt=0)
+        
+        return queryset.order_by('-balance', 'delivery_person_id')
+    
+    @action(detail=True, methods=['get'])
+    def entries(self, request, pk=None):
+        """Historique des mouvements d'un livreur, du plus récent au plus ancien"""
+        balance = self.get_object()
+        queryset = balance.delivery_person.cash_entries.select_related('order')
+        
+        kind = request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        
+        page = self.paginate_queryset(queryset)
+        serializer = DriverCashEntrySerializer(page if page is not None else queryset, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'])
+    def settle(self, request, pk=None):
+        """Enregistrer une remise d'espèces du livreur (Manager)"""
+        return self._record(request, pk, record_settlement)
+    
+    @action(detail=True, methods=['post'])
+    def adjust(self, request, pk=None):
+        """Enregistrer un ajustement signé (Manager)"""
+        return self._record(request, pk, record_adjustment)
+    
+    def _record(self, request, pk, record):
+        if request.user.user_type == 'delivery':
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        driver = get_object_or_404(User, id=pk, user_type='delivery')
+        serializer = DriverCashMovementSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            entry = record(
+                driver.id, serializer.validated_data['amount'],
+                recorded_by=request.user, note=serializer.validated_data['note']
+            )
+        except CashLedgerError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'entry': DriverCashEntrySerializer(entry).data,
+            'balance': DriverCashBalanceSerializer(self.get_queryset().get(delivery_person_id=driver.id)).data,
+        }, status=status.HTTP_201_CREATED)
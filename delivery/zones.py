@@ -0,0 +1,199 @@
+# ===================================
+# delivery/zones.py
+# ===================================
+
+"""
+Zones de livraison : frais, minimum de commande et délai de base.
+
+Les zones actives sont chargées une fois en mémoire dans une grille : chaque
+cellule liste les zones dont le rectangle englobant la recouvre. Une
+recherche ne teste donc que quelques polygones (rectangle puis lancer de
+rayon). L'index est reconstruit quand une zone change (version en cache,
+incrémentée par signal) ou après DELIVERY_ZONES['INDEX_TTL'] secondes.
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+
+ZONES_VERSION_KEY = 'delivery:zones:version'
+MAX_CELLS_PER_SIDE = 64
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'DELIVERY_ZONES', {}).get(name, default)
+
+
+class ZoneError(Exception):
+    """Adresse non livrable"""
+
+    def __init__(self, message, field='delivery_address'):
+        super().__init__(message)
+        self.field = field
+
+
+def get_zones_version():
+    return cache.get(ZONES_VERSION_KEY, 0)
+
+
+def bump_zones_version():
+    """Invalider l'index des zones"""
+    if not cache.add(ZONES_VERSION_KEY, 1, timeout=None):
+        try:
+            cache.incr(ZONES_VERSION_KEY)
+        except ValueError:
+            cache.set(ZONES_VERSION_KEY, 1, timeout=None)
+
+
+def point_in_polygon(lat, lon, polygon):
+    """Lancer de rayon (longitude en abscisse, latitude en ordonnée)"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+@dataclass(frozen=True)
+class Zone:
+    """Zone compilée"""
+    zone_id: int
+    name: str
+    polygon: tuple
+    bbox: tuple  # (min_lat, min_lon, max_lat, max_lon)
+    delivery_fee: Decimal
+    minimum_order: Decimal
+    base_eta_minutes: int
+    priority: int = 0
+
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        return point_in_polygon(lat, lon, self.polygon)
+
+    def as_dict(self):
+        return {
+            'zone': self.zone_id,
+            'zone_name': self.name,
+            'delivery_fee': str(self.delivery_fee),
+            'minimum_order': str(self.minimum_order),
+            'base_eta_minutes': self.base_eta_minutes,
+        }
+
+
+def compile_zone(zone_id, name, polygon, delivery_fee, minimum_order, base_eta_minutes, priority=0):
+    points = tuple((float(lat), float(lon)) for lat, lon in polygon)
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    return Zone(
+        zone_id=zone_id,
+        name=name,
+        polygon=points,
+        bbox=(min(lats), min(lons), max(lats), max(lons)),
+        delivery_fee=delivery_fee,
+        minimum_order=minimum_order,
+        base_eta_minutes=base_eta_minutes,
+        priority=priority,
+    )
+
+
+class ZoneIndex:
+    """Grille de cellules → zones candidates, pour une version donnée"""
+
+    def __init__(self, zones, version=0, cell_size=0.01):
+        # Zones superposées : priorité décroissante, puis frais croissants
+        self.zones = tuple(sorted(zones, key=lambda zone: (-zone.priority, zone.delivery_fee, zone.zone_id)))
+        self.version = version
+
+        # Éviter qu'une très grande zone couvre des milliers de cellules
+        largest = max(
+            (max(zone.bbox[2] - zone.bbox[0], zone.bbox[3] - zone.bbox[1]) for zone in self.zones),
+            default=0
+        )
+        self.cell_size = max(cell_size, largest / MAX_CELLS_PER_SIDE)
+
+        cells = {}
+        for rank, zone in enumerate(self.zones):
+            min_i, min_j = self._cell(zone.bbox[0], zone.bbox[1])
+            max_i, max_j = self._cell(zone.bbox[2], zone.bbox[3])
+            for i in range(min_i, max_i + 1):
+                for j in range(min_j, max_j + 1):
+                    cells.setdefault((i, j), []).append(rank)
+        self._cells = {cell: tuple(self.zones[rank] for rank in sorted(ranks)) for cell, ranks in cells.items()}
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def __bool__(self):
+        return bool(self.zones)
+
+    def locate(self, lat, lon):
+        """Zone applicable au point, ou None"""
+        lat, lon = float(lat), float(lon)
+        for zone in self._cells.get(self._cell(lat, lon), ()):
+            if zone.contains(lat, lon):
+                return zone
+        return None
+
+
+def load_zone_index(version=0):
+    """Charger les zones actives (une seule requête)"""
+    from .models import DeliveryZone
+
+    rows = DeliveryZone.objects.filter(is_active=True).values_list(
+        'id', 'name', 'polygon', 'delivery_fee', 'minimum_order', 'base_eta_minutes', 'priority'
+    )
+    return ZoneIndex(
+        [compile_zone(*row) for row in rows],
+        version=version,
+        cell_size=_get_setting('CELL_SIZE', 0.01),
+    )
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_zone_index():
+    """Index courant, reconstruit quand les zones changent"""
+    global _index, _index_built_at
+    version = get_zones_version()
+    index = _index
+    if (index is not None and index.version == version
+            and time.monotonic() - _index_built_at < _get_setting('INDEX_TTL', 60)):
+        return index
+
+    with _index_lock:
+        if _index is None or _index is index:
+            _index = load_zone_index(version)
+            _index_built_at = time.monotonic()
+        return _index
+
+
+def quote_delivery(latitude, longitude):
+    """
+    Zone applicable à une adresse. Retourne None si aucune zone n'est
+    configurée (frais de livraison libres); lève ZoneError si l'adresse
+    n'est pas livrable.
+    """
+    index = get_zone_index()
+    if not index:
+        return None
+    if latitude is None or longitude is None:
+        raise ZoneError("Coordonnées de livraison requises", field='delivery_latitude')
+    zone = index.locate(latitude, longitude)
+    if zone is None:
+        raise ZoneError("Adresse hors zone de livraison")
+    return zone
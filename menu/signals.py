@@ -0,0 +1,18 @@
+# ===================================
+# menu/signals.py
+# ===================================
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Category, MenuItem, MenuItemSize
+from .versioning import bump_menu_version
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=MenuItem)
+@receiver([post_save, post_delete], sender=MenuItemSize)
+def menu_changed(sender, **kwargs):
+    """Toute modification du menu change sa version"""
+    # Après validation : une version nouvelle ne doit jamais être compilée avec les anciennes lignes
+    transaction.on_commit(bump_menu_version)
@@ -0,0 +1,21 @@
+# ===================================
+# menu/versioning.py
+# ===================================
+
+from django.core.cache import cache
+
+MENU_VERSION_KEY = 'menu:version'
+
+
+def get_menu_version():
+    """Version courante du menu (incrémentée à chaque modification)"""
+    return cache.get(MENU_VERSION_KEY, 0)
+
+
+def bump_menu_version():
+    """Invalider les structures compilées à partir du menu"""
+    if not cache.add(MENU_VERSION_KEY, 1, timeout=None):
+        try:
+            cache.incr(MENU_VERSION_KEY)
+        except ValueError:
+            cache.set(MENU_VERSION_KEY, 1, timeout=None)
@@ -18,6 +18,8 @@ class Order(models.Model):
     )
     
     order_number = models.CharField(max_length=20, unique=True, db_index=True)
+    # Clé fournie par le client pour rendre le checkout rejouable sans doublon
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
     device = models.ForeignKey(ClientDevice, on_delete=models.SET_NULL, null=True, related_name='orders')
     
     # Adresse de livraison
@@ -40,6 +42,8 @@ class Order(models.Model):
     
     # Prix
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    promo_code = models.CharField(max_length=50, blank=True)
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     
@@ -60,6 +64,10 @@ class Order(models.Model):
     class Meta:
         db_table = 'orders'
         ordering = ['-created_at']
+        indexes = [
+            # Historique des commandes par appareil (pagination par curseur)
+            models.Index(fields=['device', 'created_at'], name='orders_device_created_idx'),
+        ]
         
     def __str__(self):
         return f"Order {self.order_number} - {self.get_status_display()}"
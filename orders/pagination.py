@@ -0,0 +1,13 @@
+# ===================================
+# orders/pagination.py
+# ===================================
+
+from rest_framework.pagination import CursorPagination
+
+
+class OrderHistoryPagination(CursorPagination):
+    """Pagination par curseur (keyset) sur la date de création"""
+    ordering = '-created_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
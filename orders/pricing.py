@@ -0,0 +1,258 @@
+# ===================================
+# orders/pricing.py
+# ===================================
+
+"""
+Moteur de tarification.
+
+La table des prix (formats, disponibilité, règles de frais et remises) est
+compilée une fois en structure immuable puis réutilisée tant que la version
+du menu ne change pas. Panier, checkout et création de commande passent
+tous par `PriceTable.quote` : aucun accès base par ligne et des résultats
+identiques partout.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import time as dt_time
+from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
+from django.conf import settings
+from django.utils import timezone
+from menu.versioning import get_menu_version
+
+
+CENT = Decimal('0.01')
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PRICING', {}).get(name, default)
+
+
+class PricingError(Exception):
+    """Ligne ou code promo impossible à tarifer"""
+
+    def __init__(self, message, field='items'):
+        super().__init__(message)
+        self.field = field
+
+
+@dataclass(frozen=True)
+class SizePrice:
+    """Prix d'un format tel que compilé dans la table"""
+    size_id: int
+    menu_item_id: int
+    category_slug: str
+    item_name: str
+    size_name: str
+    price: Decimal
+    is_available: bool
+
+
+@dataclass(frozen=True)
+class HappyHour:
+    """Remise en pourcentage sur une plage horaire (et des catégories)"""
+    start: dt_time
+    end: dt_time
+    percent: Decimal
+    categories: frozenset = frozenset()
+    weekdays: frozenset = frozenset()
+
+    def applies(self, size_price, at):
+        if self.weekdays and at.weekday() not in self.weekdays:
+            return False
+        if self.categories and size_price.category_slug not in self.categories:
+            return False
+        current = at.time()
+        if self.start <= self.end:
+            return self.start <= current < self.end
+        return current >= self.start or current < self.end
+
+
+@dataclass(frozen=True)
+class PromoCode:
+    """Code promo en pourcentage ou montant fixe sur le sous-total"""
+    code: str
+    kind: str
+    value: Decimal
+    min_subtotal: Decimal = Decimal('0')
+
+    def discount_for(self, subtotal):
+        if subtotal < self.min_subtotal:
+            raise PricingError(
+                f"Le code {self.code} exige un minimum de {self.min_subtotal}", field='promo_code'
+            )
+        if self.kind == 'percent':
+            return money(subtotal * self.value / 100)
+        return min(money(self.value), subtotal)
+
+
+@dataclass(frozen=True)
+class LineQuote:
+    size: SizePrice
+    quantity: int
+    unit_price: Decimal
+    subtotal: Decimal
+    special_instructions: str = ''
+
+
+@dataclass(frozen=True)
+class Quote:
+    lines: tuple
+    subtotal: Decimal
+    discount: Decimal
+    delivery_fee: Decimal
+    total: Decimal
+    promo_code: str = ''
+
+
+class PriceTable:
+    """Table de prix immuable pour une version donnée du menu"""
+
+    def __init__(self, version, sizes, happy_hours=(), promo_codes=None, free_delivery_over=None):
+        self.version = version
+        self.sizes = MappingProxyType(dict(sizes))
+        self.happy_hours = tuple(happy_hours)
+        self.promo_codes = MappingProxyType(dict(promo_codes or {}))
+        self.free_delivery_over = free_delivery_over
+
+    def get(self, size_id):
+        try:
+            return self.sizes.get(int(size_id))
+        except (TypeError, ValueError):
+            return None
+
+    def unit_price(self, size_price, at):
+        price = size_price.price
+        for happy_hour in self.happy_hours:
+            if happy_hour.applies(size_price, at):
+                price = money(price * (100 - happy_hour.percent) / 100)
+        return price
+
+    def price_line(self, size_id, quantity, at=None, special_instructions=''):
+        size_price = self.get(size_id)
+        if size_price is None:
+            raise PricingError(f"Format {size_id} introuvable.")
+        at = timezone.localtime(at)
+        unit_price = self.unit_price(size_price, at)
+        return LineQuote(size_price, quantity, unit_price, unit_price * quantity, special_instructions)
+
+    def quote(self, lines, delivery_fee=0, promo_code=None, at=None, require_available=True):
+        """
+        Tarifer des lignes (size_id, quantity, special_instructions).
+        Lève PricingError si un format est introuvable ou indisponible.
+        """
+        at = at or timezone.now()
+        quoted = []
+        for size_id, quantity, special_instructions in lines:
+            line = self.price_line(size_id, quantity, at, special_instructions)
+            if require_available and not line.size.is_available:
+                raise PricingError('Article ou format non disponible')
+            quoted.append(line)
+
+        subtotal = sum((line.subtotal for line in quoted), Decimal('0'))
+
+        discount = Decimal('0')
+        if promo_code:
+            promo = self.promo_codes.get(promo_code.strip().upper())
+            if promo is None:
+                raise PricingError('Code promo invalide', field='promo_code')
+            discount = promo.discount_for(subtotal)
+
+        delivery_fee = money(delivery_fee or 0)
+        if self.free_delivery_over is not None and subtotal >= self.free_delivery_over:
+            delivery_fee = Decimal('0.00')
+
+        return Quote(
+            lines=tuple(quoted),
+            subtotal=money(subtotal),
+            discount=discount,
+            delivery_fee=delivery_fee,
+            total=money(subtotal - discount + delivery_fee),
+            promo_code=promo_code.strip().upper() if promo_code else '',
+        )
+
+
+def _parse_time(value):
+    hours, minutes = value.split(':')
+    return dt_time(int(hours), int(minutes))
+
+
+def compile_price_table(version):
+    """Compiler la table des prix à partir du menu (une seule requête)"""
+    from menu.models import MenuItemSize
+
+    size_names = dict(MenuItemSize.SIZE_CHOICES)
+    rows = MenuItemSize.objects.values_list(
+        'id', 'menu_item_id', 'menu_item__category__slug', 'menu_item__name',
+        'size', 'price', 'is_available', 'menu_item__is_available'
+    )
+    sizes = {
+        size_id: SizePrice(
+            size_id=size_id,
+            menu_item_id=menu_item_id,
+            category_slug=category_slug,
+            item_name=item_name,
+            size_name=size_names.get(size, size),
+            price=price,
+            is_available=size_available and item_available,
+        )
+        for size_id, menu_item_id, category_slug, item_name, size, price,
+            size_available, item_available in rows
+    }
+
+    happy_hours = [
+        HappyHour(
+            start=_parse_time(rule['start']),
+            end=_parse_time(rule['end']),
+            percent=Decimal(str(rule['percent'])),
+            categories=frozenset(rule.get('categories', ())),
+            weekdays=frozenset(rule.get('weekdays', ())),
+        )
+        for rule in _get_setting('HAPPY_HOURS', [])
+    ]
+
+    promo_codes = {
+        code.upper(): PromoCode(
+            code=code.upper(),
+            kind=rule.get('kind', 'percent'),
+            value=Decimal(str(rule['value'])),
+            min_subtotal=Decimal(str(rule.get('min_subtotal', 0))),
+        )
+        for code, rule in _get_setting('PROMO_CODES', {}).items()
+    }
+
+    free_delivery_over = _get_setting('FREE_DELIVERY_OVER', None)
+    if free_delivery_over is not None:
+        free_delivery_over = Decimal(str(free_delivery_over))
+
+    return PriceTable(version, sizes, happy_hours, promo_codes, free_delivery_over)
+
+
+_table = None
+_table_built_at = 0.0
+_table_lock = threading.Lock()
+
+
+def get_price_table():
+    """
+    Table courante, recompilée quand la version du menu change
+    (ou après TABLE_TTL secondes, pour les autres processus).
+    """
+    global _table, _table_built_at
+    version = get_menu_version()
+    table = _table
+    if (table is not None and table.version == version
+            and time.monotonic() - _table_built_at < _get_setting('TABLE_TTL', 60)):
+        return table
+
+    with _table_lock:
+        if _table is None or _table is table:
+            _table = compile_price_table(version)
+            _table_built_at = time.monotonic()
+        return _table
@@ -3,8 +3,10 @@
 # orders/serializers.py
 # ===================================
 
+from django.db import transaction
 from rest_framework import serializers
 from .models import Order, OrderItem, Cart, CartItem
+from .pricing import PricingError, get_price_table
 from menu.serializers import MenuItemListSerializer, MenuItemSizeSerializer
 from accounts.serializers import DeliveryPersonSerializer, ClientDeviceSerializer
 
@@ -40,13 +42,13 @@ class OrderSerializer(serializers.ModelSerializer):
             'delivery_description', 'customer_name', 'customer_phone',
             'customer_email', 'status', 'status_display', 'manager',
             'manager_info', 'delivery_person', 'delivery_person_info',
-            'subtotal', 'delivery_fee', 'total', 'notes',
+            'subtotal', 'discount', 'promo_code', 'delivery_fee', 'total', 'notes',
             'cancellation_reason', 'refusal_reason', 'items',
             'created_at', 'accepted_at', 'ready_at', 'assigned_at',
             'picked_up_at', 'delivered_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'order_number', 'subtotal', 'total',
+            'id', 'order_number', 'subtotal', 'discount', 'promo_code', 'total',
             'created_at', 'accepted_at', 'ready_at', 'assigned_at',
             'picked_up_at', 'delivered_at', 'updated_at'
         ]
@@ -64,6 +66,7 @@ class OrderSerializer(serializers.ModelSerializer):
 class OrderCreateSerializer(serializers.ModelSerializer):
     """Serializer pour la création d'une commande"""
     items = serializers.ListField(child=serializers.DictField(), write_only=True)
+    promo_code = serializers.CharField(required=False, allow_blank=True, write_only=True)
     
     class Meta:
         model = Order
@@ -71,7 +74,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             'device', 'delivery_address', 'delivery_latitude',
             'delivery_longitude', 'delivery_description',
             'customer_name', 'customer_phone', 'customer_email',
-            'delivery_fee', 'notes', 'items'
+            'delivery_fee', 'promo_code', 'notes', 'items'
         ]
     
     def validate_items(self, value):
@@ -80,42 +83,38 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         return value
     
     def create(self, validated_data):
-        from menu.models import MenuItem, MenuItemSize
-        import uuid
+        from .services import create_order, quote_order
         
         items_data = validated_data.pop('items')
         
-        # Générer le numéro de commande
-        validated_data['order_number'] = f"ORD-{uuid.uuid4().hex[:8].upper()}"
-        
-        # Calculer le sous-total
-        subtotal = 0
-        for item_data in items_data:
-            size = MenuItemSize.objects.get(id=item_data['size_id'])
-            subtotal += size.price * item_data['quantity']
-        
-        validated_data['subtotal'] = subtotal
-        validated_data['total'] = subtotal + validated_data.get('delivery_fee', 0)
-        
-        # Créer la commande
-        order = Order.objects.create(**validated_data)
-        
-        # Créer les items
-        for item_data in items_data:
-            size = MenuItemSize.objects.get(id=item_data['size_id'])
-            OrderItem.objects.create(
-                order=order,
-                menu_item=size.menu_item,
-                size=size,
-                item_name=size.menu_item.name,
-                size_name=size.get_size_display(),
-                item_price=size.price,
-                quantity=item_data['quantity'],
-                subtotal=size.price * item_data['quantity'],
-                special_instructions=item_data.get('special_instructions', '')
+        try:
+            quote, _ = quote_order(
+                [
+                    (item_data.get('size_id'), item_data['quantity'], item_data.get('special_instructions', ''))
+                    for item_data in items_data
+                ],
+                validated_data
             )
+        except PricingError as e:
+            raise serializers.ValidationError({e.field: str(e)})
         
-        return order
+        with transaction.atomic():
+            return create_order(validated_data, quote)
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    """Serializer pour les informations de livraison lors du checkout"""
+    promo_code = serializers.CharField(required=False, allow_blank=True)
+    idempotency_key = serializers.CharField(max_length=64, required=False, allow_blank=True, write_only=True)
+    
+    class Meta:
+        model = Order
+        fields = [
+            'delivery_address', 'delivery_latitude',
+            'delivery_longitude', 'delivery_description',
+            'customer_name', 'customer_phone', 'customer_email',
+            'delivery_fee', 'promo_code', 'notes', 'idempotency_key'
+        ]
 
 
 class OrderListSerializer(serializers.ModelSerializer):
@@ -132,9 +131,25 @@ class OrderListSerializer(serializers.ModelSerializer):
         ]
     
     def get_items_count(self, obj):
+        # Valeur annotée par la requête si disponible
+        if hasattr(obj, 'num_items'):
+            return obj.num_items
         return obj.items.count()
 
 
+class OrderHistorySerializer(serializers.ModelSerializer):
+    """Serializer compact pour l'historique des commandes d'un appareil"""
+    items_count = serializers.IntegerField(source='num_items', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_number', 'status', 'status_display',
+            'total', 'items_count', 'created_at', 'delivered_at'
+        ]
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     """Serializer pour CartItem"""
     menu_item_details = MenuItemListSerializer(source='menu_item', read_only=True)
@@ -151,7 +166,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'added_at', 'updated_at']
     
     def get_item_total(self, obj):
-        return obj.size.price * obj.quantity
+        table = get_price_table()
+        if table.get(obj.size_id) is None:
+            return obj.size.price * obj.quantity
+        return table.price_line(obj.size_id, obj.quantity).subtotal
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -172,5 +190,13 @@ class CartSerializer(serializers.ModelSerializer):
         return sum(item.quantity for item in obj.items.all())
     
     def get_total_amount(self, obj):
-        return sum(item.size.price * item.quantity for item in obj.items.all())
+        # Même calcul que le checkout, sans exiger la disponibilité
+        try:
+            quote = get_price_table().quote(
+                [(item.size_id, item.quantity, '') for item in obj.items.all()],
+                require_available=False
+            )
+        except PricingError:
+            return sum(item.size.price * item.quantity for item in obj.items.all())
+        return quote.subtotal
 
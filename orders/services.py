@@ -0,0 +1,209 @@
+# ===================================
+# orders/services.py
+# ===================================
+
+import uuid
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from .models import Order, OrderItem, CartItem
+from .pricing import PricingError, get_price_table
+from delivery.zones import ZoneError, quote_delivery
+
+
+class CheckoutError(Exception):
+    """Erreur métier levée lors de la transformation d'un panier"""
+
+
+class IdempotencyConflict(CheckoutError):
+    """Clé d'idempotence déjà utilisée par un autre appareil (409)"""
+
+
+def generate_order_number():
+    """Numéro de commande au format ORD-XXXXXXXX"""
+    return f"ORD-{uuid.uuid4().hex[:8].upper()}"
+
+
+def create_order(order_data, quote):
+    """
+    Créer une commande et ses articles en une passe à partir d'un devis
+    calculé par le moteur de tarification (`orders.pricing`).
+    """
+    order_data = dict(order_data)
+    order_data.pop('delivery_fee', None)
+    order_data.pop('promo_code', None)
+
+    order = Order.objects.create(
+        order_number=generate_order_number(),
+        subtotal=quote.subtotal,
+        discount=quote.discount,
+        promo_code=quote.promo_code,
+        delivery_fee=quote.delivery_fee,
+        total=quote.total,
+        **order_data
+    )
+
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            menu_item_id=line.size.menu_item_id,
+            size_id=line.size.size_id,
+            item_name=line.size.item_name,
+            size_name=line.size.size_name,
+            item_price=line.unit_price,
+            quantity=line.quantity,
+            subtotal=line.subtotal,
+            special_instructions=line.special_instructions
+        )
+        for line in quote.lines
+    ])
+
+    return order
+
+
+def quote_order(lines, order_data):
+    """
+    Devis d'une commande : tarification et zone de livraison.
+    Les frais de livraison sont ceux de la zone; ceux envoyés par le client
+    ne servent que si aucune zone n'est configurée. Lève PricingError.
+    Retourne (quote, zone).
+    """
+    try:
+        zone = quote_delivery(order_data.get('delivery_latitude'), order_data.get('delivery_longitude'))
+    except ZoneError as e:
+        raise PricingError(str(e), field=e.field)
+    
+    quote = get_price_table().quote(
+        lines,
+        delivery_fee=zone.delivery_fee if zone else order_data.get('delivery_fee', 0),
+        promo_code=order_data.get('promo_code'),
+    )
+    if zone and quote.subtotal < zone.minimum_order:
+        raise PricingError(
+            f"Minimum de commande de {zone.minimum_order} pour la zone {zone.name}"
+        )
+    return quote, zone
+
+
+def find_idempotent_order(idempotency_key, device_id):
+    """Commande déjà créée avec cette clé, ou None"""
+    if not idempotency_key:
+        return None
+    order = Order.objects.filter(idempotency_key=idempotency_key).first()
+    if order and order.device_id != device_id:
+        raise IdempotencyConflict("Clé d'idempotence déjà utilisée par un autre appareil")
+    return order
+
+
+def checkout_cart(cart, cart_items, order_data, idempotency_key=None):
+    """
+    Transformer un panier en commande dans une seule transaction.
+    `cart_items` sont les lignes du panier déjà chargées.
+    Retourne (order, created).
+    """
+    try:
+        quote, _ = quote_order(
+            [(item.size_id, item.quantity, item.special_instructions) for item in cart_items],
+            order_data
+        )
+    except PricingError as e:
+        raise CheckoutError(str(e))
+
+    try:
+        with transaction.atomic():
+            order = create_order(
+                dict(order_data, device_id=cart.device_id, idempotency_key=idempotency_key or None),
+                quote
+            )
+            # Ne supprimer que les lignes facturées
+            CartItem.objects.filter(
+                cart_id=cart.pk, id__in=[item.id for item in cart_items]
+            ).delete()
+    except IntegrityError:
+        # Checkout concurrent avec la même clé : renvoyer la commande gagnante
+        # (IdempotencyConflict si elle appartient à un autre appareil)
+        order = find_idempotent_order(idempotency_key, cart.device_id)
+        if order is None:
+            raise
+        return order, False
+
+    return order, True
+
+
+def revalidate_order_lines(order):
+    """
+    Revalider les articles d'une commande passée contre la table de prix
+    courante (disponibilité et prix), sans requête par article.
+    Retourne (lines, report) où `lines` ne contient que les articles disponibles.
+    """
+    table = get_price_table()
+    now = timezone.now()
+
+    lines = []
+    report_items = []
+    previous_total = Decimal('0')
+    current_total = Decimal('0')
+    for item in order.items.all():
+        size = table.get(item.size_id)
+        available = bool(size and size.is_available)
+        current_price = table.price_line(item.size_id, 1, now).unit_price if size else None
+
+        report_items.append({
+            'order_item': item.id,
+            'item_name': item.item_name,
+            'size_name': item.size_name,
+            'quantity': item.quantity,
+            'previous_price': item.item_price,
+            'current_price': current_price,
+            'price_changed': available and current_price != item.item_price,
+            'available': available,
+        })
+
+        if available:
+            lines.append((size, item.quantity, item.special_instructions))
+            previous_total += item.item_price * item.quantity
+            current_total += current_price * item.quantity
+
+    report = {
+        'items': report_items,
+        'unavailable_count': sum(1 for line in report_items if not line['available']),
+        'previous_subtotal': previous_total,
+        'current_subtotal': current_total,
+        'difference': current_total - previous_total,
+    }
+    return lines, report
+
+
+def add_lines_to_cart(cart, lines):
+    """
+    Fusionner des lignes (SizePrice, quantity, special_instructions)
+    dans un panier avec une insertion groupée
+    """
+    existing = {
+        (cart_item.menu_item_id, cart_item.size_id): cart_item
+        for cart_item in CartItem.objects.filter(cart=cart)
+    }
+
+    to_create = []
+    to_update = []
+    for size, quantity, special_instructions in lines:
+        cart_item = existing.get((size.menu_item_id, size.size_id))
+        if cart_item:
+            cart_item.quantity += quantity
+            if cart_item.pk and cart_item not in to_update:
+                to_update.append(cart_item)
+        else:
+            cart_item = CartItem(
+                cart=cart,
+                menu_item_id=size.menu_item_id,
+                size_id=size.size_id,
+                quantity=quantity,
+                special_instructions=special_instructions
+            )
+            existing[(size.menu_item_id, size.size_id)] = cart_item
+            to_create.append(cart_item)
+
+    with transaction.atomic():
+        CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
@@ -1,3 +1,430 @@
-from django.test import TestCase
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.models import ClientDevice
+from menu.models import Category, MenuItem, MenuItemSize
+from menu.versioning import get_menu_version
+from RestoOnline.idempotency import store
+from . import pricing
+from .models import Cart, CartItem, Order, OrderItem
+from .pricing import PricingError, get_price_table
+from .services import quote_order
 
-# Create your tests here.
+HAPPY_HOURS = [
+    {'start': '15:00', 'end': '17:00', 'percent': 20, 'categories': ['plats']},
+    {'start': '22:00', 'end': '02:00', 'percent': 10, 'categories': ['boissons']},
+]
+PROMO_CODES = {
+    'bienvenue': {'kind': 'percent', 'value': 10},
+    'moins500': {'kind': 'amount', 'value': 500, 'min_subtotal': 2000},
+    'moins9000': {'kind': 'amount', 'value': 9000},
+}
+
+
+def at(hour, minute=0):
+    return timezone.make_aware(datetime(2024, 3, 15, hour, minute))
+
+
+class PricingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        pricing._table = None
+        plats = Category.objects.create(name='Plats', slug='plats')
+        boissons = Category.objects.create(name='Boissons', slug='boissons')
+        self.sizes = []
+        for index, (category, price) in enumerate([(plats, '2500.00'), (plats, '1800.50'), (boissons, '700.00')]):
+            item = MenuItem.objects.create(category=category, name=f'Article {index}', slug=f'article-{index}',
+                                           description='-')
+            self.sizes.append(MenuItemSize.objects.create(menu_item=item, size='medium', price=Decimal(price)))
+        self.plat, self.plat_bis, self.boisson = self.sizes
+
+    def tearDown(self):
+        # Tables compilées à partir de lignes annulées par le rollback du test
+        from delivery import zones
+
+        pricing._table = None
+        zones._index = None
+        cache.clear()
+
+    def lines(self, *pairs):
+        return [(size.id, quantity, '') for size, quantity in pairs]
+
+    def test_table_matches_database(self):
+        MenuItemSize.objects.filter(id=self.plat_bis.id).update(is_available=False)
+        MenuItem.objects.filter(id=self.boisson.menu_item_id).update(is_available=False)
+        pricing._table = None
+
+        table = get_price_table()
+
+        self.assertEqual(len(table.sizes), MenuItemSize.objects.count())
+        for size in MenuItemSize.objects.select_related('menu_item__category'):
+            compiled = table.get(size.id)
+            self.assertEqual(compiled.price, size.price)
+            self.assertEqual(compiled.category_slug, size.menu_item.category.slug)
+            self.assertEqual(compiled.is_available, size.is_available and size.menu_item.is_available)
+        self.assertIsNone(table.get('inconnu'))
+
+    def test_menu_edit_bumps_version_and_recompiles(self):
+        table = get_price_table()
+        version = get_menu_version()
+        self.assertIs(get_price_table(), table)
+
+        self.plat.price = Decimal('3000.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plat.save()
+            # Version inchangée tant que la modification n'est pas validée
+            self.assertEqual(get_menu_version(), version)
+
+        self.assertGreater(get_menu_version(), version)
+        refreshed = get_price_table()
+        self.assertIsNot(refreshed, table)
+        self.assertEqual(refreshed.get(self.plat.id).price, Decimal('3000.00'))
+        # L'ancienne table est immuable : les devis en cours restent cohérents
+        self.assertEqual(table.get(self.plat.id).price, Decimal('2500.00'))
+
+    @override_settings(PRICING={'HAPPY_HOURS': HAPPY_HOURS})
+    def test_happy_hours(self):
+        table = get_price_table()
+        lines = self.lines((self.plat, 2), (self.boisson, 1))
+
+        during = table.quote(lines, at=at(16))
+        self.assertEqual(during.lines[0].unit_price, Decimal('2000.00'))
+        self.assertEqual(during.lines[1].unit_price, Decimal('700.00'))
+        self.assertEqual(during.subtotal, Decimal('4700.00'))
+
+        # Fin de plage exclue
+        self.assertEqual(table.quote(lines, at=at(17)).subtotal, Decimal('5700.00'))
+        # Plage à cheval sur minuit
+        self.assertEqual(table.quote(lines, at=at(1, 30)).lines[1].unit_price, Decimal('630.00'))
+        self.assertEqual(table.quote(lines, at=at(21, 59)).lines[1].unit_price, Decimal('700.00'))
+
+    @override_settings(PRICING={'PROMO_CODES': PROMO_CODES})
+    def test_promo_codes(self):
+        table = get_price_table()
+        lines = self.lines((self.plat_bis, 1))
+
+        quote = table.quote(lines, promo_code=' Bienvenue ')
+        self.assertEqual((quote.discount, quote.total, quote.promo_code), (Decimal('180.05'), Decimal('1620.45'), 'BIENVENUE'))
+
+        with self.assertRaises(PricingError) as context:
+            table.quote(lines, promo_code='MOINS500')
+        self.assertEqual(context.exception.field, 'promo_code')
+        self.assertEqual(table.quote(self.lines((self.plat, 1)), promo_code='moins500').total, Decimal('2000.00'))
+
+        # Remise fixe plafonnée au sous-total
+        self.assertEqual(table.quote(lines, delivery_fee=500, promo_code='MOINS9000').total, Decimal('500.00'))
+
+        with self.assertRaises(PricingError):
+            table.quote(lines, promo_code='INCONNU')
+
+    @override_settings(PRICING={'FREE_DELIVERY_OVER': 5000})
+    def test_quote_order(self):
+        quote, zone = quote_order(self.lines((self.plat, 1)), {'delivery_fee': '500'})
+        self.assertIsNone(zone)
+        self.assertEqual((quote.subtotal, quote.delivery_fee, quote.total),
+                         (Decimal('2500.00'), Decimal('500.00'), Decimal('3000.00')))
+
+        quote, _ = quote_order(self.lines((self.plat, 2)), {'delivery_fee': '500'})
+        self.assertEqual((quote.delivery_fee, quote.total), (Decimal('0.00'), Decimal('5000.00')))
+
+        self.boisson.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boisson.save()
+        with self.assertRaises(PricingError):
+            quote_order(self.lines((self.boisson, 1)), {})
+        with self.assertRaises(PricingError):
+            quote_order([(999999, 1, '')], {})
+
+    def test_zone_fee_replaces_client_fee(self):
+        from delivery.models import DeliveryZone
+
+        DeliveryZone.objects.create(
+            name='Centre', polygon=[[6.34, 2.39], [6.34, 2.44], [6.39, 2.44], [6.39, 2.39]],
+            delivery_fee=Decimal('700.00'), minimum_order=Decimal('3000.00')
+        )
+        address = {'delivery_latitude': 6.36, 'delivery_longitude': 2.41, 'delivery_fee': '0'}
+
+        quote, zone = quote_order(self.lines((self.plat, 2)), address)
+        self.assertEqual(zone.name, 'Centre')
+        self.assertEqual((quote.delivery_fee, quote.total), (Decimal('700.00'), Decimal('5700.00')))
+
+        with self.assertRaises(PricingError):
+            quote_order(self.lines((self.plat, 1)), address)
+        with self.assertRaises(PricingError):
+            quote_order(self.lines((self.plat, 2)), dict(address, delivery_latitude=7.0))
+
+
+class CheckoutTests(TestCase):
+
+    address = {'delivery_address': 'Cotonou', 'customer_name': 'Client',
+               'customer_phone': '0100000000', 'delivery_fee': '0'}
+
+    def setUp(self):
+        cache.clear()
+        store.clear()
+        pricing._table = None
+        category = Category.objects.create(name='Plats', slug='plats')
+        item = MenuItem.objects.create(category=category, name='Riz', slug='riz', description='-')
+        self.small = MenuItemSize.objects.create(menu_item=item, size='small', price=Decimal('1500.00'))
+        self.large = MenuItemSize.objects.create(menu_item=item, size='large', price=Decimal('2500.00'))
+        self.cart = self.create_cart('appareil-1')
+        self.client = APIClient()
+
+    def tearDown(self):
+        from delivery import zones
+
+        pricing._table = None
+        zones._index = None
+        store.clear()
+        cache.clear()
+
+    def create_cart(self, device_id):
+        cart = Cart.objects.create(device=ClientDevice.objects.create(device_id=device_id))
+        CartItem.objects.create(cart=cart, menu_item=self.small.menu_item, size=self.small, quantity=2)
+        CartItem.objects.create(cart=cart, menu_item=self.large.menu_item, size=self.large, quantity=1)
+        return cart
+
+    def checkout(self, cart, key=None, header=None):
+        data = dict(self.address, idempotency_key=key) if key is not None else self.address
+        headers = {'HTTP_IDEMPOTENCY_KEY': header} if header else {}
+        return self.client.post(reverse('cart-checkout', args=[cart.pk]), data, format='json', **headers)
+
+    def test_replayed_key_returns_same_order(self):
+        first = self.checkout(self.cart, key='cle-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['total'], '5500.00')
+        self.assertFalse(self.cart.items.exists())
+
+        replay = self.checkout(self.cart, key='cle-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.data['order_number'], first.data['order_number'])
+
+        # Même clé par l'en-tête, hors du stockage d'idempotence : retrouvée en base
+        replay = self.checkout(self.cart, header='cle-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.data['order_number'], first.data['order_number'])
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+    def test_key_from_another_device_conflicts(self):
+        self.assertEqual(self.checkout(self.cart, key='cle-1').status_code, 201)
+        other = self.create_cart('appareil-2')
+
+        for response in (self.checkout(other, key='cle-1'), self.checkout(other, header='cle-1')):
+            self.assertEqual(response.status_code, 409)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(other.items.count(), 2)
+
+    def test_invalid_key_is_rejected(self):
+        responses = [
+            self.checkout(self.cart, key='x' * 65),
+            self.checkout(self.cart, header='x' * 65),
+            self.checkout(self.cart, key=['cle']),
+        ]
+
+        for response in responses:
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('idempotency_key', response.data)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_concurrent_checkout_returns_winning_order(self):
+        # La vérification préalable ne voit pas encore la commande concurrente :
+        # l'insertion échoue sur la contrainte unique et la commande gagnante est renvoyée
+        winner = Order.objects.create(
+            order_number='ORD-GAGNANT', idempotency_key='cle-1', device=self.cart.device,
+            delivery_address='Cotonou', customer_name='Client', customer_phone='0100000000',
+            subtotal=5500, total=5500
+        )
+        other = self.create_cart('appareil-2')
+
+        with mock.patch('orders.views.find_idempotent_order', return_value=None):
+            response = self.checkout(self.cart, key='cle-1')
+            conflict = self.checkout(other, key='cle-1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['order_number'], winner.order_number)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+        # Transaction annulée : les paniers ne sont pas vidés
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertEqual(other.items.count(), 2)
+
+    def test_cart_lines_deleted_only_on_success(self):
+        MenuItemSize.objects.filter(id=self.large.id).update(is_available=False)
+        pricing._table = None
+
+        response = self.checkout(self.cart, key='cle-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+
+        MenuItemSize.objects.filter(id=self.large.id).update(is_available=True)
+        pricing._table = None
+        with mock.patch('orders.services.create_order', side_effect=RuntimeError('panne')):
+            with self.assertRaises(RuntimeError):
+                self.checkout(self.cart, key='cle-1')
+        self.assertEqual(self.cart.items.count(), 2)
+
+        self.assertEqual(self.checkout(self.cart, key='cle-1').status_code, 201)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_items_written_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout(self.cart)
+
+        self.assertEqual(response.status_code, 201)
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "order_items"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted((line['size_name'], line['quantity'], line['subtotal']) for line in response.data['items']),
+            [('Grand', 1, '2500.00'), ('Petit', 2, '3000.00')]
+        )
+
+
+class ReorderTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        store.clear()
+        pricing._table = None
+        category = Category.objects.create(name='Plats', slug='plats')
+        self.sizes = {}
+        for name, price in [('Riz', '1500.00'), ('Poulet', '2500.00'), ('Jus', '700.00')]:
+            item = MenuItem.objects.create(category=category, name=name, slug=name.lower(), description='-')
+            self.sizes[name] = MenuItemSize.objects.create(menu_item=item, size='medium', price=Decimal(price))
+        self.device = ClientDevice.objects.create(device_id='appareil-1')
+        self.order = Order.objects.create(
+            order_number='ORD-PASSEE', device=self.device, status='delivered',
+            delivery_address='Cotonou', customer_name='Client', customer_phone='0100000000',
+            subtotal=Decimal('5600.00'), total=Decimal('5600.00')
+        )
+        # Riz payé 1200 à l'époque, les autres au prix courant
+        for name, price, quantity in [('Riz', '1200.00', 2), ('Poulet', '2500.00', 1), ('Jus', '700.00', 1)]:
+            size = self.sizes[name]
+            OrderItem.objects.create(
+                order=self.order, menu_item=size.menu_item, size=size, item_name=name, size_name='Moyen',
+                item_price=Decimal(price), quantity=quantity, subtotal=Decimal(price) * quantity
+            )
+        self.client = APIClient()
+
+    def tearDown(self):
+        from delivery import zones
+
+        pricing._table = None
+        zones._index = None
+        store.clear()
+        cache.clear()
+
+    def reorder(self, **data):
+        data.setdefault('device_id', 'appareil-1')
+        return self.client.post(reverse('order-reorder', args=[self.order.order_number]), data, format='json')
+
+    def report_by_name(self, report):
+        return {line['item_name']: line for line in report['items']}
+
+    def test_price_report_and_unavailable_items(self):
+        MenuItemSize.objects.filter(id=self.sizes['Jus'].id).update(is_available=False)
+        pricing._table = None
+
+        response = self.reorder()
+
+        self.assertEqual(response.status_code, 200)
+        report = response.data['price_report']
+        lines = self.report_by_name(report)
+        self.assertEqual((lines['Riz']['previous_price'], lines['Riz']['current_price']),
+                         (Decimal('1200.00'), Decimal('1500.00')))
+        self.assertTrue(lines['Riz']['price_changed'])
+        self.assertFalse(lines['Poulet']['price_changed'])
+        self.assertFalse(lines['Jus']['available'])
+        self.assertFalse(lines['Jus']['price_changed'])
+        self.assertEqual(report['unavailable_count'], 1)
+        self.assertEqual(
+            (report['previous_subtotal'], report['current_subtotal'], report['difference']),
+            (Decimal('4900.00'), Decimal('5500.00'), Decimal('600.00'))
+        )
+        self.assertEqual(
+            {(item['menu_item'], item['quantity']) for item in response.data['cart']['items']},
+            {(self.sizes['Riz'].menu_item_id, 2), (self.sizes['Poulet'].menu_item_id, 1)}
+        )
+
+    def test_deleted_item_is_skipped(self):
+        # Format absent de la table de prix (supprimé du menu)
+        table = get_price_table()
+        without_poulet = pricing.PriceTable(
+            table.version, {size_id: size for size_id, size in table.sizes.items()
+                            if size_id != self.sizes['Poulet'].id}
+        )
+
+        with mock.patch('orders.services.get_price_table', return_value=without_poulet):
+            response = self.reorder(target='order')
+
+        self.assertEqual(response.status_code, 201)
+        line = self.report_by_name(response.data['price_report'])['Poulet']
+        self.assertEqual((line['available'], line['current_price']), (False, None))
+        self.assertEqual(
+            sorted(item['item_name'] for item in response.data['order']['items']), ['Jus', 'Riz']
+        )
+
+    def test_reorder_into_cart_merges_lines(self):
+        cart = Cart.objects.create(device=self.device)
+        CartItem.objects.create(cart=cart, menu_item=self.sizes['Riz'].menu_item, size=self.sizes['Riz'], quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reorder(target='cart')
+
+        self.assertEqual(response.status_code, 200)
+        # Une insertion groupée pour les nouvelles lignes, une mise à jour pour les existantes
+        writes = [query['sql'].split(' ')[0] for query in queries if '"cart_items"' in query['sql']
+                  and not query['sql'].startswith('SELECT')]
+        self.assertEqual(sorted(writes), ['INSERT', 'UPDATE'])
+        self.assertEqual(response.data['cart']['id'], cart.id)
+        quantities = dict(CartItem.objects.filter(cart=cart).values_list('size__menu_item__name', 'quantity'))
+        self.assertEqual(quantities, {'Riz': 3, 'Poulet': 1, 'Jus': 1})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_reorder_as_new_order(self):
+        response = self.reorder(target='order', customer_name='Autre nom')
+
+        self.assertEqual(response.status_code, 201)
+        new_order = Order.objects.get(order_number=response.data['order']['order_number'])
+        self.assertNotEqual(new_order.pk, self.order.pk)
+        self.assertEqual(new_order.device, self.device)
+        self.assertEqual(new_order.delivery_address, 'Cotonou')
+        self.assertEqual(new_order.customer_name, 'Autre nom')
+        self.assertEqual(new_order.status, 'pending')
+        # Prix courants, pas ceux de la commande d'origine
+        self.assertEqual(new_order.subtotal, Decimal('6200.00'))
+        self.assertFalse(Cart.objects.exists())
+
+    def test_other_device_is_forbidden(self):
+        ClientDevice.objects.create(device_id='appareil-2')
+
+        for device_id in ('appareil-2', ''):
+            for target in ('cart', 'order'):
+                self.assertEqual(self.reorder(device_id=device_id, target=target).status_code, 403)
+
+        Order.objects.filter(pk=self.order.pk).update(device=None)
+        self.assertEqual(self.reorder().status_code, 403)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_invalid_target_or_nothing_available(self):
+        self.assertEqual(self.reorder(target='livraison').status_code, 400)
+
+        MenuItemSize.objects.update(is_available=False)
+        pricing._table = None
+        response = self.reorder()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['price_report']['unavailable_count'], 3)
+        self.assertFalse(Cart.objects.exists())
@@ -7,11 +7,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
+from RestoOnline.idempotency import idempotent
 from .models import Order, OrderItem, Cart, CartItem
 from .serializers import (
     OrderSerializer, OrderCreateSerializer, OrderListSerializer,
-    CartSerializer, CartItemSerializer
+    CartSerializer, CartItemSerializer, CheckoutSerializer
+)
+from .pricing import PricingError
+from .services import (
+    CheckoutError, IdempotencyConflict, checkout_cart, find_idempotent_order,
+    create_order, quote_order, revalidate_order_lines, add_lines_to_cart
 )
 
 
@@ -22,7 +29,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     lookup_field = 'order_number'
     
     def get_permissions(self):
-        if self.action in ['create', 'track']:
+        if self.action in ['create', 'track', 'reorder']:
             return [AllowAny()]
         return [IsAuthenticated()]
     
@@ -33,6 +40,10 @@ class OrderViewSet(viewsets.ModelViewSet):
             return OrderListSerializer
         return OrderSerializer
     
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
     def get_queryset(self):
         queryset = Order.objects.select_related(
             'device', 'manager', 'delivery_person'
@@ -143,19 +154,17 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, order_number=None):
-        """Annuler une commande (Client ou Manager)"""
+        """Annuler une commande (Client ou Manager); un paiement en ligne réglé est remboursé"""
+        from payments.refunds import cancel_and_refund
+        
         order = self.get_object()
         
-        if order.status in ['delivered', 'cancelled']:
+        if not cancel_and_refund(order, request.data.get('reason', '')):
             return Response(
                 {'error': 'Cette commande ne peut pas être annulée'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = 'cancelled'
-        order.cancellation_reason = request.data.get('reason', '')
-        order.save()
-        
         return Response({'status': 'cancelled'})
     
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
@@ -167,10 +176,10 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Ajouter la position du livreur si en livraison
         data = serializer.data
         if order.status == 'in_delivery' and hasattr(order, 'assignment'):
-            from delivery.models import DeliveryLocation
-            latest_location = DeliveryLocation.objects.filter(
-                assignment=order.assignment
-            ).first()
+            from delivery.positions import latest_position
+            latest_location = latest_position(
+                order.assignment.id, order.assignment.delivery_person_id
+            )
             
             if latest_location:
                 data['delivery_location'] = {
@@ -181,6 +190,78 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         return Response(data)
     
+    @action(detail=True, methods=['post'])
+    @idempotent
+    def reorder(self, request, order_number=None):
+        """Recommander une commande passée (dans le panier ou en nouvelle commande)"""
+        order = self.get_object()
+        device_id = request.data.get('device_id')
+        target = request.data.get('target', 'cart')
+        
+        if not order.device or order.device.device_id != device_id:
+            return Response(
+                {'error': 'Cette commande n\'appartient pas à cet appareil'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if target not in ['cart', 'order']:
+            return Response(
+                {'error': "target doit valoir 'cart' ou 'order'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        lines, report = revalidate_order_lines(order)
+        if not lines:
+            return Response(
+                {'error': 'Aucun article de cette commande n\'est disponible', 'price_report': report},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if target == 'cart':
+            cart, _ = Cart.objects.get_or_create(device=order.device)
+            add_lines_to_cart(cart, lines)
+            return Response({
+                'price_report': report,
+                'cart': CartSerializer(cart).data
+            })
+        
+        # Nouvelle commande avec les informations de livraison précédentes
+        order_data = {
+            'delivery_address': order.delivery_address,
+            'delivery_latitude': order.delivery_latitude,
+            'delivery_longitude': order.delivery_longitude,
+            'delivery_description': order.delivery_description,
+            'customer_name': order.customer_name,
+            'customer_phone': order.customer_phone,
+            'customer_email': order.customer_email,
+            'delivery_fee': order.delivery_fee,
+        }
+        order_data.update({
+            field: value for field, value in request.data.items()
+            if field in CheckoutSerializer.Meta.fields
+        })
+        serializer = CheckoutSerializer(data=order_data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            quote, _ = quote_order(
+                [(size.size_id, quantity, instructions) for size, quantity, instructions in lines],
+                serializer.validated_data
+            )
+        except PricingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            new_order = create_order(
+                dict(serializer.validated_data, device=order.device), quote
+            )
+        
+        return Response({
+            'price_report': report,
+            'order': OrderSerializer(new_order).data
+        }, status=status.HTTP_201_CREATED)
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Statistiques des commandes"""
@@ -226,7 +307,32 @@ class CartViewSet(viewsets.ModelViewSet):
         cart, _ = Cart.objects.get_or_create(device=device)
         
         serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        data = serializer.data
+        
+        # Devis de livraison pour l'adresse fournie (zone, frais, délai)
+        latitude = request.query_params.get('latitude')
+        longitude = request.query_params.get('longitude')
+        if latitude and longitude:
+            data['delivery'] = self._delivery_quote(latitude, longitude, data['total_amount'])
+        return Response(data)
+    
+    def _delivery_quote(self, latitude, longitude, subtotal):
+        from delivery.zones import ZoneError, quote_delivery
+        
+        try:
+            zone = quote_delivery(float(latitude), float(longitude))
+        except ValueError:
+            return {'deliverable': False, 'error': 'Coordonnées invalides'}
+        except ZoneError as e:
+            return {'deliverable': False, 'error': str(e)}
+        
+        if zone is None:
+            return {'deliverable': True, 'zone': None}
+        
+        quote = dict(zone.as_dict(), deliverable=True)
+        if subtotal < zone.minimum_order:
+            quote['missing_amount'] = str(zone.minimum_order - subtotal)
+        return quote
     
     @action(detail=True, methods=['post'])
     def add_item(self, request, pk=None):
@@ -317,50 +423,48 @@ class CartViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def checkout(self, request, pk=None):
         """Transformer le panier en commande"""
         cart = self.get_object()
         
-        if not cart.items.exists():
+        serializer = CheckoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        order_data = dict(serializer.validated_data)
+        body_key = order_data.pop('idempotency_key', None)
+        idempotency_key = request.headers.get('Idempotency-Key') or body_key
+        if idempotency_key and len(idempotency_key) > Order._meta.get_field('idempotency_key').max_length:
             return Response(
-                {'error': 'Le panier est vide'},
+                {'idempotency_key': ['Clé d\'idempotence trop longue (64 caractères au plus)']},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Préparer les données de commande
-        order_data = {
-            'device': cart.device.id,
-            'delivery_address': request.data.get('delivery_address'),
-            'delivery_latitude': request.data.get('delivery_latitude'),
-            'delivery_longitude': request.data.get('delivery_longitude'),
-            'delivery_description': request.data.get('delivery_description', ''),
-            'customer_name': request.data.get('customer_name'),
-            'customer_phone': request.data.get('customer_phone'),
-            'customer_email': request.data.get('customer_email', ''),
-            'delivery_fee': request.data.get('delivery_fee', 0),
-            'notes': request.data.get('notes', ''),
-            'items': []
-        }
+        # Checkout rejoué : renvoyer la commande déjà créée
+        try:
+            existing_order = find_idempotent_order(idempotency_key, cart.device_id)
+        except IdempotencyConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
         
-        # Ajouter les articles du panier
-        for cart_item in cart.items.all():
-            order_data['items'].append({
-                'size_id': cart_item.size.id,
-                'quantity': cart_item.quantity,
-                'special_instructions': cart_item.special_instructions
-            })
+        if existing_order:
+            return Response(OrderSerializer(existing_order).data)
         
-        # Créer la commande
-        serializer = OrderCreateSerializer(data=order_data)
-        if serializer.is_valid():
-            order = serializer.save()
-            # Vider le panier
-            cart.items.all().delete()
-            
+        cart_items = list(cart.items.all())
+        if not cart_items:
             return Response(
-                OrderSerializer(order).data,
-                status=status.HTTP_201_CREATED
+                {'error': 'Le panier est vide'},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
+        try:
+            order, created = checkout_cart(cart, cart_items, order_data, idempotency_key)
+        except IdempotencyConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(
+            OrderSerializer(order).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
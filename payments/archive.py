@@ -0,0 +1,165 @@
+# ===================================
+# payments/archive.py
+# ===================================
+
+"""
+Rétention des logs de webhooks.
+
+Les webhooks traités plus anciens que RETENTION_DAYS sont écrits par lots
+dans des fichiers JSON Lines compressés (gzip), puis supprimés de la base :
+la table ne garde que l'historique récent et les webhooks à traiter.
+Chaque fichier couvre un lot (ordre de réception) et porte dans son nom
+l'intervalle de dates couvert, ce qui permet de restaurer une période sans
+relire toute l'archive.
+
+Un fichier est écrit entièrement (fichier temporaire puis renommage) avant
+la suppression du lot; une interruption entre les deux laisse au pire des
+lignes archivées deux fois, ignorées à la restauration (même id).
+"""
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from .models import Payment, PaymentWebhook
+
+ARCHIVE_NAME = re.compile(r'^webhooks-(\d{8})-(\d{8})-(\d+)\.jsonl\.gz$')
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """Dates complètes : DjangoJSONEncoder tronque les microsecondes"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_WEBHOOKS', {}).get(name, default)
+
+
+def archive_directory(directory=None):
+    return Path(directory or _get_setting('ARCHIVE_DIR', settings.BASE_DIR / 'archives' / 'webhooks'))
+
+
+def archivable_webhooks(days=None, now=None):
+    """Webhooks traités reçus avant la période de rétention, les plus anciens d'abord"""
+    days = _get_setting('RETENTION_DAYS', 90) if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return PaymentWebhook.objects.filter(processed=True, received_at__lt=cutoff).order_by('received_at', 'id')
+
+
+def _write_chunk(directory, webhooks):
+    first, last = webhooks[0], webhooks[-1]
+    name = (
+        f"webhooks-{timezone.localtime(first.received_at):%Y%m%d}-"
+        f"{timezone.localtime(last.received_at):%Y%m%d}-{first.id}.jsonl.gz"
+    )
+    path = directory / name
+    temporary = directory / f'.{name}.tmp'
+    with open(temporary, 'wb') as raw:
+        with gzip.open(raw, 'wt', encoding='utf-8') as archive:
+            for row in serializers.serialize('python', webhooks):
+                archive.write(json.dumps(row, cls=ArchiveEncoder, ensure_ascii=False))
+                archive.write('\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temporary, path)
+    return path
+
+
+def archive_webhooks(days=None, chunk_size=None, directory=None, dry_run=False):
+    """
+    Archiver puis supprimer les webhooks traités au-delà de la rétention.
+    Retourne (webhooks archivés, fichiers écrits).
+    """
+    chunk_size = chunk_size or _get_setting('ARCHIVE_CHUNK', 1000)
+    queryset = archivable_webhooks(days)
+    if dry_run:
+        return queryset.count(), 0
+
+    directory = archive_directory(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    archived = files = 0
+    while True:
+        # Le lot précédent est supprimé : la même requête retourne le suivant
+        webhooks = list(queryset[:chunk_size])
+        if not webhooks:
+            break
+        _write_chunk(directory, webhooks)
+        with transaction.atomic():
+            PaymentWebhook.objects.filter(id__in=[webhook.id for webhook in webhooks]).delete()
+        archived += len(webhooks)
+        files += 1
+    return archived, files
+
+
+def archive_files(date_from=None, date_to=None, directory=None):
+    """Fichiers d'archive couvrant au moins un jour de l'intervalle (dates incluses)"""
+    directory = archive_directory(directory)
+    if not directory.is_dir():
+        return []
+    selected = []
+    for path in sorted(directory.iterdir()):
+        match = ARCHIVE_NAME.match(path.name)
+        if not match:
+            continue
+        first = datetime.strptime(match.group(1), '%Y%m%d').date()
+        last = datetime.strptime(match.group(2), '%Y%m%d').date()
+        if (date_to and first > date_to) or (date_from and last < date_from):
+            continue
+        selected.append(path)
+    return selected
+
+
+def _insert(rows):
+    """Réinsérer des webhooks archivés; les ids déjà présents sont ignorés"""
+    ids = [row['pk'] for row in rows]
+    existing = set(PaymentWebhook.objects.filter(id__in=ids).values_list('id', flat=True))
+    payment_ids = {row['fields']['payment'] for row in rows if row['fields'].get('payment')}
+    known_payments = set(Payment.objects.filter(id__in=payment_ids).values_list('id', flat=True))
+
+    # Une ligne peut figurer dans deux fichiers (archivage interrompu)
+    rows = list({row['pk']: row for row in rows if row['pk'] not in existing}.values())
+    for row in rows:
+        # Paiement supprimé depuis l'archivage : le lien est perdu, pas le log
+        if row['fields'].get('payment') not in known_payments:
+            row['fields']['payment'] = None
+
+    # Sauvegarde brute : received_at est conservé (bulk_create le remplacerait, auto_now_add)
+    with transaction.atomic():
+        for webhook in serializers.deserialize('python', rows):
+            webhook.save(force_insert=True)
+    return len(rows)
+
+
+def restore_webhooks(date_from=None, date_to=None, directory=None, chunk_size=None):
+    """Restaurer les webhooks archivés reçus dans l'intervalle (dates incluses); retourne le nombre restauré"""
+    chunk_size = chunk_size or _get_setting('ARCHIVE_CHUNK', 1000)
+    start = timezone.make_aware(datetime.combine(date_from, time.min)) if date_from else None
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None
+
+    restored = 0
+    rows = []
+    for path in archive_files(date_from, date_to, directory):
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                row = json.loads(line)
+                received_at = datetime.fromisoformat(row['fields']['received_at'].replace('Z', '+00:00'))
+                if (start and received_at < start) or (end and received_at >= end):
+                    continue
+                rows.append(row)
+                if len(rows) >= chunk_size:
+                    restored += _insert(rows)
+                    rows = []
+    if rows:
+        restored += _insert(rows)
+    return restored
@@ -0,0 +1,416 @@
+# ===================================
+# payments/gateway.py
+# ===================================
+
+"""
+Client de la passerelle de paiement.
+
+`get_gateway()` retourne une instance unique par processus, choisie par
+PAYMENT_GATEWAY['BACKEND'] :
+- 'paydunya' : API HTTP PayDunya via une session `requests` partagée (pool
+  de connexions keep-alive), délais stricts, disjoncteur et reprises avec
+  gigue sur les erreurs réseau;
+- 'fake' : passerelle locale en mémoire pour les tests et les mesures de
+  charge (latence et taux d'échec réglables).
+"""
+
+import abc
+import random
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_GATEWAY', {}).get(name, default)
+
+
+class GatewayError(Exception):
+    """Erreur de la passerelle (réponse refusée ou invalide)"""
+
+
+class GatewayUnavailable(GatewayError):
+    """Passerelle injoignable : délai dépassé, erreur réseau ou disjoncteur ouvert"""
+
+
+def payer_account(payment):
+    """
+    Compte mobile qui a réglé le paiement, lu dans la confirmation PayDunya
+    (`customer.phone`) ou, pour un paiement confirmé par webhook, dans le
+    webhook `completed` reçu. None si aucun reçu ne l'indique.
+    """
+    from .models import PaymentWebhook
+
+    customer = (payment.paydunya_response or {}).get('customer') or {}
+    if not customer.get('phone') and payment.paydunya_token:
+        data = PaymentWebhook.objects.filter(
+            token=payment.paydunya_token, status='completed'
+        ).order_by('-id').values_list('webhook_data', flat=True).first()
+        customer = (data or {}).get('customer') or {}
+    return customer.get('phone') or None
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur : après `failure_threshold` échecs consécutifs, les appels
+    sont refusés pendant `reset_timeout` secondes, puis un seul appel d'essai
+    est autorisé (demi-ouvert).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class PaymentGateway(abc.ABC):
+    """Interface d'une passerelle de paiement"""
+    name = None
+
+    @abc.abstractmethod
+    def create_invoice(self, payment, order):
+        """
+        Créer la facture; retourne {'token', 'invoice_url', 'response_code',
+        'response_text', 'response'} ou lève GatewayError.
+        """
+
+    @abc.abstractmethod
+    def confirm(self, token):
+        """
+        Statut d'une facture; retourne {'status', 'transaction_id',
+        'response'} avec status parmi 'completed', 'pending', 'failed',
+        'cancelled', ou lève GatewayError.
+        """
+
+    @abc.abstractmethod
+    def refund(self, payment):
+        """
+        Rembourser un paiement complété; retourne {'transaction_id',
+        'response'} ou lève GatewayError. Jamais réessayé automatiquement :
+        un délai dépassé ne dit pas si le remboursement a eu lieu.
+        """
+
+
+class PayDunyaGateway(PaymentGateway):
+    """API HTTP PayDunya (facture « checkout-invoice »)"""
+    name = 'paydunya'
+
+    BASE_URLS = {
+        'test': 'https://app.paydunya.com/sandbox-api/v1',
+        'live': 'https://app.paydunya.com/api/v1',
+    }
+    STATUSES = {'completed': 'completed', 'cancelled': 'cancelled', 'failed': 'failed'}
+
+    def __init__(self, master_key, private_key, token, mode='test', connect_timeout=3.05,
+                 read_timeout=10.0, pool_size=10, max_retries=2, backoff=0.2, breaker=None,
+                 withdraw_modes=None):
+        self.base_url = self.BASE_URLS.get(mode, self.BASE_URLS['test'])
+        # Remboursement par déboursement vers le compte mobile du client (API v2)
+        self.disburse_url = self.base_url.replace('/v1', '/v2')
+        self.withdraw_modes = withdraw_modes or {}
+        self.headers = {
+            'Content-Type': 'application/json',
+            'PAYDUNYA-MASTER-KEY': master_key,
+            'PAYDUNYA-PRIVATE-KEY': private_key,
+            'PAYDUNYA-TOKEN': token,
+        }
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Session partagée par tous les threads du processus (pool keep-alive)"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    try:
+                        import requests
+                        from requests.adapters import HTTPAdapter
+                    except ImportError as e:
+                        raise GatewayError("Le package 'requests' est requis pour PayDunya") from e
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+
+    def _request(self, method, path, idempotent, base_url=None, **kwargs):
+        """
+        Appel HTTP protégé par le disjoncteur. Les erreurs de connexion sont
+        réessayées; les délais de lecture et les erreurs 5xx seulement pour
+        les appels idempotents (une facture ne doit pas être créée deux fois).
+        """
+        import requests
+
+        session = self.session
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise GatewayUnavailable("PayDunya indisponible (disjoncteur ouvert)")
+
+            retryable = False
+            try:
+                response = session.request(
+                    method, f'{base_url or self.base_url}{path}', timeout=self.timeout, **kwargs
+                )
+            except requests.ConnectionError as e:
+                error, retryable = GatewayUnavailable(f"Connexion à PayDunya impossible : {e}"), True
+            except requests.Timeout as e:
+                error, retryable = GatewayUnavailable(f"Délai dépassé : {e}"), idempotent
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise GatewayError(f"Réponse PayDunya invalide (HTTP {response.status_code})") from e
+                error = GatewayUnavailable(f"Erreur PayDunya HTTP {response.status_code}")
+                retryable = idempotent
+
+            self.breaker.record_failure()
+            if not retryable or attempt == self.max_retries:
+                raise error
+            # Délai exponentiel avec gigue complète
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def create_invoice(self, payment, order):
+        amount = float(payment.amount)
+        payload = {
+            'invoice': {
+                'items': {
+                    'item_0': {
+                        'name': f"Commande {order.order_number}",
+                        'quantity': 1,
+                        'unit_price': amount,
+                        'total_price': amount,
+                        'description': f"Paiement pour la commande {order.order_number}",
+                    },
+                },
+                'total_amount': amount,
+                'description': f"Paiement pour la commande {order.order_number}",
+            },
+            'store': {'name': getattr(settings, 'PAYDUNYA_STORE_NAME', 'RestoOnline')},
+            'custom_data': {
+                'order_id': order.id,
+                'order_number': order.order_number,
+                'customer_name': order.customer_name,
+                'customer_phone': order.customer_phone,
+            },
+            'actions': {
+                'callback_url': f"{settings.SITE_URL}{reverse('paydunya-webhook')}",
+                'return_url': f"{settings.SITE_URL}/orders/{order.order_number}/payment/success/",
+                'cancel_url': f"{settings.SITE_URL}/orders/{order.order_number}/payment/cancel/",
+            },
+        }
+        response = self._request('POST', '/checkout-invoice/create', idempotent=False, json=payload)
+        if response.get('response_code') != '00':
+            raise GatewayError(response.get('response_text', 'Erreur inconnue'))
+        return {
+            'token': response['token'],
+            'invoice_url': response['response_text'],
+            'response_code': response['response_code'],
+            'response_text': response['response_text'],
+            'response': response,
+        }
+
+    def confirm(self, token):
+        response = self._request('GET', f'/checkout-invoice/confirm/{token}', idempotent=True)
+        if response.get('response_code') != '00':
+            raise GatewayError(response.get('response_text', 'Erreur inconnue'))
+        return {
+            'status': self.STATUSES.get(response.get('status'), 'pending'),
+            'transaction_id': response.get('receipt_identifier') or response.get('transaction_id'),
+            'response': response,
+        }
+
+    def refund(self, payment):
+        withdraw_mode = self.withdraw_modes.get(payment.payment_method)
+        if not withdraw_mode:
+            raise GatewayError(f"Remboursement automatique impossible pour {payment.payment_method or 'ce paiement'}")
+
+        # Jamais vers le téléphone saisi sur la commande (texte libre) : seulement le compte payeur
+        account = payer_account(payment)
+        if not account:
+            raise GatewayError("Compte payeur absent du reçu PayDunya : remboursement à traiter manuellement")
+
+        invoice = self._request('POST', '/disburse/get-invoice', idempotent=False, base_url=self.disburse_url, json={
+            'account_alias': account,
+            'amount': int(payment.amount),
+            'withdraw_mode': withdraw_mode,
+            'callback_url': f"{settings.SITE_URL}{reverse('paydunya-webhook')}",
+        })
+        if invoice.get('response_code') != '00':
+            raise GatewayError(invoice.get('response_text', 'Erreur inconnue'))
+
+        response = self._request('POST', '/disburse/submit-invoice', idempotent=False, base_url=self.disburse_url, json={
+            'disburse_invoice': invoice['disburse_token'],
+            'disburse_id': f'refund-{payment.id}',
+        })
+        if response.get('response_code') != '00' or response.get('status') == 'failed':
+            raise GatewayError(response.get('response_text', 'Erreur inconnue'))
+        return {
+            'transaction_id': response.get('transaction_id') or invoice['disburse_token'],
+            'response': response,
+        }
+
+
+class FakeGateway(PaymentGateway):
+    """
+    Passerelle locale en mémoire. `latency` (secondes) et `failure_rate`
+    simulent un fournisseur lent ou instable; `confirm_status` est le statut
+    rendu par `confirm` pour les factures créées.
+    """
+    name = 'fake'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, confirm_status='completed', seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.confirm_status = confirm_status
+        self.invoices = {}
+        self.calls = 0
+        self.refunds = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise GatewayUnavailable("Passerelle simulée indisponible")
+
+    def create_invoice(self, payment, order):
+        self._call()
+        token = f'fake-{uuid.uuid4().hex}'
+        with self._lock:
+            self.invoices[token] = {'amount': str(payment.amount), 'order': order.order_number}
+        return {
+            'token': token,
+            'invoice_url': f"{settings.SITE_URL}/fake-checkout/{token}/",
+            'response_code': '00',
+            'response_text': f"{settings.SITE_URL}/fake-checkout/{token}/",
+            'response': {'token': token},
+        }
+
+    def confirm(self, token):
+        self._call()
+        with self._lock:
+            known = token in self.invoices
+        if not known:
+            raise GatewayError("Facture inconnue")
+        transaction_id = f'FAKE-{token[-8:]}' if self.confirm_status == 'completed' else None
+        return {
+            'status': self.confirm_status,
+            'transaction_id': transaction_id,
+            'response': {'token': token, 'status': self.confirm_status},
+        }
+
+    def refund(self, payment):
+        self._call()
+        with self._lock:
+            self.refunds += 1
+        return {
+            'transaction_id': f'FAKE-R-{payment.id}',
+            'response': {'payment': payment.id, 'amount': str(payment.amount)},
+        }
+
+
+BACKENDS = {
+    'paydunya': 'payments.gateway.build_paydunya_gateway',
+    'fake': 'payments.gateway.build_fake_gateway',
+}
+
+
+def build_paydunya_gateway():
+    return PayDunyaGateway(
+        master_key=settings.PAYDUNYA_MASTER_KEY,
+        private_key=settings.PAYDUNYA_PRIVATE_KEY,
+        token=settings.PAYDUNYA_TOKEN,
+        mode=settings.PAYDUNYA_MODE,
+        connect_timeout=_get_setting('CONNECT_TIMEOUT', 3.05),
+        read_timeout=_get_setting('READ_TIMEOUT', 10.0),
+        pool_size=_get_setting('POOL_SIZE', 10),
+        max_retries=_get_setting('MAX_RETRIES', 2),
+        backoff=_get_setting('BACKOFF', 0.2),
+        breaker=CircuitBreaker(
+            failure_threshold=_get_setting('BREAKER_THRESHOLD', 5),
+            reset_timeout=_get_setting('BREAKER_RESET', 30.0),
+        ),
+        withdraw_modes=_get_setting('WITHDRAW_MODES', None),
+    )
+
+
+def build_fake_gateway():
+    return FakeGateway(
+        latency=_get_setting('FAKE_LATENCY', 0.0),
+        failure_rate=_get_setting('FAKE_FAILURE_RATE', 0.0),
+        confirm_status=_get_setting('FAKE_CONFIRM_STATUS', 'completed'),
+    )
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Passerelle du processus (construite au premier appel)"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                backend = _get_setting('BACKEND', 'paydunya')
+                _gateway = import_string(BACKENDS.get(backend, backend))()
+    return _gateway
+
+
+def set_gateway(gateway):
+    """Remplacer la passerelle du processus (tests, mesures); retourne la précédente"""
+    global _gateway
+    with _gateway_lock:
+        previous, _gateway = _gateway, gateway
+    return previous
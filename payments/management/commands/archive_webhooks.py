@@ -0,0 +1,29 @@
+# ===================================
+# payments/management/commands/archive_webhooks.py
+# ===================================
+
+from django.core.management.base import BaseCommand
+from payments.archive import archive_directory, archive_webhooks
+
+
+class Command(BaseCommand):
+    help = "Archive (JSON Lines gzip) puis supprime les webhooks traités au-delà de la rétention"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Rétention en jours (défaut : RETENTION_DAYS)')
+        parser.add_argument('--chunk', type=int, default=None, help='Webhooks par fichier')
+        parser.add_argument('--dir', default=None, help="Répertoire d'archive (défaut : ARCHIVE_DIR)")
+        parser.add_argument('--dry-run', action='store_true', help='Compter sans archiver')
+
+    def handle(self, *args, **options):
+        archived, files = archive_webhooks(
+            days=options['days'], chunk_size=options['chunk'],
+            directory=options['dir'], dry_run=options['dry_run']
+        )
+        if options['dry_run']:
+            self.stdout.write(f"{archived} webhook(s) à archiver")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"{archived} webhook(s) archivé(s) dans {files} fichier(s) ({archive_directory(options['dir'])})"
+        ))
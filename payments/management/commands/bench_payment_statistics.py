@@ -0,0 +1,151 @@
+# ===================================
+# payments/management/commands/bench_payment_statistics.py
+# ===================================
+
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from orders.models import Order
+from payments.models import Payment
+from payments.stats import compute_payment_statistics
+
+
+def legacy_statistics(queryset):
+    """Ancienne implémentation : comptages et agrégats séparés par statut et par méthode"""
+    total_payments = queryset.count()
+    completed_payments = queryset.filter(status='completed')
+    stats = {
+        'total_payments': total_payments,
+        'completed_count': completed_payments.count(),
+        'pending_count': queryset.filter(status='pending').count(),
+        'failed_count': queryset.filter(status='failed').count(),
+        'total_amount': float(completed_payments.aggregate(Sum('amount'))['amount__sum'] or 0),
+        'by_method': {},
+    }
+    for method, _ in Payment.PAYMENT_METHOD_CHOICES:
+        method_payments = completed_payments.filter(payment_method=method)
+        stats['by_method'][method] = {
+            'count': method_payments.count(),
+            'total_amount': float(method_payments.aggregate(Sum('amount'))['amount__sum'] or 0),
+        }
+    return stats
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare les statistiques des paiements : requête groupée unique vs comptages par méthode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=1_000_000)
+        parser.add_argument('--days', type=int, default=90, help='Période couverte par les paiements générés')
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--chunk', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Données générées dans une transaction annulée à la fin
+        try:
+            with transaction.atomic():
+                self._generate(options)
+                results = self._measure(options['runs'])
+                week = self._measure(options['runs'], timezone.localdate() - timedelta(days=6))[1]
+                raise Rollback
+        except Rollback:
+            pass
+
+        (legacy_time, legacy_queries, legacy), (grouped_time, grouped_queries, grouped) = results
+        self.stdout.write(f"{options['payments']:,} paiements sur {options['days']} jours")
+        self.stdout.write(f"Implémentation actuelle : {legacy_time * 1000:,.0f} ms, {legacy_queries} requêtes")
+        self.stdout.write(
+            f"Requête groupée : {grouped_time * 1000:,.0f} ms, {grouped_queries} requête(s), "
+            f"{len(grouped['daily'])} jours"
+        )
+        self.stdout.write(f"Gain : x{legacy_time / grouped_time:.1f}")
+        self.stdout.write(
+            f"Requête groupée sur 7 jours : {week[0] * 1000:,.0f} ms, {week[2]['total_payments']:,} paiements"
+        )
+
+        mismatches = [
+            key for key in ('total_payments', 'completed_count', 'pending_count', 'failed_count')
+            if legacy[key] != grouped[key]
+        ] + [
+            method for method, values in legacy['by_method'].items()
+            if values['count'] != grouped['by_method'][method]['count']
+        ]
+        drift = abs(Decimal(str(legacy['total_amount'])) - grouped['total_amount'])
+        self.stdout.write(
+            f"Différences de comptage : {len(mismatches)} — total exact {grouped['total_amount']} "
+            f"(écart du flottant : {drift})"
+        )
+
+    def _generate(self, options):
+        rng = random.Random(options['seed'])
+        statuses = [value for value, _ in Payment.STATUS_CHOICES]
+        weights = [5, 5, 70, 10, 5, 5]
+        methods = [value for value, _ in Payment.PAYMENT_METHOD_CHOICES]
+        now = timezone.now()
+        stamp = int(time.time())
+        total, chunk = options['payments'], options['chunk']
+        quote = connection.ops.quote_name
+        update_sql = (
+            f"UPDATE {quote(Payment._meta.db_table)} SET {quote('created_at')} = %s WHERE {quote('id')} = %s"
+        )
+
+        started = time.perf_counter()
+        for offset in range(0, total, chunk):
+            size = min(chunk, total - offset)
+            orders = Order.objects.bulk_create([
+                Order(
+                    order_number=f'ST-{stamp}-{offset + i}', delivery_address='bench',
+                    customer_name='bench', customer_phone='0', subtotal=0, total=0
+                )
+                for i in range(size)
+            ])
+            payments = Payment.objects.bulk_create([
+                Payment(
+                    order=order, status=rng.choices(statuses, weights)[0],
+                    payment_method=rng.choice(methods),
+                    amount=Decimal(rng.randint(50000, 2500000)) / 100,
+                )
+                for order in orders
+            ])
+            # created_at est en auto_now_add : dates réparties sur la période après insertion
+            # (executemany direct, bulk_update construit un CASE par ligne)
+            with connection.cursor() as cursor:
+                cursor.executemany(update_sql, [
+                    (connection.ops.adapt_datetimefield_value(
+                        now - timedelta(seconds=rng.randint(0, options['days'] * 86400))
+                    ), payment.id)
+                    for payment in payments
+                ])
+        # Statistiques du planificateur, comme sur une base en production
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(f"Génération : {time.perf_counter() - started:,.1f} s")
+
+    def _measure(self, runs, date_from=None):
+        reset_queries()
+        results = []
+        for compute in (
+            lambda: legacy_statistics(Payment.objects.all()),
+            lambda: compute_payment_statistics(date_from=date_from),
+        ):
+            best = None
+            for _ in range(runs):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    data = compute()
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results.append((best, len(queries), data))
+        return results
@@ -0,0 +1,106 @@
+# ===================================
+# payments/management/commands/bench_webhook_replay.py
+# ===================================
+
+import time
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from orders.models import Order
+from payments.models import Payment, PaymentWebhook
+from payments.signatures import expected_hash
+from payments.views import paydunya_webhook
+from payments.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = "Rejoue des webhooks PayDunya : réponse inline vs enregistrement seul, puis débit des workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--webhooks', type=int, default=500)
+        parser.add_argument('--payments', type=int, default=100,
+                            help='Plusieurs webhooks par paiement sont appliqués dans leur ordre de réception')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        # Les workers utilisent leurs propres connexions : les données sont
+        # écrites pour de bon puis supprimées à la fin
+        stamp = int(time.time() * 1000)
+        orders = self._create_payments(stamp, options['payments'])
+        tokens = [f'bench-{stamp}-{i}' for i in range(options['payments'])]
+        payloads = [
+            {'token': tokens[i % len(tokens)], 'status': 'completed', 'transaction_id': f'T{i}'}
+            for i in range(options['webhooks'])
+        ]
+        webhook_ids = []
+        try:
+            # Contenus distincts par passage : sinon le second serait écarté comme doublon
+            inline = self._replay(payloads, 'sync', webhook_ids)
+            queued = self._replay(payloads, 'none', webhook_ids)
+
+            drains = []
+            for workers in sorted({1, options['workers']}):
+                if drains:
+                    PaymentWebhook.objects.filter(id__in=queued[2]).update(
+                        processed=False, processed_at=None, attempts=0, next_attempt_at=queued[3]
+                    )
+                drains.append((workers, self._drain(len(payloads), workers)))
+        finally:
+            PaymentWebhook.objects.filter(id__in=webhook_ids).delete()
+            Order.objects.filter(id__in=orders).delete()
+
+        total = len(payloads)
+        self.stdout.write(f"{total} webhooks sur {options['payments']} paiements")
+        self.stdout.write(
+            f"Traitement inline : {total / inline[0]:,.0f} webhooks/s, "
+            f"réponse moyenne {inline[1] * 1000:.2f} ms"
+        )
+        self.stdout.write(
+            f"Enregistrement seul : {total / queued[0]:,.0f} webhooks/s, "
+            f"réponse moyenne {queued[1] * 1000:.2f} ms"
+        )
+        for workers, elapsed in drains:
+            self.stdout.write(f"Workers ({workers} thread(s)) : {total / elapsed:,.0f} webhooks/s")
+
+    def _create_payments(self, stamp, count):
+        order_ids = []
+        for i in range(count):
+            order = Order.objects.create(
+                order_number=f'WH-{stamp % 100000}-{i}', delivery_address='bench',
+                customer_name='bench', customer_phone='0', subtotal=1000, total=1000
+            )
+            Payment.objects.create(
+                order=order, amount=1000, payment_method='orange_money',
+                paydunya_token=f'bench-{stamp}-{i}', status='processing'
+            )
+            order_ids.append(order.id)
+        return order_ids
+
+    def _replay(self, payloads, backend, webhook_ids):
+        factory = APIRequestFactory()
+        first_id = PaymentWebhook.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        with override_settings(PAYMENT_WEBHOOKS={'BACKEND': backend}):
+            start = time.perf_counter()
+            for payload in payloads:
+                payload = dict(payload, custom_data={'replay': backend}, hash=expected_hash())
+                response = paydunya_webhook(factory.post('/api/payments/paydunya/webhook/', payload, format='json'))
+                assert response.status_code == 200, response.data
+            elapsed = time.perf_counter() - start
+
+        created = PaymentWebhook.objects.filter(id__gt=first_id)
+        ids = list(created.values_list('id', flat=True))
+        webhook_ids.extend(ids)
+        first_due = created.order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+        return elapsed, elapsed / len(payloads), ids, first_due
+
+    def _drain(self, total, workers):
+        start = time.perf_counter()
+        done = 0
+        # Événements différés (même token) : reprise immédiate au passage suivant
+        with override_settings(PAYMENT_WEBHOOKS={'ORDER_DELAY': 0}):
+            while done < total:
+                counts = process_pending(batch_size=200, workers=workers)
+                if not any(counts.values()):
+                    break
+                done += counts['processed'] + counts['duplicate'] + counts['failed']
+        return time.perf_counter() - start
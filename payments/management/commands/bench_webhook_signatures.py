@@ -0,0 +1,91 @@
+# ===================================
+# payments/management/commands/bench_webhook_signatures.py
+# ===================================
+
+import logging
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from payments.signatures import expected_hash, sign_body, verify_webhook
+from payments.views import paydunya_webhook
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mesure le coût de la vérification des webhooks PayDunya sur une rafale de notifications"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--webhooks', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        total = options['webhooks']
+        payloads = [
+            {'token': f'burst-{i}', 'status': 'completed', 'transaction_id': f'T{i}'}
+            for i in range(total)
+        ]
+        digest = expected_hash()
+
+        # Vérification seule (aucune requête)
+        body = b'{"token": "burst", "status": "completed"}'
+        signature = sign_body(body)
+        timings = {}
+        for name, check in (
+            ('hash', lambda payload: verify_webhook(b'', payload)),
+            ('hmac', lambda payload: verify_webhook(body, payload, signature)),
+        ):
+            started = time.perf_counter()
+            for payload in payloads:
+                assert check(dict(payload, hash=digest))
+            timings[name] = (time.perf_counter() - started) / total
+
+        # Rafale sur l'endpoint (webhooks enregistrés puis annulés), sans puis avec vérification
+        try:
+            with transaction.atomic():
+                unsigned = self._burst(payloads, verify=False)
+                # Contenus distincts de la première rafale : sinon acquittés comme doublons
+                signed = self._burst([dict(payload, hash=digest, round=2) for payload in payloads], verify=True)
+                raise Rollback
+        except Rollback:
+            pass
+        forged = self._burst([dict(payload, hash='0' * 128) for payload in payloads], verify=True, expected=403)
+
+        self.stdout.write(f"{total:,} webhooks")
+        self.stdout.write(
+            f"Vérification seule : hash {timings['hash'] * 1e6:.1f} µs, HMAC du corps {timings['hmac'] * 1e6:.1f} µs"
+        )
+        for name, latencies in (('Sans vérification', unsigned), ('Avec vérification', signed),
+                                ('Webhooks forgés (refusés)', forged)):
+            self.stdout.write(
+                f"{name} : médiane {statistics.median(latencies) * 1000:.3f} ms, "
+                f"p99 {statistics.quantiles(latencies, n=100)[98] * 1000:.3f} ms, "
+                f"{len(latencies) / sum(latencies):,.0f} webhooks/s"
+            )
+        overhead = statistics.median(signed) - statistics.median(unsigned)
+        self.stdout.write(
+            f"Surcoût médian de la vérification : {overhead * 1000:+.3f} ms "
+            f"({100 * overhead / statistics.median(unsigned):+.1f} %)"
+        )
+
+    def _burst(self, payloads, verify, expected=200):
+        factory = APIRequestFactory()
+        latencies = []
+        settings = {'BACKEND': 'none', 'VERIFY_SIGNATURE': verify}
+        # Journal des refus coupé : on mesure la vérification, pas l'écriture des logs
+        with override_settings(PAYMENT_WEBHOOKS=settings):
+            logging.getLogger('payments.views').disabled = True
+            try:
+                for payload in payloads:
+                    request = factory.post('/api/payments/paydunya/webhook/', payload, format='json')
+                    started = time.perf_counter()
+                    response = paydunya_webhook(request)
+                    latencies.append(time.perf_counter() - started)
+                    assert response.status_code == expected, response.data
+            finally:
+                logging.getLogger('payments.views').disabled = False
+        return latencies
@@ -0,0 +1,40 @@
+# ===================================
+# payments/management/commands/process_webhooks.py
+# ===================================
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = "Traite les webhooks PayDunya en attente (pool de workers, reprises avec délai)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Relancer un passage toutes les --interval secondes')
+        parser.add_argument('--interval', type=float, default=2.0)
+        parser.add_argument('--batch', type=int, default=None, help='Webhooks réservés par passage')
+        parser.add_argument('--workers', type=int, default=None, help='Webhooks traités simultanément')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            counts = process_pending(batch_size=options['batch'], workers=options['workers'])
+            if any(counts.values()):
+                self.stdout.write(
+                    f"{counts['processed']} traité(s), {counts['duplicate']} doublon(s), "
+                    f"{counts['deferred']} différé(s), {counts['retry']} à réessayer, "
+                    f"{counts['failed']} abandonné(s), {counts['skipped']} ignoré(s)"
+                )
+
+            if not options['loop']:
+                # Traiter aussi les événements différés derrière un événement du même token
+                if counts['deferred']:
+                    time.sleep(min(options['interval'], 1.0))
+                elif not sum(counts.values()):
+                    break
+                continue
+            if not sum(counts.values()):
+                time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+# ===================================
+# payments/management/commands/reconcile_payments.py
+# ===================================
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.reconciliation import reconcile_pending
+
+
+class Command(BaseCommand):
+    help = "Vérifie auprès de la passerelle les paiements restés en cours (par lots, appels simultanés bornés)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Relancer un passage toutes les --interval secondes')
+        parser.add_argument('--interval', type=float, default=30.0)
+        parser.add_argument('--batch', type=int, default=None, help='Paiements réservés par passage')
+        parser.add_argument('--workers', type=int, default=None, help='Appels simultanés à la passerelle')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            counts = reconcile_pending(batch_size=options['batch'], workers=options['workers'])
+            if any(counts.values()):
+                self.stdout.write(
+                    f"{counts['completed']} complété(s), {counts['failed']} échoué(s), "
+                    f"{counts['cancelled']} annulé(s), {counts['expired']} expiré(s), "
+                    f"{counts['pending']} en attente, {counts['unchanged']} déjà résolu(s), "
+                    f"{counts['error']} erreur(s)"
+                )
+
+            if not options['loop']:
+                # Les paiements vérifiés ne sont pas repris avant RECHECK_INTERVAL : la boucle se termine
+                if not sum(counts.values()):
+                    break
+                continue
+            if not sum(counts.values()):
+                time.sleep(options['interval'])
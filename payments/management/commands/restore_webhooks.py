@@ -0,0 +1,31 @@
+# ===================================
+# payments/management/commands/restore_webhooks.py
+# ===================================
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from payments.archive import restore_webhooks
+
+
+class Command(BaseCommand):
+    help = "Restaure les webhooks archivés reçus dans une période"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', default=None, help='Première date (AAAA-MM-JJ)')
+        parser.add_argument('--to', dest='date_to', default=None, help='Dernière date incluse (AAAA-MM-JJ)')
+        parser.add_argument('--dir', default=None, help="Répertoire d'archive (défaut : ARCHIVE_DIR)")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            if options[name] is None:
+                continue
+            try:
+                dates[name] = parse_date(options[name])
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                raise CommandError(f"Date invalide : {options[name]} (format AAAA-MM-JJ)")
+
+        restored = restore_webhooks(directory=options['dir'], **dates)
+        self.stdout.write(self.style.SUCCESS(f"{restored} webhook(s) restauré(s)"))
@@ -0,0 +1,26 @@
+# ===================================
+# payments/management/commands/run_refund_jobs.py
+# ===================================
+
+from django.core.management.base import BaseCommand
+from payments.models import RefundJob
+from payments.refunds import run_refund_job
+
+
+class Command(BaseCommand):
+    help = "Exécute les jobs d'annulation et de remboursement en file (PAYMENT_REFUNDS['BACKEND'] = 'none')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Remboursements simultanés')
+        parser.add_argument('--chunk', type=int, default=None, help='Commandes annulées par transaction')
+
+    def handle(self, *args, **options):
+        for job_id in RefundJob.objects.filter(status='queued').order_by('id').values_list('id', flat=True):
+            if not run_refund_job(job_id, workers=options['workers'], chunk_size=options['chunk']):
+                continue
+            job = RefundJob.objects.get(id=job_id)
+            self.stdout.write(
+                f"Job {job.id} ({job.get_status_display()}) : {job.orders_cancelled}/{job.orders_matched} "
+                f"commande(s) annulée(s), {job.refunds_completed}/{job.refunds_total} remboursement(s), "
+                f"{job.refunds_failed} échec(s)"
+            )
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:28
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def queue_unprocessed(apps, schema_editor):
+    """Les webhooks non traités existants entrent dans la file"""
+    PaymentWebhook = apps.get_model('payments', 'PaymentWebhook')
+    PaymentWebhook.objects.filter(processed=False).update(next_attempt_at=F('received_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentwebhook',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paymentwebhook',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentwebhook',
+            index=models.Index(fields=['processed', 'next_attempt_at'], name='payment_webhook_queue_idx'),
+        ),
+        migrations.RunPython(queue_unprocessed, migrations.RunPython.noop),
+    ]
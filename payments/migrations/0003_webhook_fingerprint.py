@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:32
+
+import hashlib
+import json
+from django.db import migrations, models
+
+
+def fingerprint_webhooks(apps, schema_editor):
+    """Empreinte et token des webhooks existants"""
+    PaymentWebhook = apps.get_model('payments', 'PaymentWebhook')
+    webhooks = []
+    for webhook in PaymentWebhook.objects.only('id', 'webhook_data').iterator(chunk_size=1000):
+        data = webhook.webhook_data if isinstance(webhook.webhook_data, dict) else {}
+        webhook.token = str(data.get('token') or '')[:255]
+        webhook.fingerprint = hashlib.sha256(
+            json.dumps(webhook.webhook_data, sort_keys=True, separators=(',', ':'), default=str).encode()
+        ).hexdigest()
+        webhooks.append(webhook)
+    PaymentWebhook.objects.bulk_update(webhooks, ['token', 'fingerprint'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_webhook_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentwebhook',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='paymentwebhook',
+            name='token',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(fingerprint_webhooks, migrations.RunPython.noop),
+    ]
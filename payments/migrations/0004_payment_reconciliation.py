@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_discount_order_promo_code'),
+        ('payments', '0003_webhook_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'last_checked_at'], name='payment_reconcile_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_discount_order_promo_code'),
+        ('payments', '0004_payment_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'status', 'payment_method', 'amount'], name='payment_stats_idx'),
+        ),
+    ]
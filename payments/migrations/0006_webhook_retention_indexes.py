@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payment_stats_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentwebhook',
+            name='payment_webhook_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='paymentwebhook',
+            index=models.Index(condition=models.Q(('processed', False)), fields=['next_attempt_at', 'id'], name='payment_webhook_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentwebhook',
+            index=models.Index(fields=['processed', '-received_at'], name='payment_webhook_log_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentwebhook',
+            index=models.Index(fields=['-received_at'], name='payment_webhook_received_idx'),
+        ),
+    ]
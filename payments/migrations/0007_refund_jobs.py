@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_webhook_retention_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'En file'), ('running', 'En cours'), ('completed', 'Terminé'), ('failed', 'Échoué')], default='queued', max_length=20)),
+                ('filters', models.JSONField(default=dict)),
+                ('reason', models.TextField()),
+                ('orders_matched', models.PositiveIntegerField(default=0)),
+                ('orders_cancelled', models.PositiveIntegerField(default=0)),
+                ('payments_cancelled', models.PositiveIntegerField(default=0)),
+                ('refunds_total', models.PositiveIntegerField(default=0)),
+                ('refunds_completed', models.PositiveIntegerField(default=0)),
+                ('refunds_failed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refund_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'payment_refund_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('processing', 'En cours'), ('completed', 'Effectué'), ('failed', 'Échoué')], default='pending', max_length=20)),
+                ('transaction_id', models.CharField(blank=True, max_length=255)),
+                ('gateway_response', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='refund', to='payments.payment')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to='payments.refundjob')),
+            ],
+            options={
+                'db_table': 'payment_refunds',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['job', 'status'], name='payment_refund_job_idx')],
+            },
+        ),
+    ]
@@ -41,6 +41,9 @@ class Payment(models.Model):
     # Notes
     notes = models.TextField(blank=True)
     
+    # Dernière vérification auprès de la passerelle (payments/reconciliation.py)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -48,6 +51,11 @@ class Payment(models.Model):
     class Meta:
         db_table = 'payments'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'last_checked_at'], name='payment_reconcile_idx'),
+            # Index couvrant des statistiques (payments/stats.py) : pas de lecture des lignes
+            models.Index(fields=['created_at', 'status', 'payment_method', 'amount'], name='payment_stats_idx'),
+        ]
         
     def __str__(self):
         return f"Payment for Order {self.order.order_number} - {self.get_status_display()}"
@@ -60,15 +68,100 @@ class PaymentWebhook(models.Model):
     
     webhook_data = models.JSONField()
     status = models.CharField(max_length=50)
+    token = models.CharField(max_length=255, blank=True, db_index=True)  # paydunya_token reçu
+    fingerprint = models.CharField(max_length=64, blank=True, db_index=True)  # sha256 du contenu
     processed = models.BooleanField(default=False)
     processing_error = models.TextField(blank=True)
     
+    # File de traitement (payments/webhooks.py)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)  # None : abandonné après MAX_ATTEMPTS
+    
     received_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         db_table = 'payment_webhooks'
         ordering = ['-received_at']
+        indexes = [
+            # File de traitement : webhooks non traités dus, partielle (la table ne fait que grandir)
+            models.Index(
+                fields=['next_attempt_at', 'id'], condition=models.Q(processed=False),
+                name='payment_webhook_due_idx'
+            ),
+            # Listes filtrées par état et triées par réception, sélection des webhooks à archiver
+            models.Index(fields=['processed', '-received_at'], name='payment_webhook_log_idx'),
+            models.Index(fields=['-received_at'], name='payment_webhook_received_idx'),
+        ]
+        
+    def __str__(self):
+        return f"Webhook for Payment {self.payment_id} at {self.received_at}"
+
+
+class RefundJob(models.Model):
+    """Annulation et remboursement en masse de commandes (payments/refunds.py)"""
+    STATUS_CHOICES = (
+        ('queued', 'En file'),
+        ('running', 'En cours'),
+        ('completed', 'Terminé'),
+        ('failed', 'Échoué'),
+    )
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    filters = models.JSONField(default=dict)  # Filtre des commandes (statuts, dates, numéros)
+    reason = models.TextField()
+    created_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True,
+                                   blank=True, related_name='refund_jobs')
+    
+    # Avancement
+    orders_matched = models.PositiveIntegerField(default=0)
+    orders_cancelled = models.PositiveIntegerField(default=0)
+    payments_cancelled = models.PositiveIntegerField(default=0)  # Paiements non réglés annulés
+    refunds_total = models.PositiveIntegerField(default=0)
+    refunds_completed = models.PositiveIntegerField(default=0)
+    refunds_failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'payment_refund_jobs'
+        ordering = ['-created_at']
+        
+    def __str__(self):
+        return f"Refund job {self.id} - {self.get_status_display()}"
+
+
+class Refund(models.Model):
+    """Remboursement d'un paiement (au plus un par paiement)"""
+    STATUS_CHOICES = (
+        ('pending', 'En attente'),
+        ('processing', 'En cours'),
+        ('completed', 'Effectué'),
+        ('failed', 'Échoué'),
+    )
+    
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='refund')
+    job = models.ForeignKey(RefundJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='refunds')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    transaction_id = models.CharField(max_length=255, blank=True)
+    gateway_response = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'payment_refunds'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['job', 'status'], name='payment_refund_job_idx'),
+        ]
         
     def __str__(self):
-        return f"Webhook for Payment {self.payment_id} at {self.received_at}"
\ No newline at end of file
+        return f"Refund for Payment {self.payment_id} - {self.get_status_display()}"
@@ -0,0 +1,131 @@
+# ===================================
+# payments/reconciliation.py
+# ===================================
+
+"""
+Réconciliation des paiements avec la passerelle.
+
+Les paiements restés en `processing` (webhook perdu ou pas encore reçu)
+sont sélectionnés par lots, réservés par une mise à jour conditionnelle
+de `last_checked_at`, puis confirmés auprès de la passerelle par un pool
+de threads borné. Les threads ne font que les appels réseau; les résultats
+sont appliqués ensuite à travers le treillis de statuts
+(payments/transitions.py), comme pour les webhooks.
+
+Une facture toujours en attente après EXPIRE_AFTER est annulée.
+`check_status` lit l'état réconcilié sans appeler la passerelle.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .gateway import GatewayError, get_gateway
+from .models import Payment
+from .transitions import transition_payment
+
+logger = logging.getLogger(__name__)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_RECONCILIATION', {}).get(name, default)
+
+
+def _stale_filter(now):
+    """Paiements en cours sans nouvelle depuis STALE_AFTER et non vérifiés depuis RECHECK_INTERVAL"""
+    stale_before = now - timedelta(seconds=_get_setting('STALE_AFTER', 120))
+    checked_before = now - timedelta(seconds=_get_setting('RECHECK_INTERVAL', 60))
+    return (
+        Q(status='processing', paydunya_token__isnull=False, updated_at__lte=stale_before)
+        & (Q(last_checked_at__isnull=True) | Q(last_checked_at__lte=checked_before))
+    )
+
+
+def stale_payment_ids(limit=100, now=None):
+    """Paiements à vérifier, les jamais vérifiés puis les plus anciennement vérifiés d'abord"""
+    return list(
+        Payment.objects.filter(_stale_filter(now or timezone.now())).order_by(
+            F('last_checked_at').asc(nulls_first=True), 'id'
+        ).values_list('id', flat=True)[:limit]
+    )
+
+
+def claim_payments(payment_ids, now=None):
+    """
+    Réserver des paiements (last_checked_at = maintenant); retourne les
+    couples (id, token) réservés. Un paiement pris par un autre passage ou
+    résolu entre-temps est écarté.
+    """
+    now = now or timezone.now()
+    Payment.objects.filter(_stale_filter(now), id__in=payment_ids).update(last_checked_at=now)
+    return list(
+        Payment.objects.filter(id__in=payment_ids, status='processing', last_checked_at=now)
+        .order_by('id').values_list('id', 'paydunya_token')
+    )
+
+
+def _confirm(gateway, token):
+    """Appel réseau seul (exécuté dans le pool) : pas d'accès à la base"""
+    try:
+        return gateway.confirm(token)
+    except GatewayError as e:
+        return {'status': 'error', 'error': str(e)}
+    except Exception as e:
+        logger.exception("Échec de la confirmation de la facture %s", token)
+        return {'status': 'error', 'error': str(e)}
+
+
+def apply_confirmation(payment_id, result, now=None):
+    """
+    Appliquer le statut confirmé par la passerelle. Retourne 'completed',
+    'failed', 'cancelled', 'expired', 'pending', 'error' ou 'unchanged'
+    (statut déjà atteint ou dépassé, par un webhook par exemple).
+    """
+    now = now or timezone.now()
+    status_value = result.get('status')
+
+    if status_value == 'error':
+        return 'error'
+    if status_value == 'completed':
+        changed = transition_payment(
+            payment_id, 'completed', transaction_id=result.get('transaction_id'),
+            now=now, paydunya_response=result.get('response') or {}
+        )
+        return 'completed' if changed else 'unchanged'
+    if status_value in ('failed', 'cancelled'):
+        return status_value if transition_payment(payment_id, status_value, now=now) else 'unchanged'
+
+    # Toujours en attente : facture abandonnée au-delà de EXPIRE_AFTER
+    expire_before = now - timedelta(seconds=_get_setting('EXPIRE_AFTER', 86400))
+    if Payment.objects.filter(id=payment_id, created_at__lte=expire_before).exists():
+        return 'expired' if transition_payment(payment_id, 'cancelled', now=now) else 'unchanged'
+    return 'pending'
+
+
+def reconcile_pending(batch_size=None, workers=None, gateway=None):
+    """Vérifier un lot de paiements en cours avec au plus `workers` appels simultanés; retourne les compteurs"""
+    batch_size = batch_size or _get_setting('BATCH_SIZE', 100)
+    workers = workers or _get_setting('WORKERS', 8)
+    gateway = gateway or get_gateway()
+
+    counts = {
+        'completed': 0, 'failed': 0, 'cancelled': 0, 'expired': 0,
+        'pending': 0, 'unchanged': 0, 'error': 0,
+    }
+    claimed = claim_payments(stale_payment_ids(batch_size))
+    if not claimed:
+        return counts
+
+    tokens = [token for _, token in claimed]
+    if workers == 1:
+        results = [_confirm(gateway, token) for token in tokens]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(tokens)), thread_name_prefix='reconcile') as pool:
+            results = list(pool.map(lambda token: _confirm(gateway, token), tokens))
+
+    now = timezone.now()
+    for (payment_id, _), result in zip(claimed, results):
+        counts[apply_confirmation(payment_id, result, now)] += 1
+    return counts
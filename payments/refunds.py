@@ -0,0 +1,285 @@
+# ===================================
+# payments/refunds.py
+# ===================================
+
+"""
+Annulation et remboursement de commandes, à l'unité ou en masse.
+
+Les commandes sont annulées par lots de CHUNK_SIZE, chaque lot dans sa
+transaction : commandes passées à `cancelled`, paiements non réglés
+annulés et une ligne `Refund` créée pour chaque paiement en ligne complété
+(au plus une par paiement). Après chaque lot, les remboursements sont
+envoyés à la passerelle par un pool de WORKERS threads; chaque succès fait
+passer le paiement à `refunded` à travers le treillis de statuts.
+
+Les paiements en `processing` (facture ouverte) ne sont pas touchés : un
+règlement tardif reste visible sur la commande annulée. Un remboursement
+échoué n'est jamais rejoué automatiquement (un délai dépassé ne dit pas si
+l'argent est parti) : il reste `failed` avec son erreur.
+"""
+
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .gateway import GatewayError, get_gateway
+from .models import Payment, Refund, RefundJob
+from .transitions import transition_payment
+
+logger = logging.getLogger(__name__)
+
+CANCELLABLE_STATUSES = ('pending', 'accepted', 'preparing', 'ready', 'assigned', 'in_delivery')
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_REFUNDS', {}).get(name, default)
+
+
+class RefundError(Exception):
+    """Filtre ou demande d'annulation invalide"""
+
+
+def clean_filters(data):
+    """
+    Valider le filtre des commandes : `statuses` (parmi les statuts
+    annulables), `created_from` / `created_to` (AAAA-MM-JJ, inclus),
+    `order_numbers`. Au moins un critère est requis.
+    """
+    filters = {}
+    statuses = data.get('statuses')
+    if statuses:
+        invalid = [value for value in statuses if value not in CANCELLABLE_STATUSES]
+        if invalid:
+            raise RefundError(f"Statuts non annulables : {', '.join(map(str, invalid))}")
+        filters['statuses'] = list(statuses)
+    for name in ('created_from', 'created_to'):
+        if data.get(name):
+            try:
+                value = parse_date(str(data[name]))
+            except ValueError:
+                value = None
+            if value is None:
+                raise RefundError(f"{name} invalide (format AAAA-MM-JJ)")
+            filters[name] = str(value)
+    if data.get('order_numbers'):
+        filters['order_numbers'] = [str(number) for number in data['order_numbers']]
+    if not filters:
+        raise RefundError("Au moins un critère de sélection des commandes est requis")
+    return filters
+
+
+def filter_orders(filters):
+    """Commandes annulables correspondant au filtre"""
+    from orders.models import Order
+
+    queryset = Order.objects.filter(status__in=filters.get('statuses') or CANCELLABLE_STATUSES)
+    if filters.get('created_from'):
+        queryset = queryset.filter(created_at__date__gte=filters['created_from'])
+    if filters.get('created_to'):
+        queryset = queryset.filter(created_at__date__lte=filters['created_to'])
+    if filters.get('order_numbers'):
+        queryset = queryset.filter(order_number__in=filters['order_numbers'])
+    return queryset
+
+
+def cancel_orders(order_ids, reason, job_id=None, now=None):
+    """
+    Annuler des commandes dans une transaction; retourne les ids des
+    remboursements à exécuter. Les commandes qui ne sont plus annulables
+    (livrées entre-temps...) sont ignorées.
+    """
+    from orders.models import Order
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        orders = Order.objects.select_for_update().filter(id__in=order_ids, status__in=CANCELLABLE_STATUSES)
+        cancelled_ids = list(orders.values_list('id', flat=True))
+        Order.objects.filter(id__in=cancelled_ids).update(
+            status='cancelled', cancellation_reason=reason, updated_at=now
+        )
+
+        payments = Payment.objects.filter(order_id__in=cancelled_ids)
+        unpaid = list(payments.filter(status='pending').values_list('id', flat=True))
+        payments_cancelled = sum(transition_payment(payment_id, 'cancelled', now=now) for payment_id in unpaid)
+
+        refunds = [
+            Refund(payment_id=payment_id, job_id=job_id, amount=amount)
+            for payment_id, amount in payments.filter(status='completed').exclude(
+                payment_method='cash'
+            ).values_list('id', 'amount')
+        ]
+        Refund.objects.bulk_create(refunds, ignore_conflicts=True)
+        refund_ids = list(
+            Refund.objects.filter(
+                payment_id__in=[refund.payment_id for refund in refunds], status='pending'
+            ).values_list('id', flat=True)
+        )
+
+        if job_id is not None:
+            RefundJob.objects.filter(id=job_id).update(
+                orders_cancelled=F('orders_cancelled') + len(cancelled_ids),
+                payments_cancelled=F('payments_cancelled') + payments_cancelled,
+                refunds_total=F('refunds_total') + len(refund_ids),
+            )
+    return refund_ids
+
+
+def execute_refund(refund_id, gateway=None):
+    """Exécuter un remboursement en attente; retourne 'completed', 'failed' ou 'skipped'"""
+    now = timezone.now()
+    # Réservation : un remboursement n'est envoyé qu'une fois
+    if not Refund.objects.filter(id=refund_id, status='pending').update(status='processing', updated_at=now):
+        return 'skipped'
+
+    refund = Refund.objects.select_related('payment__order').get(id=refund_id)
+    refunds = Refund.objects.filter(id=refund_id)
+    try:
+        result = (gateway or get_gateway()).refund(refund.payment)
+    except Exception as e:
+        if not isinstance(e, GatewayError):
+            logger.exception("Échec du remboursement %s", refund_id)
+        refunds.update(status='failed', error=str(e), updated_at=timezone.now())
+        if refund.job_id:
+            RefundJob.objects.filter(id=refund.job_id).update(refunds_failed=F('refunds_failed') + 1)
+        return 'failed'
+
+    now = timezone.now()
+    with transaction.atomic():
+        refunds.update(
+            status='completed', transaction_id=result.get('transaction_id') or '',
+            gateway_response=result.get('response') or {}, error='', completed_at=now, updated_at=now
+        )
+        transition_payment(refund.payment_id, 'refunded', now=now)
+        if refund.job_id:
+            RefundJob.objects.filter(id=refund.job_id).update(refunds_completed=F('refunds_completed') + 1)
+    return 'completed'
+
+
+def _run(refund_id, gateway=None):
+    try:
+        return execute_refund(refund_id, gateway)
+    except Exception:
+        logger.exception("Échec du remboursement %s", refund_id)
+        return 'failed'
+    finally:
+        close_old_connections()
+
+
+def execute_refunds(refund_ids, workers=None, gateway=None):
+    """Exécuter des remboursements avec au plus `workers` appels simultanés; retourne les compteurs"""
+    workers = workers or _get_setting('WORKERS', 4)
+    counts = {'completed': 0, 'failed': 0, 'skipped': 0}
+    if workers == 1:
+        results = [execute_refund(refund_id, gateway) for refund_id in refund_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refund') as pool:
+            results = list(pool.map(lambda refund_id: _run(refund_id, gateway), refund_ids))
+    for result in results:
+        counts[result] += 1
+    return counts
+
+
+def run_refund_job(job_id, workers=None, chunk_size=None, gateway=None):
+    """
+    Exécuter un job en file : annulation par lots, puis remboursements de
+    chaque lot sur le pool pendant l'annulation du lot suivant.
+    Retourne False si le job n'est plus en file.
+    """
+    workers = workers or _get_setting('WORKERS', 4)
+    chunk_size = chunk_size or _get_setting('CHUNK_SIZE', 50)
+    if not RefundJob.objects.filter(id=job_id, status='queued').update(status='running', started_at=timezone.now()):
+        return False
+
+    job = RefundJob.objects.get(id=job_id)
+    jobs = RefundJob.objects.filter(id=job_id)
+    try:
+        # Commandes retenues au démarrage : les nouvelles commandes ne sont pas annulées
+        order_ids = list(filter_orders(job.filters).order_by('id').values_list('id', flat=True))
+        jobs.update(orders_matched=len(order_ids))
+
+        chunks = [order_ids[i:i + chunk_size] for i in range(0, len(order_ids), chunk_size)]
+        if workers == 1:
+            for chunk in chunks:
+                execute_refunds(cancel_orders(chunk, job.reason, job_id), workers=1, gateway=gateway)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refund') as pool:
+                futures = []
+                for chunk in chunks:
+                    futures.extend(
+                        pool.submit(_run, refund_id, gateway)
+                        for refund_id in cancel_orders(chunk, job.reason, job_id)
+                    )
+                for future in futures:
+                    future.result()
+    except Exception as e:
+        logger.exception("Échec du job de remboursement %s", job_id)
+        jobs.update(status='failed', error=str(e), finished_at=timezone.now())
+        return True
+
+    jobs.update(status='completed', finished_at=timezone.now())
+    return True
+
+
+class RefundRunner:
+    """Exécution locale des jobs, un à la fois (chacun avec son pool borné)"""
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refund-job')
+            return self._pool
+
+    def submit(self, function, *args):
+        def run():
+            try:
+                return function(*args)
+            finally:
+                close_old_connections()
+        return self._get_pool().submit(run)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+refund_runner = RefundRunner()
+atexit.register(refund_runner.shutdown)
+
+
+def _schedule(function, *args):
+    backend = _get_setting('BACKEND', 'thread')
+    if backend == 'sync':
+        transaction.on_commit(lambda: function(*args))
+    elif backend == 'thread':
+        transaction.on_commit(lambda: refund_runner.submit(function, *args))
+
+
+def start_refund_job(filters, reason, created_by=None):
+    """Créer un job (filtre validé par clean_filters) et programmer son exécution"""
+    with transaction.atomic():
+        job = RefundJob.objects.create(filters=filters, reason=reason, created_by=created_by)
+        _schedule(run_refund_job, job.id)
+    return job
+
+
+def cancel_and_refund(order, reason=''):
+    """Annuler une commande; son remboursement éventuel est programmé. Retourne False si non annulable"""
+    if order.status not in CANCELLABLE_STATUSES:
+        return False
+    with transaction.atomic():
+        refund_ids = cancel_orders([order.id], reason)
+        if refund_ids:
+            _schedule(execute_refunds, refund_ids)
+    order.refresh_from_db(fields=['status', 'cancellation_reason', 'updated_at'])
+    return order.status == 'cancelled'
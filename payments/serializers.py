@@ -5,7 +5,7 @@
 # ===================================
 
 from rest_framework import serializers
-from .models import Payment, PaymentWebhook
+from .models import Payment, PaymentWebhook, Refund, RefundJob
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -22,13 +22,13 @@ class PaymentSerializer(serializers.ModelSerializer):
             'paydunya_response_text', 'amount', 'payment_method',
             'payment_method_display', 'status', 'status_display',
             'transaction_id', 'paydunya_response', 'notes',
-            'created_at', 'completed_at', 'updated_at'
+            'last_checked_at', 'created_at', 'completed_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'paydunya_token', 'paydunya_invoice_url',
             'paydunya_response_code', 'paydunya_response_text',
-            'transaction_id', 'paydunya_response', 'created_at',
-            'completed_at', 'updated_at'
+            'transaction_id', 'paydunya_response', 'last_checked_at',
+            'created_at', 'completed_at', 'updated_at'
         ]
 
 
@@ -37,6 +37,8 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = ['order', 'amount', 'payment_method']
+        # Unicité par commande vérifiée par la contrainte à l'insertion (sûr en concurrence)
+        extra_kwargs = {'order': {'validators': []}}
 
 
 class PaymentWebhookSerializer(serializers.ModelSerializer):
@@ -48,4 +50,50 @@ class PaymentWebhookSerializer(serializers.ModelSerializer):
             'processed', 'processing_error', 'received_at',
             'processed_at'
         ]
-        read_only_fields = ['id', 'received_at', 'processed_at']
\ No newline at end of file
+        read_only_fields = ['id', 'received_at', 'processed_at']
+
+
+class RefundSerializer(serializers.ModelSerializer):
+    """Serializer pour Refund"""
+    order_number = serializers.CharField(source='payment.order.order_number', read_only=True)
+    
+    class Meta:
+        model = Refund
+        fields = [
+            'id', 'payment', 'order_number', 'amount', 'status',
+            'transaction_id', 'error', 'created_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
+class RefundJobSerializer(serializers.ModelSerializer):
+    """Serializer pour l'avancement d'un job d'annulation et de remboursement"""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = RefundJob
+        fields = [
+            'id', 'status', 'status_display', 'filters', 'reason', 'created_by',
+            'orders_matched', 'orders_cancelled', 'payments_cancelled',
+            'refunds_total', 'refunds_completed', 'refunds_failed', 'progress',
+            'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        """Part des remboursements terminés (succès ou échec), en pourcentage"""
+        if obj.status in ('queued', 'running') and not obj.refunds_total:
+            return 0
+        if not obj.refunds_total:
+            return 100
+        return round(100 * (obj.refunds_completed + obj.refunds_failed) / obj.refunds_total)
+
+
+class RefundJobCreateSerializer(serializers.Serializer):
+    """Filtre des commandes à annuler et rembourser"""
+    statuses = serializers.ListField(child=serializers.CharField(), required=False)
+    created_from = serializers.DateField(required=False)
+    created_to = serializers.DateField(required=False)
+    order_numbers = serializers.ListField(child=serializers.CharField(), required=False)
+    reason = serializers.CharField()
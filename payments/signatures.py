@@ -0,0 +1,72 @@
+# ===================================
+# payments/signatures.py
+# ===================================
+
+"""
+Vérification de l'origine des webhooks PayDunya.
+
+PayDunya joint à chaque notification un champ `hash` : l'empreinte SHA-512
+(hexadécimale) de la clé principale (PAYDUNYA_MASTER_KEY). Un expéditeur
+qui signe le corps brut (relais interne, outil de rejeu) peut aussi
+envoyer l'en-tête `X-PayDunya-Signature` : HMAC-SHA512 du corps avec la
+même clé. Si l'en-tête est présent il est seul pris en compte; il lie la
+signature au contenu.
+
+Les empreintes attendues sont calculées une fois par clé et gardées en
+mémoire; chaque comparaison est en temps constant (`hmac.compare_digest`).
+"""
+
+import functools
+import hashlib
+import hmac
+from django.conf import settings
+
+SIGNATURE_HEADER = 'X-PayDunya-Signature'
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_WEBHOOKS', {}).get(name, default)
+
+
+@functools.lru_cache(maxsize=4)
+def _key_material(master_key):
+    """(clé HMAC, hash attendu) dérivés de la clé principale, une fois par processus"""
+    key = master_key.encode()
+    return key, hashlib.sha512(key).hexdigest().encode()
+
+
+def key_material():
+    return _key_material(settings.PAYDUNYA_MASTER_KEY)
+
+
+def _as_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).strip().lower().encode('utf-8', 'replace')
+
+
+def expected_hash():
+    """Valeur du champ `hash` envoyé par PayDunya"""
+    return key_material()[1].decode()
+
+
+def sign_body(body):
+    """Signature HMAC-SHA512 (hexadécimale) d'un corps brut"""
+    return hmac.new(key_material()[0], body, hashlib.sha512).hexdigest()
+
+
+def verify_webhook(body, data, signature=None):
+    """
+    Vrai si le webhook vient de PayDunya : en-tête de signature valide pour
+    `body`, ou à défaut champ `hash` valide dans `data`.
+    """
+    if not _get_setting('VERIFY_SIGNATURE', True):
+        return True
+    key, digest = key_material()
+    if signature:
+        expected = hmac.new(key, body, hashlib.sha512).hexdigest().encode()
+        return hmac.compare_digest(_as_bytes(signature), expected)
+    received = data.get('hash') if hasattr(data, 'get') else None
+    if not received:
+        return False
+    return hmac.compare_digest(_as_bytes(received), digest)
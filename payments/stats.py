@@ -0,0 +1,130 @@
+# ===================================
+# payments/stats.py
+# ===================================
+
+"""
+Statistiques des paiements calculées en une seule requête groupée par
+(jour, statut, méthode) au lieu de plusieurs `count()` et `aggregate()`
+par statut et par méthode. Les montants restent des Decimal exacts.
+Le résultat est mis en cache STATS_TTL secondes pour les tableaux de bord
+qui l'interrogent en continu.
+"""
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Payment
+
+STATS_CACHE_PREFIX = 'payments:stats'
+CENT = Decimal('0.01')
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_STATISTICS', {}).get(name, default)
+
+
+class TruncDay(TruncDate):
+    """
+    TruncDate, natif en SQLite quand le fuseau courant est UTC : Django y
+    convertit sinon chaque ligne par une fonction Python
+    """
+
+    def as_sqlite(self, compiler, connection):
+        if settings.USE_TZ and timezone.get_current_timezone_name() == 'UTC':
+            sql, params = compiler.compile(self.lhs)
+            return f'date({sql})', params
+        return self.as_sql(compiler, connection)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _amount(value):
+    return (value or Decimal('0')).quantize(CENT)
+
+
+def compute_payment_statistics(date_from=None, date_to=None, **filters):
+    """
+    Statistiques des paiements créés entre `date_from` et `date_to` (dates
+    incluses, fuseau local); `filters` restreint le queryset (statut,
+    méthode...). Une seule requête quel que soit le nombre de méthodes.
+    """
+    queryset = Payment.objects.filter(**filters)
+    if date_from:
+        queryset = queryset.filter(created_at__gte=_day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(created_at__lt=_day_start(date_to + timedelta(days=1)))
+
+    rows = queryset.annotate(day=TruncDay('created_at')).values(
+        'day', 'status', 'payment_method'
+    ).annotate(count=Count('id'), amount=Sum('amount')).order_by()
+
+    by_status = {value: 0 for value, _ in Payment.STATUS_CHOICES}
+    by_method = {
+        value: {'count': 0, 'total_amount': Decimal('0')}
+        for value, _ in Payment.PAYMENT_METHOD_CHOICES
+    }
+    daily = {}
+    total_payments = 0
+    total_amount = Decimal('0')
+
+    for row in rows:
+        count, amount = row['count'], row['amount'] or Decimal('0')
+        total_payments += count
+        by_status[row['status']] = by_status.get(row['status'], 0) + count
+
+        day = daily.setdefault(row['day'], {
+            'date': row['day'], 'count': 0, 'completed_count': 0, 'total_amount': Decimal('0'),
+        })
+        day['count'] += count
+
+        # Les montants et la répartition par méthode ne portent que sur les paiements complétés
+        if row['status'] != 'completed':
+            continue
+        total_amount += amount
+        day['completed_count'] += count
+        day['total_amount'] += amount
+        if row['payment_method'] in by_method:
+            by_method[row['payment_method']]['count'] += count
+            by_method[row['payment_method']]['total_amount'] += amount
+
+    for method in by_method.values():
+        method['total_amount'] = _amount(method['total_amount'])
+    for day in daily.values():
+        day['total_amount'] = _amount(day['total_amount'])
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'generated_at': timezone.now(),
+        'total_payments': total_payments,
+        'completed_count': by_status['completed'],
+        'pending_count': by_status['pending'],
+        'failed_count': by_status['failed'],
+        'total_amount': _amount(total_amount),
+        'by_status': by_status,
+        'by_method': by_method,
+        'daily': [daily[day] for day in sorted(daily)],
+    }
+
+
+def payment_statistics(date_from=None, date_to=None, use_cache=True, **filters):
+    """Statistiques des paiements, en cache STATS_TTL secondes par combinaison de filtres"""
+    ttl = _get_setting('STATS_TTL', 30)
+    key = ':'.join([STATS_CACHE_PREFIX, str(date_from or ''), str(date_to or '')] + [
+        f'{name}={value}' for name, value in sorted(filters.items())
+    ])
+    if use_cache and ttl:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    data = compute_payment_statistics(date_from, date_to, **filters)
+    if ttl:
+        cache.set(key, data, timeout=ttl)
+    return data
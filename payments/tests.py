@@ -1,3 +1,712 @@
-from django.test import TestCase
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import close_old_connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from orders.models import Order
+from RestoOnline.testing import ThreadedTestCase
+from .archive import archive_webhooks, restore_webhooks
+from .gateway import CircuitBreaker, FakeGateway, PaymentGateway, set_gateway
+from .models import Payment, PaymentWebhook, Refund
+from .reconciliation import reconcile_pending
+from .refunds import cancel_orders, execute_refunds, run_refund_job, start_refund_job
+from .signatures import SIGNATURE_HEADER, expected_hash, sign_body
+from .stats import compute_payment_statistics
+from .transitions import can_transition
+from .webhooks import apply_webhook, claim_webhook, process_pending, webhook_queue
+
+QUEUE_ONLY = {'BACKEND': 'none', 'ORDER_DELAY': 0, 'MAX_ATTEMPTS': 3}
+
+
+def create_payment(index, payment_status='processing'):
+    order = Order.objects.create(
+        order_number=f'PAY-{index}', delivery_address='Cotonou', customer_name='Client',
+        customer_phone='0100000000', subtotal=5000, total=5000
+    )
+    return Payment.objects.create(
+        order=order, amount=5000, payment_method='orange_money',
+        paydunya_token=f'token-{index}', status=payment_status
+    )
+
+
+class StatusLatticeTests(TestCase):
+
+    def test_transitions_are_monotonic(self):
+        self.assertTrue(can_transition('pending', 'processing'))
+        self.assertTrue(can_transition('processing', 'completed'))
+        self.assertTrue(can_transition('completed', 'refunded'))
+        self.assertFalse(can_transition('completed', 'failed'))
+        self.assertFalse(can_transition('failed', 'completed'))
+        self.assertFalse(can_transition('processing', 'pending'))
+
+
+class GatewayTests(TestCase):
+
+    def setUp(self):
+        self.gateway = FakeGateway()
+        self.previous = set_gateway(self.gateway)
+        self.client = APIClient()
+
+    def tearDown(self):
+        set_gateway(self.previous)
+
+    def test_gateway_must_implement_every_operation(self):
+        class InvoiceOnlyGateway(PaymentGateway):
+            def create_invoice(self, payment, order):
+                return {}
+
+        with self.assertRaises(TypeError):
+            InvoiceOnlyGateway()
+        self.assertIsInstance(FakeGateway(), PaymentGateway)
+
+    def test_breaker_opens_then_allows_one_trial(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        breaker.reset_timeout = 0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def stale_payment(self, index, age=timedelta(minutes=10)):
+        payment = create_payment(index)
+        invoice = self.gateway.create_invoice(payment, payment.order)
+        Payment.objects.filter(id=payment.id).update(
+            paydunya_token=invoice['token'], updated_at=timezone.now() - age, created_at=timezone.now() - age
+        )
+        return payment
+
+    def test_reconcile_completes_stale_payments(self):
+        payments = [self.stale_payment(i) for i in range(5)]
+        fresh = create_payment(99)
+
+        counts = reconcile_pending(workers=4)
+
+        self.assertEqual(counts['completed'], 5)
+        for payment in payments:
+            response = self.client.get(reverse('payment-check-status', args=[payment.id]))
+            self.assertEqual(response.data['status'], 'completed')
+            payment.refresh_from_db()
+            self.assertEqual(payment.order.status, 'accepted')
+            self.assertIsNotNone(payment.last_checked_at)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, 'processing')
+        self.assertIsNone(fresh.last_checked_at)
+
+        # Déjà vérifiés : pas repris avant RECHECK_INTERVAL
+        calls = self.gateway.calls
+        self.assertFalse(any(reconcile_pending(workers=4).values()))
+        self.assertEqual(self.gateway.calls, calls)
+
+    def test_unavailable_gateway_leaves_payment_unchanged(self):
+        payment = self.stale_payment(1)
+        self.gateway.failure_rate = 1
+
+        counts = reconcile_pending(workers=1)
+
+        self.assertEqual(counts['error'], 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'processing')
+
+    def test_pending_invoice_expires(self):
+        self.gateway.confirm_status = 'pending'
+        recent = self.stale_payment(1)
+        old = self.stale_payment(2, age=timedelta(days=2))
+
+        counts = reconcile_pending(workers=2)
+
+        self.assertEqual((counts['pending'], counts['expired']), (1, 1))
+        recent.refresh_from_db()
+        old.refresh_from_db()
+        self.assertEqual(recent.status, 'processing')
+        self.assertEqual(old.status, 'cancelled')
+
+    def test_webhook_resolution_wins(self):
+        payment = self.stale_payment(1)
+        self.gateway.confirm_status = 'failed'
+        Payment.objects.filter(id=payment.id).update(status='completed')
+
+        self.assertFalse(any(reconcile_pending(workers=1).values()))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+
+@override_settings(PAYMENT_STATISTICS={'STATS_TTL': 0})
+class StatisticsTests(TestCase):
+
+    def setUp(self):
+        from accounts.models import User
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='finance', password='x'))
+        self.url = reverse('payment-statistics')
+        amounts = [('completed', 'orange_money', '1000.10', 0), ('completed', 'card', '2000.20', 0),
+                   ('completed', 'orange_money', '0.05', 3), ('failed', 'card', '500.00', 3),
+                   ('pending', 'mtn_money', '700.00', 10)]
+        for index, (payment_status, method, amount, age) in enumerate(amounts):
+            payment = create_payment(index, payment_status)
+            Payment.objects.filter(id=payment.id).update(
+                payment_method=method, amount=Decimal(amount),
+                created_at=timezone.now() - timedelta(days=age)
+            )
+
+    def test_single_grouped_query_with_exact_sums(self):
+        with self.assertNumQueries(1):
+            data = compute_payment_statistics()
+
+        self.assertEqual(data['total_payments'], 5)
+        self.assertEqual((data['completed_count'], data['pending_count'], data['failed_count']), (3, 1, 1))
+        self.assertEqual(data['total_amount'], Decimal('3000.35'))
+        self.assertEqual(data['by_method']['orange_money'], {'count': 2, 'total_amount': Decimal('1000.15')})
+        self.assertEqual(data['by_method']['moov_money']['count'], 0)
+        self.assertEqual([day['count'] for day in data['daily']], [1, 2, 2])
+        self.assertEqual(data['daily'][-1]['total_amount'], Decimal('3000.30'))
+
+    def test_date_range_filter(self):
+        today = timezone.localdate()
+        response = self.client.get(self.url, {
+            'date_from': str(today - timedelta(days=5)), 'date_to': str(today), 'payment_method': 'card'
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_payments'], 2)
+        self.assertEqual(response.data['total_amount'], Decimal('2000.20'))
+
+    def test_invalid_filters(self):
+        for params in ({'date_from': '2024-13-01'}, {'date_from': '2024-02-01', 'date_to': '2024-01-01'},
+                       {'status': 'inconnu'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class WebhookArchiveTests(TestCase):
+
+    def setUp(self):
+        payment = create_payment(1)
+        now = timezone.now()
+        for index in range(7):
+            webhook = PaymentWebhook.objects.create(
+                payment=payment, webhook_data={'token': 'token-1', 'index': index}, status='completed',
+                processed=index != 6, processed_at=now,
+            )
+            PaymentWebhook.objects.filter(id=webhook.id).update(received_at=now - timedelta(days=100 + index))
+        PaymentWebhook.objects.create(webhook_data={'recent': True}, status='completed', processed=True)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_archive_then_restore_range(self):
+        received = dict(PaymentWebhook.objects.values_list('id', 'received_at'))
+
+        self.assertEqual(archive_webhooks(days=90, dry_run=True), (6, 0))
+        self.assertEqual(archive_webhooks(days=90, chunk_size=4, directory=self.directory.name), (6, 2))
+        # Restent : le webhook récent et celui jamais traité
+        self.assertEqual(PaymentWebhook.objects.count(), 2)
+
+        oldest = timezone.localdate() - timedelta(days=105)
+        restored = restore_webhooks(oldest, oldest + timedelta(days=2), directory=self.directory.name)
+        self.assertEqual(restored, 3)
+        for webhook in PaymentWebhook.objects.filter(processed=True, received_at__lt=timezone.now() - timedelta(days=90)):
+            self.assertEqual(webhook.received_at, received[webhook.id])
+            self.assertEqual(webhook.payment.paydunya_token, 'token-1')
+
+        # Restauration complète : les lignes déjà présentes sont ignorées
+        self.assertEqual(restore_webhooks(directory=self.directory.name), 3)
+        self.assertEqual(PaymentWebhook.objects.count(), 8)
+
+    def test_unprocessed_is_paginated(self):
+        from accounts.models import User
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='admin', password='x'))
+        response = client.get(reverse('payment-webhook-unprocessed'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+@override_settings(PAYMENT_REFUNDS={'BACKEND': 'none', 'WORKERS': 1, 'CHUNK_SIZE': 2})
+class RefundTests(TestCase):
+
+    def setUp(self):
+        from accounts.models import User
+
+        self.gateway = FakeGateway()
+        self.previous = set_gateway(self.gateway)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='manager', password='x', user_type='manager'))
+
+        self.paid = [create_payment(i, 'completed') for i in range(5)]
+        self.unpaid = create_payment(10, 'pending')
+        self.open_invoice = create_payment(11, 'processing')
+        self.cash = create_payment(12, 'completed')
+        Payment.objects.filter(id=self.cash.id).update(payment_method='cash')
+        self.delivered = create_payment(13, 'completed')
+        Order.objects.filter(id=self.delivered.order_id).update(status='delivered')
+        Order.objects.filter(payment__status='completed').exclude(status='delivered').update(status='preparing')
+
+    def tearDown(self):
+        set_gateway(self.previous)
+
+    def test_bulk_cancel_and_refund_job(self):
+        response = self.client.post(reverse('refund-job-list'), {
+            'statuses': ['pending', 'preparing'], 'reason': 'Panne cuisine'
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['id']
+
+        self.assertTrue(run_refund_job(job_id))
+        self.assertFalse(run_refund_job(job_id))
+
+        data = self.client.get(reverse('refund-job-detail', args=[job_id])).data
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual((data['orders_matched'], data['orders_cancelled']), (8, 8))
+        self.assertEqual(data['payments_cancelled'], 1)
+        self.assertEqual((data['refunds_total'], data['refunds_completed'], data['refunds_failed']), (5, 5, 0))
+        self.assertEqual(data['progress'], 100)
+        self.assertEqual(self.gateway.refunds, 5)
+
+        statuses = dict(Payment.objects.values_list('id', 'status'))
+        self.assertEqual({statuses[payment.id] for payment in self.paid}, {'refunded'})
+        self.assertEqual(statuses[self.unpaid.id], 'cancelled')
+        self.assertEqual(statuses[self.open_invoice.id], 'processing')
+        self.assertEqual(statuses[self.cash.id], 'completed')
+        self.assertEqual(statuses[self.delivered.id], 'completed')
+        self.assertEqual(Order.objects.filter(status='cancelled', cancellation_reason='Panne cuisine').count(), 8)
+
+        refunds = self.client.get(reverse('refund-job-refunds', args=[job_id])).data
+        self.assertEqual(refunds['count'], 5)
+
+    def test_failed_refund_is_reported_and_not_retried(self):
+        self.gateway.failure_rate = 1
+        job = start_refund_job({'order_numbers': ['PAY-0']}, 'Panne')
+        run_refund_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual((job.refunds_total, job.refunds_failed), (1, 1))
+        self.assertEqual(Refund.objects.get().status, 'failed')
+        self.assertEqual(Payment.objects.get(id=self.paid[0].id).status, 'completed')
+
+        # Commande rouverte puis annulée à nouveau : la ligne Refund existante
+        # (contrainte unique par paiement) bloque un second remboursement
+        self.gateway.failure_rate = 0
+        Order.objects.filter(id=self.paid[0].order_id).update(status='preparing')
+        refund_ids = cancel_orders([self.paid[0].order_id], 'Panne')
+        self.assertEqual(Order.objects.get(id=self.paid[0].order_id).status, 'cancelled')
+        self.assertEqual(refund_ids, [])
+        self.assertEqual(execute_refunds(refund_ids), {'completed': 0, 'failed': 0, 'skipped': 0})
+        self.assertEqual(Refund.objects.get().status, 'failed')
+        self.assertEqual(self.gateway.refunds, 0)
+
+    @override_settings(PAYMENT_REFUNDS={'BACKEND': 'sync', 'WORKERS': 1})
+    def test_order_cancel_refunds_payment(self):
+        order = self.paid[0].order
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('order-cancel', args=[order.order_number]), {'reason': 'Client absent'}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Payment.objects.get(id=self.paid[0].id).status, 'refunded')
+        self.assertEqual(Refund.objects.get().transaction_id, f'FAKE-R-{self.paid[0].id}')
+
+        response = self.client.post(reverse('order-cancel', args=[self.delivered.order.order_number]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_order_cancel_requires_authentication(self):
+        from accounts.models import ClientDevice, User
+
+        order = self.paid[0].order
+        Order.objects.filter(id=order.id).update(device=ClientDevice.objects.create(device_id='appareil-1'))
+        url = reverse('order-cancel', args=[order.order_number])
+
+        # Un device_id ne remplace pas l'authentification
+        anonymous = APIClient()
+        self.assertEqual(anonymous.post(url, {'device_id': 'appareil-1'}, format='json').status_code, 401)
+        self.assertEqual(Order.objects.get(id=order.id).status, 'preparing')
+        self.assertFalse(Refund.objects.exists())
+
+        user = APIClient()
+        user.force_authenticate(User.objects.create_user(username='client', password='x'))
+        self.assertEqual(user.post(url, {'reason': 'Changement de plans'}, format='json').status_code, 200)
+        self.assertEqual(Refund.objects.get().payment_id, self.paid[0].id)
+
+    def test_paydunya_refunds_only_to_payer_account(self):
+        from .gateway import PayDunyaGateway, payer_account
+
+        gateway = PayDunyaGateway('master', 'private', 'token', withdraw_modes={'orange_money': 'orange-money-senegal'})
+        payment = self.paid[0]
+        Order.objects.filter(id=payment.order_id).update(status='cancelled')
+        refund = Refund.objects.create(payment=payment, amount=payment.amount)
+
+        # Sans reçu, le téléphone saisi sur la commande n'est pas utilisé
+        self.assertIsNone(payer_account(payment))
+        self.assertEqual(execute_refunds([refund.id], gateway=gateway)['failed'], 1)
+        refund.refresh_from_db()
+        self.assertEqual(refund.status, 'failed')
+        self.assertIn('manuellement', refund.error)
+        self.assertEqual(Payment.objects.get(id=payment.id).status, 'completed')
+
+        PaymentWebhook.objects.create(
+            token=payment.paydunya_token, status='completed',
+            webhook_data={'token': payment.paydunya_token, 'customer': {'phone': '22997000000'}}
+        )
+        self.assertEqual(payer_account(payment), '22997000000')
+        payment.paydunya_response = {'customer': {'phone': '22996000000'}}
+        self.assertEqual(payer_account(payment), '22996000000')
+
+    def test_filter_is_required(self):
+        response = self.client.post(reverse('refund-job-list'), {'reason': 'Panne'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('refund-job-list'), {
+            'statuses': ['delivered'], 'reason': 'Panne'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PAYMENT_WEBHOOKS=QUEUE_ONLY)
+class WebhookReplayTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('paydunya-webhook')
+
+    def post(self, payload):
+        response = self.client.post(self.url, dict(payload, hash=expected_hash()), format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def drain(self):
+        for _ in range(100):
+            counts = process_pending(batch_size=50, workers=1)
+            if not any(counts.values()):
+                return
+        self.fail("La file de webhooks ne se vide pas")
+
+    def test_duplicate_is_acknowledged_without_write(self):
+        create_payment(1)
+        payload = {'token': 'token-1', 'status': 'completed', 'transaction_id': 'T1'}
+        first = self.post(payload)
+        second = self.post(payload)
+
+        self.assertTrue(second.data['duplicate'])
+        self.assertEqual(second.data['webhook'], first.data['webhook'])
+        self.assertEqual(PaymentWebhook.objects.count(), 1)
+
+    def test_late_failure_does_not_overwrite_completion(self):
+        payment = create_payment(1)
+        self.post({'token': 'token-1', 'status': 'completed', 'transaction_id': 'T1'})
+        self.post({'token': 'token-1', 'status': 'failed'})
+        self.drain()
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.transaction_id, 'T1')
+        self.assertEqual(payment.order.status, 'accepted')
+
+    def test_unknown_payment_is_retried_then_abandoned(self):
+        self.post({'token': 'inconnu', 'status': 'completed'})
+        webhook = PaymentWebhook.objects.get()
+
+        for _ in range(QUEUE_ONLY['MAX_ATTEMPTS']):
+            PaymentWebhook.objects.filter(id=webhook.id, next_attempt_at__isnull=False).update(
+                next_attempt_at=webhook.received_at
+            )
+            process_pending(workers=1)
+
+        webhook.refresh_from_db()
+        self.assertFalse(webhook.processed)
+        self.assertEqual(webhook.attempts, QUEUE_ONLY['MAX_ATTEMPTS'])
+        self.assertIsNone(webhook.next_attempt_at)
+        self.assertEqual(webhook.processing_error, 'Paiement non trouvé')
+
+    def test_shuffled_duplicated_stream(self):
+        rng = random.Random(42)
+        payments = [create_payment(i) for i in range(30)]
+
+        # Événements par token : parfois un échec tardif ou un remboursement
+        events = []
+        for payment in payments:
+            token = payment.paydunya_token
+            outcome = rng.choice(['completed', 'failed', 'cancelled'])
+            stream = [{'token': token, 'status': 'processing'}]
+            stream.append({'token': token, 'status': outcome, 'transaction_id': f'T-{token}'})
+            if outcome == 'completed' and rng.random() < 0.5:
+                stream.append({'token': token, 'status': 'failed', 'transaction_id': f'T-{token}'})
+            if outcome == 'completed' and rng.random() < 0.3:
+                stream.append({'token': token, 'status': 'refunded'})
+            events.extend(stream)
+
+        # Réessais PayDunya : chaque événement peut arriver jusqu'à 3 fois, dans le désordre
+        delivered = [event for event in events for _ in range(rng.randint(1, 3))]
+        rng.shuffle(delivered)
+
+        # Résultat attendu : chaque événement compte une fois, à sa première réception
+        seen, first_seen = set(), []
+        for event in delivered:
+            if tuple(sorted(event.items())) not in seen:
+                seen.add(tuple(sorted(event.items())))
+                first_seen.append(event)
+        expected = {}
+        for event in first_seen:
+            current = expected.get(event['token'], 'processing')
+            if can_transition(current, event['status']):
+                expected[event['token']] = event['status']
+
+        for event in delivered:
+            self.post(event)
+        self.assertEqual(PaymentWebhook.objects.count(), len(first_seen))
+
+        self.drain()
+
+        self.assertFalse(PaymentWebhook.objects.filter(processed=False).exists())
+        for payment in payments:
+            payment.refresh_from_db()
+            final = expected.get(payment.paydunya_token, 'processing')
+            self.assertEqual(payment.status, final, payment.paydunya_token)
+            order_status = 'accepted' if final in ('completed', 'refunded') else 'pending'
+            self.assertEqual(payment.order.status, order_status, payment.paydunya_token)
+
+
+class PaymentCreationTests(TestCase):
+
+    def setUp(self):
+        self.gateway = FakeGateway()
+        self.previous = set_gateway(self.gateway)
+        self.client = APIClient()
+        self.url = reverse('payment-list')
+        self.order = Order.objects.create(
+            order_number='CRE-1', delivery_address='Cotonou', customer_name='Client',
+            customer_phone='0100000000', subtotal=5000, total=5000
+        )
+
+    def tearDown(self):
+        set_gateway(self.previous)
+
+    def create(self, order_id=None, payment_method='orange_money'):
+        return self.client.post(self.url, {
+            'order': order_id or self.order.id, 'amount': '5000.00', 'payment_method': payment_method
+        }, format='json')
+
+    def test_create_opens_invoice(self):
+        response = self.create()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'processing')
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual(payment.paydunya_token, response.data['paydunya_token'])
+        self.assertIn(payment.paydunya_token, self.gateway.invoices)
+
+    def test_cash_payment_opens_no_invoice(self):
+        response = self.create(payment_method='cash')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(self.gateway.calls, 0)
+        # Hors du périmètre de la réconciliation (pas de facture à vérifier)
+        self.assertEqual(reconcile_pending(gateway=self.gateway, workers=1)['pending'], 0)
+
+    def test_second_payment_is_refused(self):
+        self.create()
+        response = self.create()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Un paiement existe déjà pour cette commande')
+        self.assertEqual(self.gateway.calls, 1)
+
+    def test_unknown_order(self):
+        self.assertEqual(self.create(order_id=999999).status_code, 404)
+
+    def test_gateway_failure_marks_payment_failed(self):
+        self.gateway.failure_rate = 1
+        response = self.create()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.get(order=self.order).status, 'failed')
+
+
+@override_settings(PAYMENT_WEBHOOKS={'BACKEND': 'thread', 'ORDER_DELAY': 0.1, 'BACKOFF_MAX': 1})
+class WebhookThreadQueueTests(ThreadedTestCase):
+    """Backend 'thread' sans la commande process_webhooks"""
+
+    def tearDown(self):
+        webhook_queue.shutdown()
+
+    def test_concurrent_events_of_one_token_are_all_applied(self):
+        payment = create_payment(1, payment_status='pending')
+        events = [
+            {'token': 'token-1', 'status': 'processing'},
+            {'token': 'token-1', 'status': 'completed', 'transaction_id': 'T1'},
+        ]
+        barrier = threading.Barrier(len(events))
+
+        def post(event):
+            try:
+                barrier.wait()
+                APIClient().post(reverse('paydunya-webhook'), dict(event, hash=expected_hash()), format='json')
+            finally:
+                close_old_connections()
+
+        # Traitement lent : le second événement trouve le premier en cours et est reporté
+        def slow_apply(webhook):
+            time.sleep(0.3)
+            return apply_webhook(webhook)
+
+        with mock.patch('payments.webhooks.apply_webhook', side_effect=slow_apply):
+            threads = [threading.Thread(target=post, args=(event,)) for event in events]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            deadline = time.monotonic() + 10
+            while PaymentWebhook.objects.filter(processed=False).exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        self.assertEqual(PaymentWebhook.objects.filter(processed=True).count(), 2)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.transaction_id, 'T1')
+
+    def test_concurrent_claims_grant_one_lease(self):
+        webhook = PaymentWebhook.objects.create(webhook_data={}, status='completed', next_attempt_at=timezone.now())
+        barrier = threading.Barrier(8)
+        claims = []
+
+        def claim():
+            try:
+                barrier.wait()
+                claims.append(claim_webhook(webhook.id))
+            finally:
+                close_old_connections()
+
+        # Une seule instruction UPDATE conditionnelle : sans verrou applicatif ni transaction
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(claims), [False] * 7 + [True])
+
+
+class PaymentCreationConcurrencyTests(ThreadedTestCase):
+    """Requêtes simultanées réelles (threads, une connexion chacun)"""
+
+    def setUp(self):
+        # Latence : les appels à la passerelle se chevauchent
+        self.gateway = FakeGateway(latency=0.05)
+        self.previous = set_gateway(self.gateway)
+        self.url = reverse('payment-list')
+
+    def tearDown(self):
+        set_gateway(self.previous)
+
+    def create_order(self, index):
+        return Order.objects.create(
+            order_number=f'CON-{index}', delivery_address='Cotonou', customer_name='Client',
+            customer_phone='0100000000', subtotal=5000, total=5000
+        )
+
+    def race(self, order_ids):
+        """Poster un paiement par id de commande, toutes les requêtes partant ensemble"""
+        barrier = threading.Barrier(len(order_ids))
+        responses = [None] * len(order_ids)
+
+        def post(index, order_id):
+            try:
+                barrier.wait()
+                responses[index] = APIClient().post(self.url, {
+                    'order': order_id, 'amount': '5000.00', 'payment_method': 'orange_money'
+                }, format='json')
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=post, args=item) for item in enumerate(order_ids)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_concurrent_requests_create_one_payment(self):
+        order = self.create_order(1)
+
+        responses = self.race([order.id] * 8)
+
+        codes = sorted(response.status_code for response in responses)
+        self.assertEqual(codes, [201] + [400] * 7)
+        self.assertEqual(Payment.objects.filter(order=order).count(), 1)
+        # Une seule facture : les perdants sont refusés avant l'appel à la passerelle
+        self.assertEqual(self.gateway.calls, 1)
+        payment = Payment.objects.get(order=order)
+        self.assertEqual(payment.status, 'processing')
+        self.assertEqual(list(self.gateway.invoices), [payment.paydunya_token])
+
+    def test_concurrent_orders_do_not_block_each_other(self):
+        orders = [self.create_order(i) for i in range(8)]
+
+        responses = self.race([order.id for order in orders])
+
+        self.assertEqual([response.status_code for response in responses], [201] * 8)
+        self.assertEqual(Payment.objects.filter(status='processing').count(), 8)
+        self.assertEqual(len(self.gateway.invoices), 8)
+
+
+@override_settings(PAYDUNYA_MASTER_KEY='cle-de-test')
+class WebhookSignatureTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('paydunya-webhook')
+        self.payment = create_payment(1)
+        self.payload = {'token': 'token-1', 'status': 'completed', 'transaction_id': 'T1'}
+
+    def test_forged_webhook_is_rejected_without_write(self):
+        with self.assertLogs('payments.views', 'WARNING') as logs:
+            for payload in (self.payload, dict(self.payload, hash='0' * 128), dict(self.payload, hash='é')):
+                response = self.client.post(self.url, payload, format='json')
+                self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(logs.output), 3)
+        self.assertFalse(PaymentWebhook.objects.exists())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'processing')
+
+    def test_paydunya_hash_is_accepted_and_not_stored(self):
+        response = self.client.post(self.url, dict(self.payload, hash=expected_hash().upper()), format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('hash', PaymentWebhook.objects.get().webhook_data)
+
+    def test_body_signature_binds_content(self):
+        body = b'{"token": "token-1", "status": "completed"}'
+        signed = self.client.post(
+            self.url, body, content_type='application/json', headers={SIGNATURE_HEADER: sign_body(body)}
+        )
+        with self.assertLogs('payments.views', 'WARNING'):
+            tampered = self.client.post(
+                self.url, body.replace(b'completed', b'cancelled'), content_type='application/json',
+                headers={SIGNATURE_HEADER: sign_body(body)}
+            )
+
+        self.assertEqual(signed.status_code, 200)
+        self.assertEqual(tampered.status_code, 403)
+        self.assertEqual(PaymentWebhook.objects.count(), 1)
+
+    def test_key_rotation(self):
+        hash_before = expected_hash()
+        with self.settings(PAYDUNYA_MASTER_KEY='nouvelle-cle'), self.assertLogs('payments.views', 'WARNING'):
+            response = self.client.post(self.url, dict(self.payload, hash=hash_before), format='json')
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,61 @@
+# ===================================
+# payments/transitions.py
+# ===================================
+
+"""
+Transitions de statut des paiements.
+
+Les statuts forment un treillis monotone : pending → processing →
+completed / failed / cancelled, puis completed → refunded. Un paiement ne
+revient jamais en arrière et deux statuts finaux ne se remplacent pas : un
+`failed` reçu en retard n'écrase pas un `completed`. Chaque transition est
+une mise à jour conditionnelle sur le statut courant, sans verrou de ligne.
+"""
+
+from django.utils import timezone
+from .models import Payment
+
+TRANSITIONS = {
+    'pending': ('processing', 'completed', 'failed', 'cancelled'),
+    'processing': ('completed', 'failed', 'cancelled'),
+    'completed': ('refunded',),
+    'failed': (),
+    'cancelled': (),
+    'refunded': (),
+}
+
+
+def can_transition(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def predecessors(target):
+    """Statuts depuis lesquels `target` est atteignable"""
+    return [current for current, targets in TRANSITIONS.items() if target in targets]
+
+
+def transition_payment(payment_id, target, transaction_id=None, now=None, **fields):
+    """
+    Passer le paiement à `target` s'il est dans un statut prédécesseur.
+    Retourne True si la transition a eu lieu. Un paiement complété fait
+    passer sa commande de `pending` à `accepted`.
+    """
+    from orders.models import Order
+
+    sources = predecessors(target)
+    if not sources:
+        return False
+
+    now = now or timezone.now()
+    values = dict(fields, status=target, updated_at=now)
+    if target == 'completed':
+        values['completed_at'] = now
+        if transaction_id:
+            values['transaction_id'] = transaction_id
+
+    changed = Payment.objects.filter(id=payment_id, status__in=sources).update(**values) == 1
+    if changed and target == 'completed':
+        Order.objects.filter(payment__id=payment_id, status='pending').update(
+            status='accepted', updated_at=now
+        )
+    return changed
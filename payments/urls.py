@@ -5,11 +5,12 @@
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PaymentViewSet, PaymentWebhookViewSet, paydunya_webhook
+from .views import PaymentViewSet, PaymentWebhookViewSet, RefundJobViewSet, paydunya_webhook
 
 router = DefaultRouter()
 router.register(r'payments', PaymentViewSet, basename='payment')
 router.register(r'webhooks', PaymentWebhookViewSet, basename='payment-webhook')
+router.register(r'refund-jobs', RefundJobViewSet, basename='refund-job')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -6,14 +6,21 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from django.conf import settings
-from .models import Payment, PaymentWebhook
+from RestoOnline.idempotency import idempotent
+from .models import Payment, PaymentWebhook, RefundJob
 from .serializers import (
-    PaymentSerializer, PaymentCreateSerializer, PaymentWebhookSerializer
+    PaymentSerializer, PaymentCreateSerializer, PaymentWebhookSerializer,
+    RefundJobSerializer, RefundJobCreateSerializer, RefundSerializer
 )
-import hashlib
-import json
+from .gateway import GatewayError, get_gateway
+from .transitions import transition_payment
+from .signatures import SIGNATURE_HEADER, verify_webhook
+from .webhooks import enqueue_webhook, find_duplicate, webhook_fingerprint
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class PaymentViewSet(viewsets.ModelViewSet):
@@ -50,128 +57,98 @@ class PaymentViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
     
+    @idempotent
     def create(self, request, *args, **kwargs):
-        """Initialiser un paiement avec PayDunya"""
-        from orders.models import Order
-        
-        order_id = request.data.get('order')
+        """
+        Initialiser un paiement avec PayDunya. L'unicité du paiement par
+        commande est garantie par la contrainte OneToOne : deux requêtes
+        simultanées ne créent qu'un paiement, la seconde reçoit 400. La
+        facture est créée hors transaction; un paiement en espèces n'en a pas.
+        """
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            if any(error.code == 'does_not_exist' for error in serializer.errors.get('order', [])):
+                return Response(
+                    {'error': 'Commande non trouvée'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
+        # Insertion conditionnelle : la contrainte d'unicité tranche entre requêtes concurrentes
         try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
+            with transaction.atomic():
+                payment = serializer.save()
+        except IntegrityError:
             return Response(
-                {'error': 'Commande non trouvée'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Un paiement existe déjà pour cette commande'},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        if hasattr(order, 'payment'):
+        # Espèces : aucune facture, le paiement reste `pending` jusqu'à
+        # l'encaissement par le livreur (delivery/cash.py)
+        if payment.payment_method == 'cash':
             return Response(
-                {'error': 'Un paiement existe déjà pour cette commande'},
-                status=status.HTTP_400_BAD_REQUEST
+                PaymentSerializer(payment).data,
+                status=status.HTTP_201_CREATED
             )
         
-        # Créer le paiement
-        serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
-            payment = serializer.save()
-            
-            # Intégration PayDunya
-            paydunya_response = self._initialize_paydunya_payment(payment, order)
-            
-            if paydunya_response.get('success'):
-                payment.paydunya_token = paydunya_response.get('token')
-                payment.paydunya_invoice_url = paydunya_response.get('invoice_url')
-                payment.paydunya_response_code = paydunya_response.get('response_code')
-                payment.paydunya_response_text = paydunya_response.get('response_text')
-                payment.paydunya_response = paydunya_response
-                payment.status = 'processing'
-                payment.save()
-                
-                return Response(
-                    PaymentSerializer(payment).data,
-                    status=status.HTTP_201_CREATED
-                )
-            else:
-                payment.status = 'failed'
-                payment.paydunya_response = paydunya_response
-                payment.save()
-                
-                return Response(
-                    {'error': 'Échec de l\'initialisation du paiement', 'details': paydunya_response},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        # Intégration PayDunya (aucune transaction ni verrou ouvert pendant l'appel)
+        paydunya_response = self._initialize_paydunya_payment(payment, serializer.validated_data['order'])
+        
+        if paydunya_response.get('success'):
+            fields = {
+                'paydunya_token': paydunya_response.get('token'),
+                'paydunya_invoice_url': paydunya_response.get('invoice_url'),
+                'paydunya_response_code': paydunya_response.get('response_code'),
+                'paydunya_response_text': paydunya_response.get('response_text'),
+                'paydunya_response': paydunya_response,
+            }
+            self._apply_transition(payment, 'processing', fields)
+            return Response(
+                PaymentSerializer(payment).data,
+                status=status.HTTP_201_CREATED
+            )
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        self._apply_transition(payment, 'failed', {'paydunya_response': paydunya_response})
+        return Response(
+            {'error': 'Échec de l\'initialisation du paiement', 'details': paydunya_response},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    def _apply_transition(self, payment, target, fields):
+        """Mise à jour limitée au statut et aux champs PayDunya; relit le paiement s'il a changé entre-temps"""
+        now = timezone.now()
+        if transition_payment(payment.id, target, now=now, **fields):
+            for name, value in fields.items():
+                setattr(payment, name, value)
+            payment.status = target
+            payment.updated_at = now
+        else:
+            payment.refresh_from_db()
     
     def _initialize_paydunya_payment(self, payment, order):
-        """
-        Initialiser un paiement avec l'API PayDunya
-        NOTE: Cette fonction est un exemple. Vous devez adapter selon la documentation PayDunya.
-        """
+        """Créer la facture auprès de la passerelle (payments/gateway.py)"""
         try:
-            # Import de la bibliothèque PayDunya (à installer via pip)
-            # pip install paydunya
-            from paydunya import Invoice, Setup
-            
-            # Configuration PayDunya
-            setup = Setup({
-                'master_key': settings.PAYDUNYA_MASTER_KEY,
-                'private_key': settings.PAYDUNYA_PRIVATE_KEY,
-                'public_key': settings.PAYDUNYA_PUBLIC_KEY,
-                'token': settings.PAYDUNYA_TOKEN,
-                'mode': settings.PAYDUNYA_MODE  # 'test' ou 'live'
-            })
-            
-            # Créer la facture
-            invoice = Invoice(setup)
-            invoice.add_item(
-                name=f"Commande {order.order_number}",
-                quantity=1,
-                unit_price=float(payment.amount),
-                total_price=float(payment.amount),
-                description=f"Paiement pour la commande {order.order_number}"
-            )
-            
-            # Informations client
-            invoice.set_custom_data([
-                ('order_id', order.id),
-                ('order_number', order.order_number),
-                ('customer_name', order.customer_name),
-                ('customer_phone', order.customer_phone),
-            ])
-            
-            # URLs de callback
-            invoice.set_callback_url(f"{settings.SITE_URL}/api/payments/webhook/")
-            invoice.set_return_url(f"{settings.SITE_URL}/orders/{order.order_number}/payment/success/")
-            invoice.set_cancel_url(f"{settings.SITE_URL}/orders/{order.order_number}/payment/cancel/")
-            
-            # Créer la facture
-            response = invoice.create()
-            
-            if response['response_code'] == '00':
-                return {
-                    'success': True,
-                    'token': response['token'],
-                    'invoice_url': response['response_text'],
-                    'response_code': response['response_code'],
-                    'response_text': response['response_text']
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': response.get('response_text', 'Erreur inconnue'),
-                    'response_code': response.get('response_code')
-                }
-        
-        except Exception as e:
+            invoice = get_gateway().create_invoice(payment, order)
+        except GatewayError as e:
             return {
                 'success': False,
                 'error': str(e)
             }
+        return {
+            'success': True,
+            'token': invoice['token'],
+            'invoice_url': invoice['invoice_url'],
+            'response_code': invoice['response_code'],
+            'response_text': invoice['response_text']
+        }
     
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
     def check_status(self, request, pk=None):
-        """Vérifier le statut d'un paiement auprès de PayDunya"""
+        """
+        Statut d'un paiement, tel que réconcilié par les webhooks et par
+        `reconcile_payments` : pas d'appel synchrone à PayDunya
+        """
         payment = self.get_object()
         
         if not payment.paydunya_token:
@@ -180,156 +157,109 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        status_response = self._check_paydunya_status(payment)
-        
-        # Mettre à jour le statut du paiement si nécessaire
-        if status_response.get('status') == 'completed':
-            payment.status = 'completed'
-            payment.transaction_id = status_response.get('transaction_id')
-            payment.completed_at = timezone.now()
-            payment.save()
-            
-            # Mettre à jour le statut de la commande si nécessaire
-            if payment.order.status == 'pending':
-                payment.order.status = 'accepted'
-                payment.order.save()
-        
         serializer = PaymentSerializer(payment)
         return Response(serializer.data)
     
-    def _check_paydunya_status(self, payment):
-        """
-        Vérifier le statut d'un paiement auprès de PayDunya
-        NOTE: Adapter selon la documentation PayDunya
-        """
-        try:
-            from paydunya import Invoice, Setup
-            
-            setup = Setup({
-                'master_key': settings.PAYDUNYA_MASTER_KEY,
-                'private_key': settings.PAYDUNYA_PRIVATE_KEY,
-                'public_key': settings.PAYDUNYA_PUBLIC_KEY,
-                'token': settings.PAYDUNYA_TOKEN,
-                'mode': settings.PAYDUNYA_MODE
-            })
-            
-            invoice = Invoice(setup)
-            status = invoice.confirm(payment.paydunya_token)
-            
-            return {
-                'status': 'completed' if status['status'] == 'completed' else 'pending',
-                'transaction_id': status.get('transaction_id'),
-                'response': status
-            }
-        
-        except Exception as e:
-            return {
-                'status': 'error',
-                'error': str(e)
-            }
-    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Statistiques des paiements"""
-        from django.db.models import Sum, Count
-        
-        queryset = self.get_queryset()
-        
-        total_payments = queryset.count()
-        completed_payments = queryset.filter(status='completed')
+        """
+        Statistiques des paiements (une requête groupée, en cache).
+        Filtres : date_from, date_to (AAAA-MM-JJ, inclus), status, payment_method, order_id
+        """
+        from django.utils.dateparse import parse_date
+        from .stats import payment_statistics
+        
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = request.query_params.get(name)
+            if not value:
+                continue
+            try:
+                dates[name] = parse_date(value)
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                return Response(
+                    {'error': f'{name} invalide (format AAAA-MM-JJ)'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        if dates.get('date_from') and dates.get('date_to') and dates['date_from'] > dates['date_to']:
+            return Response(
+                {'error': 'date_from doit précéder date_to'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        stats = {
-            'total_payments': total_payments,
-            'completed_count': completed_payments.count(),
-            'pending_count': queryset.filter(status='pending').count(),
-            'failed_count': queryset.filter(status='failed').count(),
-            'total_amount': float(completed_payments.aggregate(
-                Sum('amount')
-            )['amount__sum'] or 0),
-            'by_method': {}
+        filters = {}
+        choices = {
+            'status': dict(Payment.STATUS_CHOICES),
+            'payment_method': dict(Payment.PAYMENT_METHOD_CHOICES),
         }
+        for name, allowed in choices.items():
+            value = request.query_params.get(name)
+            if value:
+                if value not in allowed:
+                    return Response(
+                        {'error': f'{name} invalide'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                filters[name] = value
+        order_id = request.query_params.get('order_id')
+        if order_id:
+            if not order_id.isdigit():
+                return Response(
+                    {'error': 'order_id invalide'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            filters['order_id'] = int(order_id)
         
-        # Statistiques par méthode de paiement
-        for method, _ in Payment.PAYMENT_METHOD_CHOICES:
-            method_payments = completed_payments.filter(payment_method=method)
-            stats['by_method'][method] = {
-                'count': method_payments.count(),
-                'total_amount': float(method_payments.aggregate(
-                    Sum('amount')
-                )['amount__sum'] or 0)
-            }
-        
-        return Response(stats)
+        return Response(payment_statistics(**dates, **filters))
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def paydunya_webhook(request):
     """
-    Endpoint webhook pour recevoir les notifications PayDunya
-    NOTE: Adapter selon la documentation PayDunya
+    Endpoint webhook pour recevoir les notifications PayDunya.
+    Le contenu est enregistré puis traité en arrière-plan (payments/webhooks.py) :
+    la réponse ne dépend pas de la charge de la base. Un webhook dont
+    l'origine n'est pas vérifiée (payments/signatures.py) est refusé avant
+    toute écriture.
     """
-    try:
-        # Récupérer les données du webhook
-        webhook_data = request.data
-        
-        # Créer un enregistrement du webhook
-        webhook = PaymentWebhook.objects.create(
+    body = request.body  # Corps brut, lu avant request.data
+    webhook_data = request.data.dict() if hasattr(request.data, 'dict') else request.data
+    
+    if not verify_webhook(body, webhook_data, request.headers.get(SIGNATURE_HEADER)):
+        logger.warning("Webhook PayDunya refusé : signature invalide (%s)", request.META.get('REMOTE_ADDR'))
+        return Response({'error': 'Signature invalide'}, status=status.HTTP_403_FORBIDDEN)
+    
+    # Le hash dérive de la clé principale : il n'est pas conservé dans les logs
+    webhook_data = {key: value for key, value in webhook_data.items() if key != 'hash'}
+    
+    if not webhook_data.get('token'):
+        PaymentWebhook.objects.create(
             webhook_data=webhook_data,
-            status=webhook_data.get('status', 'unknown')
+            status=webhook_data.get('status', 'unknown'),
+            processed=True,
+            processing_error='Token manquant'
         )
-        
-        # Extraire les informations importantes
-        token = webhook_data.get('token')
-        status_value = webhook_data.get('status')
-        transaction_id = webhook_data.get('transaction_id')
-        
-        if not token:
-            webhook.processing_error = 'Token manquant'
-            webhook.save()
-            return Response({'error': 'Token manquant'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Trouver le paiement correspondant
-        try:
-            payment = Payment.objects.get(paydunya_token=token)
-            webhook.payment = payment
-        except Payment.DoesNotExist:
-            webhook.processing_error = 'Paiement non trouvé'
-            webhook.save()
-            return Response({'error': 'Paiement non trouvé'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Mettre à jour le statut du paiement
-        if status_value == 'completed':
-            payment.status = 'completed'
-            payment.transaction_id = transaction_id
-            payment.completed_at = timezone.now()
-            payment.save()
-            
-            # Mettre à jour la commande
-            if payment.order.status == 'pending':
-                payment.order.status = 'accepted'
-                payment.order.save()
-        
-        elif status_value in ['failed', 'cancelled']:
-            payment.status = status_value
-            payment.save()
-        
-        # Marquer le webhook comme traité
-        webhook.processed = True
-        webhook.processed_at = timezone.now()
-        webhook.save()
-        
-        return Response({'success': True}, status=status.HTTP_200_OK)
+        return Response({'error': 'Token manquant'}, status=status.HTTP_400_BAD_REQUEST)
     
-    except Exception as e:
-        if 'webhook' in locals():
-            webhook.processing_error = str(e)
-            webhook.save()
-        
-        return Response(
-            {'error': 'Erreur de traitement', 'details': str(e)},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    # Copie d'un webhook déjà reçu (réessai PayDunya) : acquittée sans écriture
+    fingerprint = webhook_fingerprint(webhook_data)
+    original_id = find_duplicate(fingerprint)
+    if original_id is not None:
+        return Response({'success': True, 'webhook': original_id, 'duplicate': True}, status=status.HTTP_200_OK)
+    
+    webhook = PaymentWebhook.objects.create(
+        webhook_data=webhook_data,
+        status=webhook_data.get('status', 'unknown'),
+        token=str(webhook_data['token'])[:255],
+        fingerprint=fingerprint,
+        next_attempt_at=timezone.now()
+    )
+    enqueue_webhook(webhook.id)
+    
+    return Response({'success': True, 'webhook': webhook.id}, status=status.HTTP_200_OK)
 
 
 class PaymentWebhookViewSet(viewsets.ReadOnlyModelViewSet):
@@ -355,8 +285,65 @@ class PaymentWebhookViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def unprocessed(self, request):
-        """Webhooks non traités"""
+        """Webhooks non traités (paginés)"""
         unprocessed = self.get_queryset().filter(processed=False)
+        page = self.paginate_queryset(unprocessed)
+        if page is not None:
+            serializer = PaymentWebhookSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = PaymentWebhookSerializer(unprocessed, many=True)
         return Response(serializer.data)
 
+
+
+class RefundJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Annulations et remboursements en masse (Manager)"""
+    queryset = RefundJob.objects.all()
+    serializer_class = RefundJobSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        # Les livreurs n'ont pas accès aux jobs
+        if self.request.user.user_type == 'delivery':
+            return RefundJob.objects.none()
+        return RefundJob.objects.order_by('-created_at')
+    
+    def create(self, request, *args, **kwargs):
+        """Annuler les commandes correspondant au filtre et rembourser leurs paiements"""
+        from .refunds import RefundError, clean_filters, start_refund_job
+        
+        if request.user.user_type == 'delivery':
+            return Response(
+                {'error': 'Réservé aux managers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = RefundJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+        reason = data.pop('reason')
+        
+        try:
+            filters = clean_filters(data)
+        except RefundError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job = start_refund_job(filters, reason, created_by=request.user)
+        return Response(RefundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def refunds(self, request, pk=None):
+        """Remboursements du job (paginés), filtrables par statut"""
+        job = self.get_object()
+        refunds = job.refunds.select_related('payment__order').order_by('id')
+        refund_status = request.query_params.get('status')
+        if refund_status:
+            refunds = refunds.filter(status=refund_status)
+        
+        page = self.paginate_queryset(refunds)
+        if page is not None:
+            return self.get_paginated_response(RefundSerializer(page, many=True).data)
+        return Response(RefundSerializer(refunds, many=True).data)
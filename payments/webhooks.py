@@ -0,0 +1,289 @@
+# ===================================
+# payments/webhooks.py
+# ===================================
+
+"""
+File de traitement des webhooks PayDunya.
+
+L'endpoint webhook se contente d'enregistrer le contenu brut
+(`PaymentWebhook`) et de répondre; le traitement (paiement, commande) est
+fait ensuite par un pool de threads local (PAYMENT_WEBHOOKS['BACKEND'] =
+'thread'), inline ('sync') ou uniquement par la commande
+`process_webhooks` ('none'). Avec 'thread', les webhooks reportés ou en
+échec sont resoumis par le pool lui-même; avec 'sync' et 'none', seule la
+commande `process_webhooks --loop` les reprend.
+
+Chaque webhook est réservé par une mise à jour conditionnelle (bail de
+LEASE_SECONDS) avant traitement : deux workers ne traitent jamais la même
+ligne. En cas d'échec, il est reprogrammé avec un délai exponentiel et une
+part aléatoire, jusqu'à MAX_ATTEMPTS tentatives.
+
+Les copies d'un même webhook (même empreinte de contenu) sont écartées par
+une recherche indexée, à la réception puis avant traitement; les événements
+d'un même token sont appliqués dans l'ordre de réception, à travers le
+treillis de statuts de payments/transitions.py.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Payment, PaymentWebhook
+from .transitions import TRANSITIONS, transition_payment
+
+logger = logging.getLogger(__name__)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PAYMENT_WEBHOOKS', {}).get(name, default)
+
+
+class WebhookError(Exception):
+    """Webhook impossible à appliquer (réessayé plus tard)"""
+
+
+def backoff_delay(attempts):
+    """Délai avant la tentative suivante : exponentiel plafonné, avec gigue"""
+    base = _get_setting('BACKOFF_BASE', 2)
+    ceiling = _get_setting('BACKOFF_MAX', 600)
+    delay = min(ceiling, base ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def webhook_fingerprint(data):
+    """Empreinte du contenu (clés triées) : deux copies d'un même webhook ont la même"""
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()
+    ).hexdigest()
+
+
+def find_duplicate(fingerprint, exclude_id=None, processed=None):
+    """Id d'un webhook de même empreinte (recherche indexée), ou None"""
+    if not fingerprint:
+        return None
+    queryset = PaymentWebhook.objects.filter(fingerprint=fingerprint)
+    if exclude_id is not None:
+        queryset = queryset.exclude(id=exclude_id)
+    if processed is not None:
+        queryset = queryset.filter(processed=processed)
+    return queryset.values_list('id', flat=True).first()
+
+
+def apply_webhook(webhook):
+    """
+    Appliquer le statut reçu au paiement (et à la commande) via le treillis
+    de statuts; retourne l'id du paiement.
+    """
+    data = webhook.webhook_data
+    payment_id = Payment.objects.filter(
+        paydunya_token=data.get('token')
+    ).values_list('id', flat=True).first()
+    if payment_id is None:
+        raise WebhookError('Paiement non trouvé')
+
+    status_value = data.get('status')
+    if status_value in TRANSITIONS:
+        # Transition conditionnelle : sans effet si le statut est déjà atteint ou dépassé
+        transition_payment(payment_id, status_value, transaction_id=data.get('transaction_id'))
+    return payment_id
+
+
+def claim_webhook(webhook_id, now=None):
+    """Réserver un webhook dû; False s'il est déjà traité ou pris par un autre worker"""
+    now = now or timezone.now()
+    return PaymentWebhook.objects.filter(
+        id=webhook_id, processed=False, next_attempt_at__lte=now
+    ).update(
+        next_attempt_at=now + timedelta(seconds=_get_setting('LEASE_SECONDS', 60))
+    ) == 1
+
+
+def process_webhook(webhook_id):
+    """
+    Traiter un webhook réservé. Retourne 'processed', 'duplicate',
+    'deferred' (un événement antérieur du même token est en attente),
+    'retry', 'failed' (abandonné après MAX_ATTEMPTS) ou 'skipped' (non dû
+    ou déjà pris).
+    """
+    now = timezone.now()
+    if not claim_webhook(webhook_id, now):
+        return 'skipped'
+
+    webhook = PaymentWebhook.objects.get(id=webhook_id)
+    webhooks = PaymentWebhook.objects.filter(id=webhook_id)
+
+    # Copie d'un webhook déjà appliqué : clôturé sans toucher au paiement
+    original_id = find_duplicate(webhook.fingerprint, exclude_id=webhook_id, processed=True)
+    if original_id is not None:
+        webhooks.update(
+            processed=True, processed_at=timezone.now(),
+            processing_error=f'Doublon du webhook {original_id}', next_attempt_at=None
+        )
+        return 'duplicate'
+
+    # Les événements d'un même token sont appliqués dans l'ordre de réception
+    if webhook.token and PaymentWebhook.objects.filter(
+        token=webhook.token, processed=False, next_attempt_at__isnull=False, id__lt=webhook_id
+    ).exists():
+        webhooks.update(next_attempt_at=now + timedelta(seconds=_get_setting('ORDER_DELAY', 1)))
+        return 'deferred'
+
+    try:
+        payment_id = apply_webhook(webhook)
+    except Exception as e:
+        attempts = webhook.attempts + 1
+        abandoned = attempts >= _get_setting('MAX_ATTEMPTS', 8)
+        webhooks.update(
+            attempts=F('attempts') + 1,
+            processing_error=str(e),
+            next_attempt_at=None if abandoned else now + timedelta(seconds=backoff_delay(attempts)),
+        )
+        if not isinstance(e, WebhookError):
+            logger.exception("Échec du traitement du webhook %s", webhook_id)
+        return 'failed' if abandoned else 'retry'
+
+    webhooks.update(
+        payment_id=payment_id,
+        processed=True,
+        processed_at=timezone.now(),
+        processing_error='',
+        attempts=F('attempts') + 1,
+        next_attempt_at=None,
+    )
+    return 'processed'
+
+
+def due_webhook_ids(limit=100, now=None):
+    """Webhooks à traiter, les plus anciens d'abord"""
+    return list(
+        PaymentWebhook.objects.filter(
+            processed=False, next_attempt_at__lte=now or timezone.now()
+        ).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit]
+    )
+
+
+def _run(webhook_id):
+    try:
+        return process_webhook(webhook_id)
+    except Exception:
+        logger.exception("Échec du traitement du webhook %s", webhook_id)
+        return 'retry'
+    finally:
+        close_old_connections()
+
+
+def process_pending(batch_size=None, workers=None):
+    """Traiter un lot de webhooks dus avec au plus `workers` threads; retourne les compteurs"""
+    batch_size = batch_size or _get_setting('BATCH_SIZE', 100)
+    workers = workers or _get_setting('WORKERS', 4)
+    ids = due_webhook_ids(batch_size)
+
+    counts = {'processed': 0, 'duplicate': 0, 'deferred': 0, 'retry': 0, 'failed': 0, 'skipped': 0}
+    if not ids:
+        return counts
+    if workers == 1:
+        results = [process_webhook(webhook_id) for webhook_id in ids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook') as pool:
+            results = list(pool.map(_run, ids))
+    for result in results:
+        counts[result] += 1
+    return counts
+
+
+class WebhookQueue:
+    """
+    Pool de threads local à concurrence bornée. Un webhook reporté
+    ('deferred') ou à réessayer ('retry') est resoumis par un minuteur à son
+    `next_attempt_at` : le backend 'thread' n'a pas besoin de la commande
+    `process_webhooks` tant que le processus tourne.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._pool = None
+        self._timers = set()
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webhook')
+            return self._pool
+
+    def submit(self, webhook_id):
+        return self._get_pool().submit(self._process, webhook_id)
+
+    def _process(self, webhook_id):
+        try:
+            result = process_webhook(webhook_id)
+            if result in ('deferred', 'retry'):
+                self._reschedule(webhook_id)
+            return result
+        except Exception:
+            logger.exception("Échec du traitement du webhook %s", webhook_id)
+            # La ligne reste réservée : nouvel essai à l'expiration du bail
+            self.schedule(webhook_id, _get_setting('LEASE_SECONDS', 60))
+            return 'retry'
+        finally:
+            close_old_connections()
+
+    def _reschedule(self, webhook_id):
+        webhook = PaymentWebhook.objects.filter(
+            id=webhook_id, processed=False, next_attempt_at__isnull=False
+        ).values('token', 'next_attempt_at').first()
+        if webhook is None:
+            return
+        now = timezone.now()
+        self.schedule(webhook_id, (webhook['next_attempt_at'] - now).total_seconds())
+
+        # Un prédécesseur dû mais que personne ne traite (bail expiré) bloquerait ce token
+        if webhook['token']:
+            for predecessor_id in PaymentWebhook.objects.filter(
+                token=webhook['token'], processed=False, next_attempt_at__lte=now, id__lt=webhook_id
+            ).values_list('id', flat=True):
+                self.submit(predecessor_id)
+
+    def schedule(self, webhook_id, delay):
+        """Resoumettre un webhook après `delay` secondes"""
+        def fire():
+            with self._lock:
+                self._timers.discard(timer)
+            self.submit(webhook_id)
+
+        # Petite marge : le minuteur ne doit pas partir avant l'échéance enregistrée
+        timer = threading.Timer(max(delay, 0) + 0.05, fire)
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+webhook_queue = WebhookQueue(workers=_get_setting('WORKERS', 4))
+atexit.register(webhook_queue.shutdown)
+
+
+def enqueue_webhook(webhook_id):
+    """Programmer le traitement d'un webhook enregistré, selon le backend configuré"""
+    backend = _get_setting('BACKEND', 'thread')
+    if backend == 'sync':
+        transaction.on_commit(lambda: process_webhook(webhook_id))
+    elif backend == 'thread':
+        transaction.on_commit(lambda: webhook_queue.submit(webhook_id))
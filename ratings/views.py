@@ -7,6 +7,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db.models import Avg
+from RestoOnline.idempotency import idempotent
 from .models import DeliveryRating, MenuItemRating
 from .serializers import (
     DeliveryRatingSerializer, DeliveryRatingCreateSerializer,
@@ -50,6 +51,7 @@ class DeliveryRatingViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         """Créer une note de livraison"""
         from orders.models import Order
@@ -173,6 +175,7 @@ class MenuItemRatingViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         """Créer une note de plat"""
         from orders.models import Order, OrderItem
@@ -284,6 +287,7 @@ class MenuItemRatingViewSet(viewsets.ModelViewSet):
         })
     
     @action(detail=False, methods=['post'])
+    @idempotent
     def rate_order_items(self, request):
         """Noter plusieurs plats d'une commande en une fois"""
         from orders.models import Order